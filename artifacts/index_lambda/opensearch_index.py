@@ -1,46 +1,44 @@
+from coldstart import COLD_START
+
+# time every import below, the breakdown is logged with the first invocation
+COLD_START.start_import_profiling()
 from decimal import Decimal
 import json
-import boto3
-import requests
-from requests_aws4auth import AWS4Auth
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import NotFoundError
 from os import getenv
 import logging
 import uuid
 from datetime import datetime, timedelta
+from opensearch_clients import LazyClient, get_bedrock_client, get_opensearch_client, get_s3_client
+from embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_PROVIDER, create_embedding_provider
+from vector_projection import VECTOR_DIMENSIONS, VECTOR_PROJECTION
+from search_pipelines import FUSION_STRATEGIES, pipeline_body, pipeline_id
+from facet_snapshots import FACET_SNAPSHOT_SEARCHES, snapshot_id
+COLD_START.stop_import_profiling()
 
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
-credentials = boto3.Session().get_credentials()
-print(boto3.__version__)
-ENDPOINT = getenv("OPENSEARCH_HOST", "default")
-SERVICE = "es"  # aoss for Amazon Opensearch serverless
-REGION = getenv("AWS_REGION", "us-east-1")
 S3_BUCKET = getenv("S3_BUCKET_NAME", "default")
-SEARCH_PIPELINE_NAME = getenv("SEARCH_PIPELINE_NAME", "oss_srch_pipeline")
-awsauth = AWS4Auth(
-    credentials.access_key,
-    credentials.secret_key,
-    REGION,
-    SERVICE,
-    session_token=credentials.token,
-)
 INDEX_NAME = getenv("INDEX_NAME", "products")
 VECTOR_INDEX_NAME_ON_DISK = getenv("VECTOR_INDEX_NAME_ON_DISK", "products_vectorized_on_disk")
 VECTOR_INDEX_NAME_IN_MEMORY = getenv("VECTOR_INDEX_NAME_IN_MEMORY", "products_vectorized_in_memory")
+VECTOR_INDEX_NAME_INT8 = getenv("VECTOR_INDEX_NAME_INT8", "products_vectorized_int8")
+VECTOR_INDEX_NAME_BINARY = getenv("VECTOR_INDEX_NAME_BINARY", "products_vectorized_binary")
+VECTOR_INDEX_NAME_FP16 = getenv("VECTOR_INDEX_NAME_FP16", "products_vectorized_fp16")
+# Vector indices vectorize_and_index_products creates and loads, comma separated.
+# fp16 reuses the float vectors, int8 and binary are opt-in as they re-embed the
+# whole catalog, since the stored vectors are floats
+VECTOR_INDEX_MODES = [mode.strip() for mode in getenv("VECTOR_INDEX_MODES", "on_disk,in_memory,fp16").split(",") if mode.strip()]
 MODEL_ID = getenv("MODEL_ID", "cohere.embed-english-v3")
+GENERATION_INDEX_NAME = getenv("GENERATION_INDEX_NAME", "products_generation")
+FACET_SNAPSHOT_INDEX_NAME = getenv("FACET_SNAPSHOT_INDEX_NAME", "products_facets")
+FACET_SNAPSHOTS_ENABLED = getenv("FACET_SNAPSHOTS_ENABLED", "true").lower() == "true"
 
-ops_client = OpenSearch(
-    hosts=[{"host": ENDPOINT, "port": 443}],
-    http_auth=awsauth,
-    use_ssl=True,
-    verify_certs=True,
-    connection_class=RequestsHttpConnection,
-    timeout=300,
-)
-
-s3_client = boto3.client('s3')
-bedrock_client = boto3.client('bedrock-runtime', region_name=REGION, endpoint_url=f"https://bedrock-runtime.{REGION}.amazonaws.com")
+# Pooled clients shared through the opensearch_clients layer, created on first use
+ops_client = LazyClient(get_opensearch_client)
+s3_client = LazyClient(get_s3_client)
+bedrock_client = LazyClient(get_bedrock_client)
+embedding_provider = create_embedding_provider(bedrock_client=bedrock_client)
 
 def generate_presigned_url(event):
     """
@@ -85,26 +83,36 @@ def create_index():
                         "type": "text",
                         "analyzer": "stop",
                         "fields": {
-                            "keyword": {"type": "keyword"}
+                            # facet field, build global ordinals at refresh instead of on the first aggregation
+                            "keyword": {"type": "keyword", "eager_global_ordinals": True},
+                            "wildcard": {"type": "wildcard"}
                         }
                     },
                     "color": {
                         "type": "text",
                         "analyzer": "stop",
                         "fields": {
-                            "keyword": {"type": "keyword"}
+                            "keyword": {"type": "keyword", "eager_global_ordinals": True},
+                            "wildcard": {"type": "wildcard"}
                         }
                     },
                     "title": {
                         "type": "text",
                         "analyzer": "stop",
                         "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
+                            "keyword": {"type": "keyword"},
+                            "wildcard": {"type": "wildcard"}
+                        },
+                        "copy_to": "title_suggest"
                     },
+                    # shingle and edge-ngram subfields backing the /suggest typeahead
+                    "title_suggest": {"type": "search_as_you_type"},
                     "description": {
                         "type": "text",
                         "analyzer": "stop",
+                        "fields": {
+                            "wildcard": {"type": "wildcard"}
+                        }
                     },
                     "price": {"type": "float"},
                     "file_name": {"type": "text"}
@@ -117,12 +125,92 @@ def create_index():
         return failure_response(f'Error creating index. {e.info["error"]["reason"]}')
     return success_response("Index created successfully")
 
-def bulk_index_documents(documents):
+
+def create_facet_snapshot_index():
+    """
+    Creates the index holding precomputed facet aggregation results if it doesn't exist.
+    Results are stored as opaque objects so they never grow the mapping.
+    """
+    try:
+        # 400 is resource_already_exists_exception once the first load created it
+        res = ops_client.indices.create(index=FACET_SNAPSHOT_INDEX_NAME, ignore=[400], body={
+            "mappings": {
+                "properties": {
+                    "index": {"type": "keyword"},
+                    "generation": {"type": "keyword"},
+                    "result": {"type": "object", "enabled": False}
+                }
+            }
+        })
+        LOG.info(f"method=create_facet_snapshot_index, create_response={res}")
+    except Exception as e:
+        LOG.error(f"method=create_facet_snapshot_index, error={e}")
+        return failure_response(f'Error creating facet snapshot index. {e}')
+    return success_response("Facet snapshot index created successfully")
+
+
+def precompute_facet_snapshots(index_name, generation):
+    """
+    Computes every FACET_SNAPSHOT_SEARCHES aggregation against the newly loaded
+    contents of index_name, so the facet sidebar is served without an aggregation
+    pass right after a load.
+
+    Args:
+        index_name (str): The index that was just loaded
+        generation (str): The generation token the load was published under
+    """
+    if not FACET_SNAPSHOTS_ENABLED:
+        return
+    try:
+        for search_body in FACET_SNAPSHOT_SEARCHES:
+            result = ops_client.search(index=index_name, body=search_body)
+            ops_client.index(index=FACET_SNAPSHOT_INDEX_NAME, id=snapshot_id(index_name, search_body), body={
+                "index": index_name,
+                "generation": generation,
+                "result": result
+            })
+        LOG.info(f"method=precompute_facet_snapshots, index={index_name}, snapshots={len(FACET_SNAPSHOT_SEARCHES)}")
+    except Exception as e:
+        LOG.error(f"method=precompute_facet_snapshots, index={index_name}, error={e}")
+
+
+def bump_index_generation(index_name):
+    """
+    Records a new generation token for index_name so search Lambdas drop any
+    results they cached against its previous contents.
+
+    Callers make the loaded documents searchable first, so a search that reads the
+    new token can only ever see (and cache) them. The token needs no refresh, search
+    Lambdas read it with a realtime mget.
+
+    Args:
+        index_name (str): The index that was loaded or deleted
+
+    Returns:
+        dict: Response object whose result is the new generation token, or a failure
+    """
+    generation = uuid.uuid4().hex
+    try:
+        res = ops_client.index(
+            index=GENERATION_INDEX_NAME,
+            id=index_name,
+            body={"generation": generation, "updated_at": datetime.utcnow().isoformat()},
+        )
+        LOG.info(f"method=bump_index_generation, index={index_name}, response={res}")
+    except Exception as e:
+        LOG.error(f"method=bump_index_generation, index={index_name}, error={e}")
+        return failure_response(f"Error bumping generation for {index_name}. {e}")
+    return success_response(generation)
+
+
+def bulk_index_documents(documents, precompute_facets=False):
     """
     Bulk indexes multiple documents into OpenSearch.
 
     Args:
         documents (list): List of document dictionaries to be indexed
+        precompute_facets (bool): Whether to recompute the facet snapshots afterwards,
+                                  for full catalog loads
 
     Returns:
         dict: Response object indicating success or failure
@@ -133,6 +221,14 @@ def bulk_index_documents(documents):
     
     bulk_data = []
     for doc in documents:
+        # Process in batches of 500, the last one is sent below
+        if len(bulk_data) >= 1000:
+            response = ops_client.bulk(body=bulk_data)
+            if response.get("errors"):
+                # earlier batches are already visible, cached results are stale either way
+                bump_index_generation(INDEX_NAME)
+                return failure_response(f"Bulk indexing errors: {response}")
+            bulk_data = []
         # Add index action
         bulk_data.append(
             {"index": {"_index": INDEX_NAME, "_id": f"{uuid.uuid4().hex}"}}
@@ -141,18 +237,19 @@ def bulk_index_documents(documents):
         if 'vector_embedding' in doc:
             del doc['vector_embedding']
         bulk_data.append(doc)
-        # Process in batches of 500
-        if len(bulk_data) >= 1000:
-            response = ops_client.bulk(body=bulk_data)
-            if response.get("errors"):
-                return failure_response(f"Bulk indexing errors: {response}")
-            bulk_data = []
 
-    # Index any remaining documents
+    # Index the remaining documents, waiting for the next scheduled refresh rather
+    # than forcing one, so every batch is searchable before the generation is bumped
     if bulk_data:
-        response = ops_client.bulk(body=bulk_data)
+        response = ops_client.bulk(body=bulk_data, refresh="wait_for")
         if response.get("errors"):
+            bump_index_generation(INDEX_NAME)
             return failure_response(f"Bulk indexing errors: {response}")
+    res = bump_index_generation(INDEX_NAME)
+    if not res["success"]:
+        return res
+    if precompute_facets:
+        precompute_facet_snapshots(INDEX_NAME, res["result"])
     return success_response("Products indexed successfully")
 
 
@@ -166,19 +263,31 @@ def index_products(event):
               Failure format: {"statusCode": "500", "message": error_message}
     """
     LOG.debug(f"method=index_products, event={event}")
-    product_list = []
-    with open("products_content.jsonl", "r") as json_file:
-        product_list = json.load(json_file)
-        LOG.debug(f"method=index_products, product_list={product_list}")
+    product_list = read_products()
+    LOG.debug(f"method=index_products, product_list={product_list}")
 
     if len(product_list) > 0:
-        return bulk_index_documents(product_list)
+        if FACET_SNAPSHOTS_ENABLED:
+            create_facet_snapshot_index()
+        return bulk_index_documents(product_list, precompute_facets=True)
     else:
         err_msg = "No products to index"
         LOG.error(f"method=index_products, error=" + err_msg)
         return {"statusCode": "500", "message": err_msg}
 
 
+def read_products(file_path="products_content.jsonl"):
+    """
+    Reads the product catalog, stored either as a JSON array or as NDJSON with one
+    product per line, the format generate_product_images_vectors.py writes.
+    """
+    with open(file_path, "r") as json_file:
+        content = json_file.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
 def index_custom_document(event):
     """
     Indexes a single custom document into OpenSearch.
@@ -217,97 +326,109 @@ def delete_index(event):
     except Exception as e:
         LOG.error(f"method=delete_index, error={e.info['error']['reason']}")
         return failure_response(f'Error deleting index. {e.info["error"]["reason"]}')
+    res = bump_index_generation(INDEX_NAME)
+    if not res["success"]:
+        return res
     return success_response("Index deleted successfully")
 
 
-def search_nlp():
+def register_search_pipelines():
+    """
+    Registers the hybrid search pipeline of every FUSION_STRATEGIES strategy that
+    isn't registered yet. Pipeline ids are versioned, so one that exists is never
+    overwritten and running again only costs the lookup.
+    """
     try:
-        post_processor_search_pipleline = {
-            "description": "Post processor for hybrid search",
-            "phase_results_processors": [ {
-                "normalization-processor": {
-                    "normalization": {
-                        "technique": "min_max"
-                    },
-                        "combination": {
-                            "technique": "arithmetic_mean",
-                            "parameters": {
-                                "weights": [0.7,0.3]
-                            }
-                        }
-                    }
-                }
-            ]
-        }
-        headers = {'Content-Type': 'application/json'}
-        response = requests.put(f"https://{ENDPOINT}/_search/pipeline/{SEARCH_PIPELINE_NAME}", auth=awsauth, json=post_processor_search_pipleline,
-                     headers=headers, verify=False)
-        LOG.info(f"method=search_nlp, message={SEARCH_PIPELINE_NAME} created, response={response.text}")
-        return success_response(f"Post processor search pipeline {SEARCH_PIPELINE_NAME} created successfully")
+        try:
+            registered = ops_client.transport.perform_request("GET", "/_search/pipeline")
+        except NotFoundError:
+            registered = {}
+        missing = [strategy for strategy in FUSION_STRATEGIES if pipeline_id(strategy) not in registered]
+        for strategy in missing:
+            response = ops_client.transport.perform_request(
+                "PUT", f"/_search/pipeline/{pipeline_id(strategy)}", body=pipeline_body(strategy)
+            )
+            LOG.info(f"method=register_search_pipelines, pipeline={pipeline_id(strategy)}, response={response}")
+        LOG.info(f"method=register_search_pipelines, registered={len(missing)}, existing={len(FUSION_STRATEGIES) - len(missing)}")
+        return success_response(f"Search pipelines registered: {', '.join(pipeline_id(strategy) for strategy in missing) or 'none missing'}")
     except Exception as e:
-        LOG.error(f"method=search_nlp, error={e}")
-        return failure_response(f'Error creating post processor search pipeline. {e}')
+        LOG.error(f"method=register_search_pipelines, error={e}")
+        return failure_response(f'Error registering hybrid search pipelines. {e}')
+
+
+def register_search_pipelines_resource(event):
+    """
+    Runs register_search_pipelines for the stack's custom resource. Deleting the
+    resource leaves the pipelines in place, as running Lambdas may still use them.
+
+    Raises:
+        RuntimeError: If registration failed, so the custom resource fails the deploy
+    """
+    if event.get("RequestType") == "Delete":
+        return {}
+    result = register_search_pipelines()
+    if not result["success"]:
+        raise RuntimeError(result["errorMessage"])
+    return result
+
+
+def vector_index_body(vector_embedding):
+    """
+    Returns the settings and mappings of a vector index whose vector_embedding
+    field is mapped as given.
+    """
+    text_with_keyword = {
+        "type": "text",
+        "analyzer": "stop",
+        "fields": {
+            "keyword": {"type": "keyword"}
+        }
+    }
+    return {
+        "settings": {
+            "index": {
+                "knn": True,
+                "knn.algo_param.ef_search": 100
+            }
+        },
+        "mappings": {
+            "properties": {
+                "category": text_with_keyword,
+                "color": text_with_keyword,
+                "title": text_with_keyword,
+                "description": {
+                    "type": "text",
+                    "analyzer": "stop",
+                },
+                "price": {"type": "float"},
+                "file_name": {"type": "text"},
+                "vector_embedding": vector_embedding
+            }
+        }
+    }
+
 
 def create_vector_index_on_disk_mode():
     """
     Creates the OpenSearch index for vectorized products if it doesn't exist.
     """
     try:
-        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_ON_DISK, body={
-            "settings": {
-                "index": {
-                    "knn": True,
-                    "knn.algo_param.ef_search": 100
-                }
-            },
-            "mappings": {
-                "properties": {
-                    "category": {
-                        "type": "text",
-                        "analyzer": "stop",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "color": {
-                        "type": "text",
-                        "analyzer": "stop",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "title": {
-                        "type": "text",
-                        "analyzer": "stop",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "description": {
-                        "type": "text",
-                        "analyzer": "stop",
-                    },
-                    "price": {"type": "float"},
-                    "file_name": {"type": "text"},
-                    "vector_embedding": {
-                        "type": "knn_vector",
-                        "dimension": 1024,
-                        "data_type": "float",
-                        "mode": "on_disk",
-                        "compression_level": "32x", # default is 32x
-                        "method": {
-                            "name":"hnsw",
-                            "engine":"faiss",
-                            "space_type": "innerproduct",
-                            "parameters": {
-                                "ef_construction": 128,
-                                "m": 24
-                          }
-                        }
-                    }
+        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_ON_DISK, body=vector_index_body({
+            "type": "knn_vector",
+            "dimension": VECTOR_DIMENSIONS,
+            "data_type": "float",
+            "mode": "on_disk",
+            "compression_level": "32x", # default is 32x
+            "method": {
+                "name": "hnsw",
+                "engine": "faiss",
+                "space_type": "innerproduct",
+                "parameters": {
+                    "ef_construction": 128,
+                    "m": 24
                 }
             }
-        })
+        }))
         LOG.info(f"method=create_vector_index, create_response={res}")
     except Exception as e:
         LOG.error(f"method=create_vector_index_on_disk_mode, error={e.info['error']['reason']}")
@@ -320,58 +441,19 @@ def create_vector_index_in_memory_mode():
     Creates the OpenSearch index for vectorized products if it doesn't exist.
     """
     try:
-        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_IN_MEMORY, body={
-            "settings": {
-                "index": {
-                    "knn": True,
-                    "knn.algo_param.ef_search": 100
-                }
-            },
-            "mappings": {
-                "properties": {
-                    "category": {
-                        "type": "text",
-                        "analyzer": "stop",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "color": {
-                        "type": "text",
-                        "analyzer": "stop",
-                        "fields": {   
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "title": {
-                        "type": "text",
-                        "analyzer": "stop",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "description": {
-                        "type": "text",
-                        "analyzer": "stop",
-                    },
-                    "price": {"type": "float"},
-                    "file_name": {"type": "text"},
-                    "vector_embedding": {
-                        "type": "knn_vector",
-                        "dimension": 1024,
-                        "method": {
-                            "name":"hnsw",
-                            "engine":"faiss",
-                            "space_type": "innerproduct",
-                            "parameters": {
-                                "ef_construction": 128,
-                                "m": 24
-                          }
-                        }
-                    }
+        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_IN_MEMORY, body=vector_index_body({
+            "type": "knn_vector",
+            "dimension": VECTOR_DIMENSIONS,
+            "method": {
+                "name": "hnsw",
+                "engine": "faiss",
+                "space_type": "innerproduct",
+                "parameters": {
+                    "ef_construction": 128,
+                    "m": 24
                 }
             }
-        })
+        }))
         LOG.info(f"method=create_vector_index_in_memory_mode, create_response={res}")
     except Exception as e:
         LOG.error(f"method=create_vector_index_in_memory_mode, error={e.info['error']['reason']}")
@@ -379,29 +461,122 @@ def create_vector_index_in_memory_mode():
     return success_response("Vector index created successfully with in-memory mode")
 
 
-def get_embedding(text):
+def create_vector_index_fp16_mode():
     """
-    Gets embedding for text using Cohere model via Bedrock.
+    Creates the vector index that stores float vectors as fp16 with the faiss
+    scalar quantizer, half the memory of the in-memory mode at nearly its recall,
+    between it and the 32x compressed on-disk mode.
     """
     try:
-        body = json.dumps({
-            "texts": [text],
-            "input_type": "search_document",
-            "truncate": "END",
-            "embedding_types": ["float"]
-        })
-        LOG.info(f"method=get_embedding, body={body}")
-        response = bedrock_client.invoke_model(
-            modelId=MODEL_ID,
-            accept='application/json',
-            contentType='application/json',
-            body=body
-        )
-        LOG.info(f"method=get_embedding, response={response}")
-        response_body = json.loads(response.get('body').read())
-        return response_body['embeddings']['float'][0]
+        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_FP16, body=vector_index_body({
+            "type": "knn_vector",
+            "dimension": VECTOR_DIMENSIONS,
+            "method": {
+                "name": "hnsw",
+                "engine": "faiss",
+                "space_type": "innerproduct",
+                "parameters": {
+                    "encoder": {
+                        "name": "sq",
+                        "parameters": {
+                            "type": "fp16",
+                            # unit length embeddings are within fp16 range, fail loudly if not
+                            "clip": False
+                        }
+                    },
+                    "ef_construction": 128,
+                    "m": 24
+                }
+            }
+        }))
+        LOG.info(f"method=create_vector_index_fp16_mode, create_response={res}")
+    except Exception as e:
+        LOG.error(f"method=create_vector_index_fp16_mode, error={e.info['error']['reason']}")
+        return failure_response(f'Error creating vector index with fp16 mode. {e.info["error"]["reason"]}')
+    return success_response("Vector index created successfully with fp16 mode")
+
+
+def create_vector_index_int8_mode():
+    """
+    Creates the vector index for the int8 embeddings Cohere returns natively,
+    stored as byte vectors at a quarter of the memory of float vectors. They are
+    indexed at the full EMBEDDING_DIMENSIONS, VECTOR_PROJECTION_FILE only applies
+    to float vectors.
+    """
+    try:
+        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_INT8, body=vector_index_body({
+            "type": "knn_vector",
+            "dimension": EMBEDDING_DIMENSIONS,
+            "data_type": "byte",
+            "method": {
+                "name": "hnsw",
+                "engine": "faiss",
+                "space_type": "innerproduct",
+                "parameters": {
+                    "ef_construction": 128,
+                    "m": 24
+                }
+            }
+        }))
+        LOG.info(f"method=create_vector_index_int8_mode, create_response={res}")
     except Exception as e:
-        LOG.error(f"Error getting embedding: {str(e)}")
+        LOG.error(f"method=create_vector_index_int8_mode, error={e.info['error']['reason']}")
+        return failure_response(f'Error creating vector index with int8 mode. {e.info["error"]["reason"]}')
+    return success_response("Vector index created successfully with int8 mode")
+
+
+def create_vector_index_binary_mode():
+    """
+    Creates the vector index for the binary embeddings Cohere returns natively,
+    one bit per dimension at a 32nd of the memory of float vectors, ranked by
+    Hamming distance. The dimension is in bits, each vector holds an eighth as many
+    bytes.
+    """
+    try:
+        res = ops_client.indices.create(index=VECTOR_INDEX_NAME_BINARY, body=vector_index_body({
+            "type": "knn_vector",
+            "dimension": EMBEDDING_DIMENSIONS,
+            "data_type": "binary",
+            "method": {
+                "name": "hnsw",
+                "engine": "faiss",
+                "space_type": "hamming",
+                "parameters": {
+                    "ef_construction": 128,
+                    "m": 24
+                }
+            }
+        }))
+        LOG.info(f"method=create_vector_index_binary_mode, create_response={res}")
+    except Exception as e:
+        LOG.error(f"method=create_vector_index_binary_mode, error={e.info['error']['reason']}")
+        return failure_response(f'Error creating vector index with binary mode. {e.info["error"]["reason"]}')
+    return success_response("Vector index created successfully with binary mode")
+
+
+# vector index mode -> (index name, function creating it, embedding type its documents hold)
+VECTOR_INDICES = {
+    "on_disk": (VECTOR_INDEX_NAME_ON_DISK, create_vector_index_on_disk_mode, "float"),
+    "in_memory": (VECTOR_INDEX_NAME_IN_MEMORY, create_vector_index_in_memory_mode, "float"),
+    "fp16": (VECTOR_INDEX_NAME_FP16, create_vector_index_fp16_mode, "float"),
+    "int8": (VECTOR_INDEX_NAME_INT8, create_vector_index_int8_mode, "int8"),
+    "binary": (VECTOR_INDEX_NAME_BINARY, create_vector_index_binary_mode, "binary"),
+}
+
+
+def get_embeddings(texts, embedding_types=("float",)):
+    """
+    Gets document embeddings for texts from the EMBEDDING_PROVIDER, Cohere via
+    Bedrock by default, in as few calls as the provider allows.
+
+    Returns:
+        dict: Embedding type to one vector per text, for each of embedding_types
+    """
+    try:
+        LOG.info(f"method=get_embeddings, provider={embedding_provider.name}, texts={len(texts)}, types={','.join(embedding_types)}")
+        return embedding_provider.embed_types(texts, "search_document", embedding_types)
+    except Exception as e:
+        LOG.error(f"Error getting embeddings: {str(e)}")
         raise e
 
 def vectorize_and_index_products(event):
@@ -410,105 +585,122 @@ def vectorize_and_index_products(event):
     """
     try:
         # Read products from file
-        product_list = []
-        with open("products_content.jsonl", "r") as json_file:
-            product_list = json.load(json_file)
+        product_list = read_products()
         
         if not product_list:
             return failure_response("No products to index")
         
-        LOG.info("method=vectorize_and_index_products, creating search pipeline")
-        res=search_nlp()
+        # normally done at deploy time, only looked up here
+        LOG.info("method=vectorize_and_index_products, registering search pipelines")
+        res=register_search_pipelines()
         if not res['success']:
             return failure_response(res['errorMessage'])
         
-        # Create vector index with on-disk and in-memory modes
-        LOG.info("method=vectorize_and_index_products, creating vector index with on-disk")
-        res=create_vector_index_on_disk_mode()
-        if not res['success'] and "already exists" not in res['errorMessage']:
-            return failure_response(res['errorMessage'])
+        unknown_modes = [mode for mode in VECTOR_INDEX_MODES if mode not in VECTOR_INDICES]
+        if unknown_modes:
+            return failure_response(f"Unknown VECTOR_INDEX_MODES {unknown_modes}, use {', '.join(VECTOR_INDICES)}")
 
-        LOG.info("method=vectorize_and_index_products, creating vector index with in-memory")
-        res=create_vector_index_in_memory_mode()
-        if not res['success'] and "already exists" not in res['errorMessage']:
-            return failure_response(res['errorMessage'])
+        for mode in VECTOR_INDEX_MODES:
+            LOG.info(f"method=vectorize_and_index_products, creating vector index with {mode} mode")
+            res = VECTOR_INDICES[mode][1]()
+            if not res['success'] and "already exists" not in res['errorMessage']:
+                return failure_response(res['errorMessage'])
 
         LOG.info("method=vectorize_and_index_products, vectorizing and indexing products")
-    
+        # int8 and binary vectors come from the embedding model, so every product is
+        # embedded for them, in the same call as any float vectors it needs
+        quantized_types = sorted({VECTOR_INDICES[mode][2] for mode in VECTOR_INDEX_MODES} - {"float"})
 
         # Process products in batches
         batch_size = 20  # Smaller batch size due to embedding API calls
         for i in range(0, len(product_list), batch_size):
             batch = product_list[i:i + batch_size]
-            bulk_data_on_disk = []
-            bulk_data_in_memory = []
             
-            for product in batch:
-                if MODEL_ID != 'cohere.embed-english-v3':
-                    # Combine relevant fields
-                    combined_text = f"{product.get('title', '')}, Category: {product.get('category', '')}, Description: {product.get('description', '')}"
-                
-                    LOG.info(f"method=vectorize_and_index_products, combined_text={combined_text}")
-                    # Get embedding
-                    vector_embedding = get_embedding(combined_text)
-                    LOG.info(f"method=vectorize_and_index_products, vector_embedding={len(vector_embedding)}")
-                    # Add vector field to product
-                    # product['combined_text'] = combined_text
-                    product['vector_embedding'] = vector_embedding
-                
-                # else the vector_embeddings using cohere are already generated and are present in the json file
-                # no need to regenerate
-
-                # Add to bulk data
-                bulk_data_on_disk.append({
-                    "index": {
-                        "_index": VECTOR_INDEX_NAME_ON_DISK,
-                        "_id": f"{uuid.uuid4().hex}"
-                    }
-                })
-                bulk_data_on_disk.append(product)
-
-                bulk_data_in_memory.append({
-                    "index": {
-                        "_index": VECTOR_INDEX_NAME_IN_MEMORY,
-                        "_id": f"{uuid.uuid4().hex}"
-                    }
-                })
-                bulk_data_in_memory.append(product)
-
-            # Index batch
-            if bulk_data_on_disk:
-                LOG.info(f"method=vectorize_and_index_products, bulk_data_on_disk={len(bulk_data_on_disk)}")
-                response = ops_client.bulk(body=bulk_data_on_disk)
-                if response.get("errors"):
-                    return failure_response(f"Bulk indexing errors: {response}")
-            if bulk_data_in_memory:
-                LOG.info(f"method=vectorize_and_index_products, bulk_data_in_memory={len(bulk_data_in_memory)}")
-                response = ops_client.bulk(body=bulk_data_in_memory)
-                if response.get("errors"):
-                    return failure_response(f"Bulk indexing errors: {response}")
+            # products_content.jsonl carries Cohere vectors, reuse them unless another
+            # model or provider is configured, whose vectors would not be comparable
+            reuse_vectors = MODEL_ID == 'cohere.embed-english-v3' and EMBEDDING_PROVIDER == "bedrock"
+            needs_float = [
+                not reuse_vectors or "vector_embedding" not in product
+                for product in batch
+            ]
+            to_embed = [
+                position for position, product in enumerate(batch)
+                if needs_float[position] or quantized_types
+            ]
+            # position in batch -> embedding type -> vector
+            vectors = {position: {} for position in range(len(batch))}
+            if to_embed:
+                combined_texts = [
+                    f"{batch[position].get('title', '')}, Category: {batch[position].get('category', '')}, Description: {batch[position].get('description', '')}"
+                    for position in to_embed
+                ]
+                embedding_types = (["float"] if any(needs_float) else []) + quantized_types
+                embeddings = get_embeddings(combined_texts, embedding_types)
+                for offset, position in enumerate(to_embed):
+                    for embedding_type in embedding_types:
+                        vectors[position][embedding_type] = embeddings[embedding_type][offset]
+                LOG.info(f"method=vectorize_and_index_products, embedded={len(to_embed)}")
+
+            for position, product in enumerate(batch):
+                if needs_float[position]:
+                    product['vector_embedding'] = vectors[position]['float']
+                # the float index dimension follows the projection, see VECTOR_PROJECTION_FILE
+                product['vector_embedding'] = VECTOR_PROJECTION.project(product['vector_embedding'])
+                vectors[position]['float'] = product['vector_embedding']
+
+            for mode in VECTOR_INDEX_MODES:
+                index_name, _, embedding_type = VECTOR_INDICES[mode]
+                bulk_data = []
+                for position, product in enumerate(batch):
+                    bulk_data.append({
+                        "index": {
+                            "_index": index_name,
+                            "_id": f"{uuid.uuid4().hex}"
+                        }
+                    })
+                    bulk_data.append({**product, "vector_embedding": vectors[position][embedding_type]})
+
+                # Index batch
+                if bulk_data:
+                    LOG.info(f"method=vectorize_and_index_products, mode={mode}, bulk_data={len(bulk_data)}")
+                    response = ops_client.bulk(body=bulk_data)
+                    if response.get("errors"):
+                        return failure_response(f"Bulk indexing errors: {response}")
         
         return success_response("Products vectorized and indexed successfully")
         
     except Exception as e:
         LOG.error(f"Error in vectorize_and_index_products: {str(e)}")
         return failure_response(f"Error vectorizing and indexing products: {str(e)}")
+    finally:
+        # partial loads change search results too, so always invalidate, once the
+        # loaded vectors are searchable
+        for mode in VECTOR_INDEX_MODES:
+            if mode in VECTOR_INDICES:
+                ops_client.indices.refresh(index=VECTOR_INDICES[mode][0], ignore=[404])
+                bump_index_generation(VECTOR_INDICES[mode][0])
 
 def delete_vector_index(event):
     """
-    Deletes both vector indices.
+    Deletes the vector indices of every mode, ignoring those that don't exist.
     """
     try:
-        # Delete on-disk index
-        ops_client.indices.delete(index=VECTOR_INDEX_NAME_ON_DISK)
-        # Delete in-memory index
-        ops_client.indices.delete(index=VECTOR_INDEX_NAME_IN_MEMORY)
+        for index_name, _, _ in VECTOR_INDICES.values():
+            ops_client.indices.delete(index=index_name, ignore=[404])
+            bump_index_generation(index_name)
         return success_response("Vector indices deleted successfully")
     except Exception as e:
         LOG.error(f"Error deleting vector indices: {str(e)}")
         return failure_response(f"Error deleting vector indices: {str(e)}")
 
 def handler(event, context):
+    # invoked by the stack's custom resource provider on every deploy that changes the
+    # pipelines, with the action in ResourceProperties, or directly with it at the top level
+    if event.get("ResourceProperties", event).get("action") == "register_search_pipelines":
+        try:
+            return register_search_pipelines_resource(event)
+        finally:
+            COLD_START.flush()
     if "httpMethod" in event:
         api_map = {
             "POST/index": lambda x: index_products(x),
@@ -531,6 +723,8 @@ def handler(event, context):
         except Exception:
             LOG.exception(f"error=error_processing_api, api={api_path}")
             return respond(failure_response("system_exception"), None)
+        finally:
+            COLD_START.flush()
 
 
 def failure_response(error_message):
@@ -566,8 +760,8 @@ def respond(err, res=None):
     }
 
 
-# Test case for get_embedding
-# resp = get_embedding("Sleek Grey and Blue Womens Running Shoes, Category: women, Description: Experience ultimate comfort and performance with our stylish grey and blue running shoe. Designed with breathable mesh and advanced cushioning technology, these shoes will keep your feet cool and supported during your longest runs. The vibrant blue accents add a touch of flair to your workout attire.")
+# Test case for get_embeddings
+# resp = get_embeddings(["Sleek Grey and Blue Womens Running Shoes, Category: women, Description: Experience ultimate comfort and performance with our stylish grey and blue running shoe. Designed with breathable mesh and advanced cushioning technology, these shoes will keep your feet cool and supported during your longest runs. The vibrant blue accents add a touch of flair to your workout attire."])
 # print(resp)
 # print(len(resp))
 
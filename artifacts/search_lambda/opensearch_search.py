@@ -1,53 +1,97 @@
+from coldstart import COLD_START
+
+# time every import below, the breakdown is logged with the first invocation
+COLD_START.start_import_profiling()
 from decimal import Decimal
+from functools import lru_cache
 import json
-import boto3
-import requests
-from requests_aws4auth import AWS4Auth
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import NotFoundError
 from os import getenv
 import logging
+import time
 import uuid
 from botocore.exceptions import ClientError
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, cache_key
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_ENABLED, split_query_vector
+from search_templates import template_id, template_script
+from search_profile import condense_profile, profiled_request
+from slow_queries import SLOW_QUERIES
+from stage_timings import STAGE_TIMINGS
+from opensearch_clients import LazyClient, get_bedrock_client, get_opensearch_client, get_s3_client
+from embeddings import create_embedding_provider
+from vector_projection import VECTOR_PROJECTION
+from image_renditions import IMAGE_PREFIX, rendition_key, rendition_size
+from search_pipelines import candidate_depth, fusion_strategy, pipeline_id
+from facet_snapshots import is_precomputed, snapshot_id
+COLD_START.stop_import_profiling()
 
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
-credentials = boto3.Session().get_credentials()
 
-ENDPOINT = getenv("OPENSEARCH_HOST", "default")
-SERVICE = "es"  # aoss for Amazon Opensearch serverless
-REGION = getenv("AWS_REGION", "us-east-1")
 S3_BUCKET_NAME = getenv("S3_BUCKET_NAME")
-SEARCH_PIPELINE_NAME = getenv("SEARCH_PIPELINE_NAME", "oss_srch_pipeline")
-awsauth = AWS4Auth(
-    credentials.access_key,
-    credentials.secret_key,
-    REGION,
-    SERVICE,
-    session_token=credentials.token,
-)
 INDEX_NAME = getenv("INDEX_NAME", "products")
 VECTOR_INDEX_NAME_ON_DISK = getenv("VECTOR_INDEX_NAME_ON_DISK", "products_vectorized_on_disk")
 VECTOR_INDEX_NAME_IN_MEMORY = getenv("VECTOR_INDEX_NAME_IN_MEMORY", "products_vectorized_in_memory")
-MODEL_ID = getenv("MODEL_ID", "cohere.embed-english-v3")
-# Initialize S3 client
-s3_client = boto3.client('s3', region_name=REGION)
-bedrock_client = boto3.client('bedrock-runtime', region_name=REGION)
-ops_client = OpenSearch(
-    hosts=[{"host": ENDPOINT, "port": 443}],
-    http_auth=awsauth,
-    use_ssl=True,
-    verify_certs=True,
-    connection_class=RequestsHttpConnection,
-    timeout=300,
+VECTOR_INDEX_NAME_INT8 = getenv("VECTOR_INDEX_NAME_INT8", "products_vectorized_int8")
+VECTOR_INDEX_NAME_BINARY = getenv("VECTOR_INDEX_NAME_BINARY", "products_vectorized_binary")
+VECTOR_INDEX_NAME_FP16 = getenv("VECTOR_INDEX_NAME_FP16", "products_vectorized_fp16")
+# search request mode -> (vector index, embedding type of its vectors and the query's)
+VECTOR_MODES = {
+    "on_disk": (VECTOR_INDEX_NAME_ON_DISK, "float"),
+    "in_memory": (VECTOR_INDEX_NAME_IN_MEMORY, "float"),
+    "fp16": (VECTOR_INDEX_NAME_FP16, "float"),
+    "int8": (VECTOR_INDEX_NAME_INT8, "int8"),
+    "binary": (VECTOR_INDEX_NAME_BINARY, "binary"),
+}
+# search request types and complex_search search types, anything else is reported as "other"
+SEARCH_TYPES = (
+    "multi_match", "wildcard_match", "match", "prefix_match", "range_filter",
+    "vector_search", "hybrid_search", "complex_search", "match_all",
 )
+COMPLEX_SEARCH_TYPES = ("combined", "exact", "fuzzy", "any", "aggregations")
+MODEL_ID = getenv("MODEL_ID", "cohere.embed-english-v3")
+GENERATION_INDEX_NAME = getenv("GENERATION_INDEX_NAME", "products_generation")
+# How long a generation token is reused before it is read again, and so how long
+# cached results can outlive a bulk load or delete, 0 reads it on every request
+GENERATION_CACHE_TTL_SECONDS = float(getenv("GENERATION_CACHE_TTL_SECONDS", "5"))
+FACET_SNAPSHOT_INDEX_NAME = getenv("FACET_SNAPSHOT_INDEX_NAME", "products_facets")
+FACET_SNAPSHOTS_ENABLED = getenv("FACET_SNAPSHOTS_ENABLED", "true").lower() == "true"
+MAX_BATCH_SEARCHES = int(getenv("MAX_BATCH_SEARCHES", "10"))
+# Fields with a "wildcard" type subfield in the products mapping
+WILDCARD_FIELDS = ["title", "color", "category", "description"]
+WILDCARD_MIN_LITERAL_CHARS = int(getenv("WILDCARD_MIN_LITERAL_CHARS", "3"))
+SUGGEST_DEFAULT_SIZE = int(getenv("SUGGEST_DEFAULT_SIZE", "5"))
+SUGGEST_MAX_SIZE = int(getenv("SUGGEST_MAX_SIZE", "10"))
+EMBEDDING_CACHE_SIZE = int(getenv("EMBEDDING_CACHE_SIZE", "512"))
+PRESIGN_CACHE_MAX_ENTRIES = int(getenv("PRESIGN_CACHE_MAX_ENTRIES", "4096"))
+# Search texts embedded while priming an execution environment, comma separated
+PRIME_QUERIES = [q.strip() for q in getenv("PRIME_QUERIES", "shoes,bag,watch").split(",") if q.strip()]
+# "on-demand", "provisioned-concurrency" or "snap-start", set by the Lambda runtime
+INITIALIZATION_TYPE = getenv("AWS_LAMBDA_INITIALIZATION_TYPE", "on-demand")
+# Cognito group whose members may profile searches
+PROFILE_ADMIN_GROUP = getenv("PROFILE_ADMIN_GROUP", "search-admins")
+# Pooled clients shared through the opensearch_clients layer, created on first use
+s3_client = LazyClient(get_s3_client)
+bedrock_client = LazyClient(get_bedrock_client)
+ops_client = LazyClient(get_opensearch_client)
+embedding_provider = create_embedding_provider(bedrock_client=bedrock_client)
+RESULT_CACHE = ResultCache()
+# Points vector and hybrid searches at the RESULT_CACHE entries of similar queries
+SEMANTIC_CACHE = SemanticCache()
+# (object_key, expiration) -> (presigned url, epoch seconds it stops being valid)
+PRESIGN_CACHE = {}
+# index name -> (generation token, epoch seconds it must be read again)
+GENERATION_CACHE = {}
 
 
-def get_embedding(text):
+def get_embedding(text, embedding_type="float"):
     """
-    Gets embedding for text using Cohere model via Bedrock.
+    Gets the search query embedding for text from the EMBEDDING_PROVIDER, Cohere
+    via Bedrock by default.
     
     Args:
         text (str): The text to generate embeddings for
+        embedding_type (str): "float", or "int8" or "binary" for the quantized vector indices
         
     Returns:
         list: The embedding vector
@@ -56,27 +100,367 @@ def get_embedding(text):
         Exception: If there's an error getting the embedding
     """
     try:
-        body = json.dumps({
-            "texts": [text],
-            "input_type": "search_query",
-            "truncate": "END",
-            "embedding_types": ["float"]
-        })
-        
-        response = bedrock_client.invoke_model(
-            modelId=MODEL_ID,
-            accept='application/json',
-            contentType='application/json',
-            body=body
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        return response_body['embeddings']['float'][0]
+        return embedding_provider.embed([text], "search_query", embedding_type)[0]
     except Exception as e:
         LOG.error(f"Error getting embedding: {str(e)}")
         raise e
 
 
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def embed_query(text, embedding_type="float"):
+    """
+    Returns the embedding for a search text, float vectors projected like the
+    indexed documents are, reusing the one computed by an earlier request in this
+    execution environment. Failed calls are not cached.
+    """
+    if embedding_type != "float":
+        return get_embedding(text, embedding_type)
+    return VECTOR_PROJECTION.project(get_embedding(text))
+
+
+def get_index_generations(index_names):
+    """
+    Reads the generation tokens the index Lambda bumps on every bulk load or delete.
+
+    Args:
+        index_names (iterable): The indices whose generation to read
+
+    Tokens are kept in GENERATION_CACHE for GENERATION_CACHE_TTL_SECONDS, so only
+    indices whose token expired are read from the cluster.
+
+    Returns:
+        dict: Index name to its current generation token, "0" for an index that was
+              never bumped. Indices whose token could not be read are left out, and
+              callers must bypass the cache for them.
+    """
+    now = time.time()
+    generations = {}
+    stale = []
+    for name in dict.fromkeys(index_names):
+        cached = GENERATION_CACHE.get(name)
+        if cached and cached[1] > now:
+            generations[name] = cached[0]
+        else:
+            stale.append(name)
+    if not stale:
+        return generations
+    try:
+        res = ops_client.mget(index=GENERATION_INDEX_NAME, body={"ids": stale}, ignore=[404])
+    except Exception as e:
+        LOG.error(f"method=get_index_generations, indices={stale}, error={e}")
+        return generations
+    read = {name: "0" for name in stale}
+    for doc in res.get("docs", []):
+        if doc.get("found"):
+            read[doc["_id"]] = doc["_source"]["generation"]
+        elif "error" in doc:
+            read.pop(doc["_id"], None)
+    for name, generation in read.items():
+        GENERATION_CACHE[name] = (generation, now + GENERATION_CACHE_TTL_SECONDS)
+    generations.update(read)
+    return generations
+
+
+def search_request(index, search_body, params=None, facets=False):
+    """
+    Wraps an inline OpenSearch request body for execute_search or search_batch.
+
+    Args:
+        index (str): The index to search
+        search_body (dict): The OpenSearch request body
+        params (dict): Optional search URL parameters, e.g. request_cache
+        facets (bool): Whether the request is a facet aggregation, served from a
+                       facet snapshot when the index Lambda precomputes it
+    """
+    request = {"index": index, "body": search_body}
+    if params:
+        request["params"] = params
+    if facets:
+        request["facets"] = True
+    return request
+
+
+def template_request(index, name, params):
+    """
+    Wraps a stored search template call for execute_search or search_batch.
+    Only the template id and params are sent to the cluster.
+    """
+    return {"index": index, "template": name, "body": {"id": template_id(name), "params": params}}
+
+
+def cache_lookup(request, generation):
+    """
+    Looks request up in RESULT_CACHE.
+
+    Returns:
+        tuple: (key, cached_response). key is None when generation is None, in which
+               case the cache must be bypassed; cached_response is None on a miss.
+    """
+    if generation is None:
+        return None, None
+    key = cache_key(request["index"], request)
+    cached = RESULT_CACHE.get(key, generation)
+    if cached is None:
+        cached = semantic_cache_lookup(request, generation)
+    return key, cached
+
+
+def query_vector_scope(request):
+    """
+    Returns (vector, scope) for requests SEMANTIC_CACHE applies to, (None, None) for
+    the rest: templates, which have no vector, and binary mode searches, whose packed
+    bits cosine similarity doesn't apply to.
+    """
+    if not SEMANTIC_CACHE_ENABLED or "template" in request or request["index"] == VECTOR_INDEX_NAME_BINARY:
+        return None, None
+    return split_query_vector(request["index"], request["body"])
+
+
+def semantic_cache_lookup(request, generation):
+    """
+    Returns the cached response of a search similar enough to request, or None.
+    """
+    vector, scope = query_vector_scope(request)
+    if vector is None:
+        return None
+    similar_key, similarity = SEMANTIC_CACHE.lookup(scope, vector, generation)
+    if similar_key is None:
+        return None
+    cached = RESULT_CACHE.get(similar_key, generation)
+    if cached is None:
+        SEMANTIC_CACHE.discard(similar_key)
+        return None
+    LOG.info(f"method=semantic_cache_lookup, index={request['index']}, similarity={similarity:.4f}, semantic_cache=hit")
+    return cached
+
+
+def cache_store(key, request, generation, response):
+    """Stores an OpenSearch response in RESULT_CACHE, and its query vector in SEMANTIC_CACHE."""
+    RESULT_CACHE.put(key, generation, response)
+    vector, scope = query_vector_scope(request)
+    if vector is not None:
+        SEMANTIC_CACHE.put(key, scope, vector, generation)
+
+
+def get_facet_snapshot(request, generation):
+    """
+    Returns the snapshot of a facet request if the index Lambda precomputes it, as
+    one of FACET_SNAPSHOT_SEARCHES, and it was computed against generation.
+
+    Snapshots are only written by the index Lambda, as soon as a catalog load
+    finishes, so the facet sidebar rarely pays for an aggregation pass and other
+    aggregations never cost more than a regular search.
+    """
+    if not FACET_SNAPSHOTS_ENABLED or generation is None or not is_precomputed(request["body"]):
+        return None
+    try:
+        res = ops_client.get(
+            index=FACET_SNAPSHOT_INDEX_NAME, id=snapshot_id(request["index"], request["body"]), ignore=[404]
+        )
+    except Exception as e:
+        LOG.error(f"method=get_facet_snapshot, index={request['index']}, error={e}")
+        return None
+    if res.get("found") and res["_source"].get("generation") == generation:
+        return res["_source"]["result"]
+    return None
+
+
+def register_search_template(name):
+    """
+    Stores the search template called name in the cluster under its versioned id.
+    """
+    res = ops_client.put_script(id=template_id(name), body=template_script(name))
+    LOG.info(f"method=register_search_template, template_id={template_id(name)}, response={res}")
+
+
+def send_search(request):
+    """
+    Sends a single prepared request to OpenSearch.
+
+    Templates are registered lazily: the first request to find a versioned id
+    missing stores it and retries. Every search sent is tracked by SLOW_QUERIES.
+    """
+    if "template" not in request:
+        response = ops_client.search(
+            index=request["index"], body=request["body"], params=request.get("params")
+        )
+    else:
+        try:
+            response = ops_client.search_template(index=request["index"], body=request["body"])
+        except NotFoundError:
+            register_search_template(request["template"])
+            response = ops_client.search_template(index=request["index"], body=request["body"])
+    SLOW_QUERIES.track(request, response)
+    return response
+
+
+def execute_search(request):
+    """
+    Runs a prepared request, serving repeat queries from RESULT_CACHE.
+
+    Responses are cached before presigned URLs are added, so cached hits never
+    carry expired image links.
+
+    Args:
+        request (dict): A request built by search_request or template_request
+
+    Returns:
+        dict: The OpenSearch search response
+    """
+    with STAGE_TIMINGS.stage("cache"):
+        generation = None
+        if RESULT_CACHE_ENABLED:
+            generation = get_index_generations([request["index"]]).get(request["index"])
+        key, cached = cache_lookup(request, generation)
+        if cached is None and request.get("facets"):
+            cached = get_facet_snapshot(request, generation)
+            if cached is not None:
+                LOG.info(f"method=execute_search, index={request['index']}, facet_snapshot=hit")
+                RESULT_CACHE.put(key, generation, cached)
+    if cached is not None:
+        LOG.info(f"method=execute_search, index={request['index']}, cache=hit")
+        return cached
+    with STAGE_TIMINGS.stage("opensearch"):
+        response = send_search(request)
+    if "took" in response:
+        STAGE_TIMINGS.record("opensearch_took", response["took"])
+    if key is not None:
+        cache_store(key, request, generation, response)
+    return response
+
+
+def is_missing_template(response):
+    return response.get("error", {}).get("type") == "resource_not_found_exception"
+
+
+def send_multi_search(requests):
+    """
+    Sends prepared requests to OpenSearch in a single round trip.
+
+    Plain bodies go through msearch. If any request is a stored template the batch
+    goes through msearch_template instead, with the plain bodies as inline sources.
+    Templates missing from the cluster are registered and their searches retried once.
+    Every search sent is tracked by SLOW_QUERIES.
+
+    Args:
+        requests (list): Requests built by search_request or template_request
+
+    Returns:
+        list: One msearch response item per request, in order
+    """
+    uses_templates = any("template" in request for request in requests)
+    lines = []
+    for request in requests:
+        lines.append({"index": request["index"], **request.get("params", {})})
+        if uses_templates and "template" not in request:
+            lines.append({"source": request["body"]})
+        else:
+            lines.append(request["body"])
+    if not uses_templates:
+        responses = ops_client.msearch(body=lines)["responses"]
+        for request, response in zip(requests, responses):
+            SLOW_QUERIES.track(request, response)
+        return responses
+
+    responses = ops_client.msearch_template(body=lines)["responses"]
+    missing = [
+        position for position, (request, response) in enumerate(zip(requests, responses))
+        if "template" in request and is_missing_template(response)
+    ]
+    if missing:
+        for name in {requests[position]["template"] for position in missing}:
+            register_search_template(name)
+        retry_lines = []
+        for position in missing:
+            retry_lines.extend(lines[2 * position:2 * position + 2])
+        retried = ops_client.msearch_template(body=retry_lines)["responses"]
+        for position, response in zip(missing, retried):
+            responses[position] = response
+    for request, response in zip(requests, responses):
+        SLOW_QUERIES.track(request, response)
+    return responses
+
+
+def search_batch(event):
+    """
+    Runs several search_products request bodies in one OpenSearch round trip.
+
+    Args:
+        event (dict): The Lambda event object, its body holds the searches to run
+                     Expected body format:
+                     {
+                         "searches": [  # Request bodies as accepted by search_products,
+                             {"type": str, ...}  # except profile, batch searches can't be profiled
+                         ]
+                     }
+
+    Returns:
+        dict: Response object whose result is {"responses": [...]}, holding one
+              success_response or failure_response per search, in request order
+    """
+    if "body" not in event:
+        return failure_response("Invalid request")
+    searches = json.loads(event["body"]).get("searches")
+    if not isinstance(searches, list) or not searches:
+        return failure_response("Invalid request, searches should be a non-empty list", "400")
+    if len(searches) > MAX_BATCH_SEARCHES:
+        return failure_response(
+            f"Invalid request, at most {MAX_BATCH_SEARCHES} searches are allowed per batch", "400"
+        )
+
+    results = [None] * len(searches)
+    prepared = {}
+    for position, body in enumerate(searches):
+        try:
+            if "profile" in body:
+                request, error = None, failure_response(
+                    "Invalid request, profile is not supported in batch searches, use /search", "400"
+                )
+            else:
+                _, error = requested_image_size(body)
+            if not error:
+                request, error = prepare_search(body, caller_id(event))
+        except Exception as e:
+            LOG.exception(f"method=search_batch, position={position}, error={e}")
+            request, error = None, failure_response(f"system_exception: {e}")
+        if error:
+            results[position] = error
+        else:
+            prepared[position] = request
+
+    generations = {}
+    if RESULT_CACHE_ENABLED and prepared:
+        generations = get_index_generations(request["index"] for request in prepared.values())
+
+    pending = []
+    for position, request in prepared.items():
+        generation = generations.get(request["index"])
+        key, cached = cache_lookup(request, generation)
+        if cached is None and request.get("facets"):
+            cached = get_facet_snapshot(request, generation)
+            if cached is not None:
+                RESULT_CACHE.put(key, generation, cached)
+        if cached is not None:
+            results[position] = success_response(with_presigned_urls(cached, searches[position].get("image_size")))
+        else:
+            pending.append((position, request, key, generation))
+
+    if pending:
+        LOG.info(f"method=search_batch, searches={len(searches)}, sent={len(pending)}")
+        with STAGE_TIMINGS.stage("opensearch"):
+            responses = send_multi_search([request for _, request, _, _ in pending])
+        for (position, request, key, generation), response in zip(pending, responses):
+            if "error" in response:
+                results[position] = failure_response(
+                    f"Error in search: {response['error']}", str(response.get("status", 500))
+                )
+                continue
+            if key is not None:
+                cache_store(key, request, generation, response)
+            results[position] = success_response(with_presigned_urls(response, searches[position].get("image_size")))
+    return success_response({"responses": results})
+
+
 def search_products(event):
     """
     Searches for products in OpenSearch based on different search criteria.
@@ -92,6 +476,9 @@ def search_products(event):
                          "case_insensitive": bool, # Optional for wildcard_match
                          "minimum_should_match": str/int, # Required for match query
                          "operator": str,      # Required for range_filter (gt, gte, lt, lte)
+                         "profile": bool,      # Optional, PROFILE_ADMIN_GROUP only, adds a condensed Profile API breakdown
+                         "image_size": int,    # Optional, links image_url to the smallest rendition at least this many pixels wide
+                         "fusion": str,        # Optional for hybrid_search, one of FUSION_STRATEGIES, see search_pipelines
                          
                          # Complex search parameters
                          "search_value": str,  # Main search term
@@ -113,374 +500,507 @@ def search_products(event):
     """
     
     if "body" in event:
-        body = json.loads(event["body"])
-        is_vector_search = False
-        # Handle complex search
-        if body["type"] == "complex_search":
-            search_value = body.get("search_value", "")
-            search_type = body.get("search_type", "combined")
-            fields = body.get("fields", [])
+        with STAGE_TIMINGS.stage("parse"):
+            body = json.loads(event["body"])
+        STAGE_TIMINGS.set_dimensions(*search_dimensions(body))
+        profile = body.get("profile") is True
+        if profile and not is_profile_admin(event):
+            return failure_response(
+                f"Forbidden, profile is restricted to the {PROFILE_ADMIN_GROUP} group", "403"
+            )
+        image_size, error = requested_image_size(body)
+        if error:
+            return error
+        request, error = prepare_search(body, caller_id(event))
+        if error:
+            return error
+        if profile:
+            return profile_search(request, image_size)
+        response = execute_search(request)
+        return success_response(with_presigned_urls(response, image_size))
+    return failure_response("Invalid request")
+
+
+def caller_id(event):
+    """The Cognito user the API Gateway authorizer passed on, None for unauthenticated calls."""
+    return event.get("requestContext", {}).get("authorizer", {}).get("claims", {}).get("sub")
+
+
+def is_profile_admin(event):
+    """
+    Checks the Cognito groups claim passed on by the API Gateway authorizer for
+    PROFILE_ADMIN_GROUP. The claim arrives as a comma or space separated string.
+    """
+    claims = event.get("requestContext", {}).get("authorizer", {}).get("claims", {})
+    groups = claims.get("cognito:groups", "")
+    if isinstance(groups, str):
+        groups = groups.strip("[]").replace(",", " ").split()
+    return PROFILE_ADMIN_GROUP in groups
+
+
+def requested_image_size(body):
+    """
+    Returns:
+        tuple: (image_size, None), image_size being None when the body doesn't ask
+               for a rendition, or (None, failure_response) when it isn't a positive integer
+    """
+    image_size = body.get("image_size")
+    if image_size is None:
+        return None, None
+    if isinstance(image_size, bool) or not isinstance(image_size, int) or image_size <= 0:
+        return None, failure_response("Invalid request, image_size must be a positive integer", "400")
+    return image_size, None
+
+
+def profile_search(request, image_size=None):
+    """
+    Runs a prepared request through the OpenSearch Profile API, bypassing the result
+    cache, and replaces the raw profile with its condensed per-shard breakdown.
+    """
+    with STAGE_TIMINGS.stage("opensearch"):
+        response = send_search(profiled_request(request))
+    if "took" in response:
+        STAGE_TIMINGS.record("opensearch_took", response["took"])
+    LOG.info(f"method=profile_search, index={request['index']}, took={response.get('took')}")
+    response["profile"] = condense_profile(response.get("profile", {}))
+    return success_response(with_presigned_urls(response, image_size))
+
+
+def search_dimensions(body):
+    """
+    Returns the (search type, mode) a search_products request body is reported under.
+    Mode is the vector index mode for vector and hybrid searches, and the complex
+    search type for complex_search. Values outside SEARCH_TYPES, VECTOR_MODES and
+    COMPLEX_SEARCH_TYPES are reported as "other", so callers can't add dimensions.
+    """
+    search_type = known(body.get("type", "match_all"), SEARCH_TYPES)
+    if search_type in ("vector_search", "hybrid_search"):
+        return search_type, known(body.get("mode"), VECTOR_MODES)
+    if search_type == "complex_search":
+        return search_type, known(body.get("search_type", "combined"), COMPLEX_SEARCH_TYPES)
+    return search_type, "default"
+
+
+def known(value, values):
+    return value if isinstance(value, str) and value in values else "other"
+
+
+def rewrite_wildcard_query(attribute_name, pattern, case_insensitive):
+    """
+    Routes wildcard patterns that start with a wildcard to the field's "wildcard"
+    subfield, which answers them from an ngram index instead of scanning the whole
+    term dictionary. Patterns that would still scan everything are rejected.
+
+    A "wildcard" subfield matches the whole original value, unlike the analyzed text
+    field, which matches individual lowercased terms. When an analyzed field is
+    rewritten, the match is made case insensitive and the pattern is wrapped in "*"
+    on both ends, so "*shoe" still finds titles where any word ends in "shoe".
+
+    Args:
+        attribute_name (str): The field the request targets, e.g. title or title.keyword
+        pattern (str/int): The wildcard pattern
+        case_insensitive (bool): The requested case sensitivity
+
+    Returns:
+        tuple: (attribute_name, pattern, case_insensitive, None) to run the query with,
+               or (None, None, None, error_message) if the pattern is rejected
+    """
+    pattern = str(pattern)
+    literal_runs = pattern.replace("?", "*").split("*")
+    if not any(literal_runs):
+        return None, None, None, "Invalid request, wildcard pattern should contain at least one literal character"
+    if pattern[0] not in "*?":
+        # leading literals let OpenSearch seek straight to the matching terms
+        return attribute_name, pattern, case_insensitive, None
+
+    base_field = attribute_name[: -len(".keyword")] if attribute_name.endswith(".keyword") else attribute_name
+    if base_field not in WILDCARD_FIELDS:
+        return None, None, None, (
+            f"Invalid request, patterns starting with a wildcard are only supported on {', '.join(WILDCARD_FIELDS)}"
+        )
+    if max(len(run) for run in literal_runs) < WILDCARD_MIN_LITERAL_CHARS:
+        return None, None, None, (
+            "Invalid request, patterns starting with a wildcard should contain at least "
+            f"{WILDCARD_MIN_LITERAL_CHARS} consecutive literal characters"
+        )
+    if attribute_name == base_field:
+        case_insensitive = True
+        if not pattern.startswith("*"):
+            pattern = "*" + pattern
+        if not pattern.endswith("*"):
+            pattern = pattern + "*"
+    return f"{base_field}.wildcard", pattern, case_insensitive, None
+
+
+def prepare_search(body, caller=None):
+    """
+    Builds the OpenSearch request for a single search_products request body.
+
+    Args:
+        body (dict): The parsed request body, see search_products for the format
+        caller (str): Identifies who is searching, for FUSION_TRAFFIC_SPLIT
+
+    Returns:
+        tuple: (request, None) on success, where request comes from search_request or
+               template_request, or (None, failure_response) for an invalid body
+    """
+    # Handle complex search
+    if body["type"] == "complex_search":
+        search_value = body.get("search_value", "")
+        search_type = body.get("search_type", "combined")
+        fields = body.get("fields", [])
+        
+        # Handle aggregations as a separate search type
+        if search_type == "aggregations":
+            aggregations = body.get("aggregations", [])
+            # Facets need no hits, and size 0 lets the shard request cache serve them
+            search_body = {
+                "size": 0,
+                "query": {"match_all": {}},
+                "aggs": {}
+            }
             
-            # Handle aggregations as a separate search type
-            if search_type == "aggregations":
-                aggregations = body.get("aggregations", [])
-                search_body = {
-                    "query": {"match_all": {}},
-                    "aggs": {}
-                }
+            # Process each aggregation definition
+            for agg in aggregations:
+                agg_type = agg.get("type")
+                agg_field = agg.get("field")
+                agg_name = agg.get("name", agg_field)
                 
-                # Process each aggregation definition
-                for agg in aggregations:
-                    agg_type = agg.get("type")
-                    agg_field = agg.get("field")
-                    agg_name = agg.get("name", agg_field)
-                    
-                    if not agg_type or not agg_field:
-                        continue
-                    
-                    if agg_type == "terms":
-                        search_body["aggs"][agg_name] = {
-                            "terms": {
-                                "field": agg_field + ".keyword",
-                                "size": agg.get("size", 10)
-                            }
+                if not agg_type or not agg_field:
+                    continue
+                
+                if agg_type == "terms":
+                    search_body["aggs"][agg_name] = {
+                        "terms": {
+                            "field": agg_field + ".keyword",
+                            "size": agg.get("size", 10)
+                        }
+                    }
+                elif agg_type == "stats":
+                    search_body["aggs"][agg_name] = {
+                        "stats": {
+                            "field": agg_field
                         }
-                    elif agg_type == "stats":
+                    }
+                elif agg_type == "range":
+                    ranges = agg.get("ranges", [])
+                    if ranges:
                         search_body["aggs"][agg_name] = {
-                            "stats": {
-                                "field": agg_field
+                            "range": {
+                                "field": agg_field,
+                                "ranges": ranges
                             }
                         }
-                    elif agg_type == "range":
-                        ranges = agg.get("ranges", [])
-                        if ranges:
-                            search_body["aggs"][agg_name] = {
-                                "range": {
-                                    "field": agg_field,
-                                    "ranges": ranges
-                                }
-                            }
-                    elif agg_type == "nested_stats":
-                        # For nested aggregations like avg_price_by_category
-                        search_body["aggs"][agg_name] = {
-                            "terms": {
-                                "field": agg_field + ".keyword",
-                                "size": agg.get("size", 10)
-                            },
-                            "aggs": {
-                                agg.get("metric_name", "value"): {
-                                    agg.get("metric_type", "avg"): {
-                                        "field": agg.get("metric_field")
-                                    }
+                elif agg_type == "nested_stats":
+                    # For nested aggregations like avg_price_by_category
+                    search_body["aggs"][agg_name] = {
+                        "terms": {
+                            "field": agg_field + ".keyword",
+                            "size": agg.get("size", 10)
+                        },
+                        "aggs": {
+                            agg.get("metric_name", "value"): {
+                                agg.get("metric_type", "avg"): {
+                                    "field": agg.get("metric_field")
                                 }
                             }
                         }
+                    }
+        
+        else:
+            # Build the per-field clauses, the text clause is part of the stored template
+            must_conditions = []
+            should_conditions = []
             
-            else:
-                # Build bool query for regular searches
-                must_conditions = []
-                should_conditions = []
+            # Process each field
+            for field in fields:
+                field_name = field.get("name")
+                field_type = field.get("type")
+                field_value = field.get("value")
+                field_boost = field.get("boost")
                 
-                # Add text search conditions
-                if search_value:
-                    text_search = {
-                        "multi_match": {
-                            "query": search_value,
-                            "fields": ["title^3", "description^2", "color"],
-                            "type": "best_fields"
-                        }
-                    }
-                    
-                    # Add fuzzy search settings if search_type is fuzzy
-                    if search_type == "fuzzy":
-                        text_search["multi_match"].update({
-                            "fuzziness": "AUTO",
-                            "prefix_length": 2,
-                            "fuzzy_transpositions": True
-                        })
-                    elif search_type == "exact":
-                        text_search["multi_match"]["type"] = "phrase"
-                    
-                    must_conditions.append(text_search)
+                if not field_value:
+                    continue
                 
-                # Process each field
-                for field in fields:
-                    field_name = field.get("name")
-                    field_type = field.get("type")
-                    field_value = field.get("value")
-                    field_boost = field.get("boost")
-                    
-                    if not field_value:
-                        continue
-                    
-                    # Build field query based on type
-                    if field_type == "text":
-                        field_query = {
-                            "match": {
-                                field_name: {
-                                    "query": field_value
-                                }
+                # Build field query based on type
+                if field_type == "text":
+                    field_query = {
+                        "match": {
+                            field_name: {
+                                "query": field_value
                             }
                         }
-                        if field_boost:
-                            field_query["match"][field_name]["boost"] = field_boost
-                    
-                    elif field_type == "select":
-                        field_query = {"term": {field_name: field_value}}
-                    
-                    elif field_type == "range":
-                        range_query = {"range": {field_name: {}}}
-                        if "min" in field_value:
-                            range_query["range"][field_name]["gte"] = field_value["min"]
-                        if "max" in field_value:
-                            range_query["range"][field_name]["lte"] = field_value["max"]
-                        field_query = range_query
-                    
-                    # Add to appropriate conditions list
-                    if search_type == "any":
-                        should_conditions.append(field_query)
-                    else:
-                        must_conditions.append(field_query)
-                
-                # Build final query
-                search_body = {
-                    "query": {
-                        "bool": {
-                            "must": must_conditions
-                        }
                     }
-                }
+                    if field_boost:
+                        field_query["match"][field_name]["boost"] = field_boost
                 
-                # Add should conditions for "any" type search
-                if search_type == "any" and should_conditions:
-                    search_body["query"]["bool"]["should"] = should_conditions
-                    search_body["query"]["bool"]["minimum_should_match"] = 1
-            
-            LOG.debug(f"final Opensearch Query: {search_body}")
-            
-            response = ops_client.search(index=INDEX_NAME, body=search_body)
-            # Add presigned URLs to search results before returning
-            try:
-                if 'hits' in response:
-                    response = add_presigned_urls_to_results(response)
-            except Exception as e:
-                LOG.error(f"Error adding presigned URLs to search results: {e}")
-            return success_response(response)
+                elif field_type == "select":
+                    field_query = {"term": {field_name: field_value}}
+                
+                elif field_type == "range":
+                    range_query = {"range": {field_name: {}}}
+                    if "min" in field_value:
+                        range_query["range"][field_name]["gte"] = field_value["min"]
+                    if "max" in field_value:
+                        range_query["range"][field_name]["lte"] = field_value["max"]
+                    field_query = range_query
+                
+                # Add to appropriate conditions list
+                if search_type == "any":
+                    should_conditions.append(field_query)
+                else:
+                    must_conditions.append(field_query)
             
-        # Handle existing search types
-        attribute_name = body["attribute_name"] if "attribute_name" in body else None
-        attribute_value = body["attribute_value"] if "attribute_value" in body else None
-        if not isinstance(attribute_name, str):
-            return failure_response(
-                "Invalid request, attribute_name should be of type string", "400"
-            )
-        if not (isinstance(attribute_value, str) or isinstance(attribute_value, int)):
-            return failure_response(
-                "Invalid request, attribute_value should be of type string or integer",
-                "400",
-            )
+            template_params = {
+                "has_search_value": bool(search_value),
+                "search_value": search_value,
+                "text_type": "phrase" if search_type == "exact" else "best_fields",
+                "fuzzy": search_type == "fuzzy",
+                "has_must_clauses": bool(must_conditions),
+                "must_clauses": must_conditions,
+                "has_both": bool(search_value) and bool(must_conditions),
+                # Add should conditions for "any" type search
+                "has_should_clauses": search_type == "any" and bool(should_conditions),
+                "should_clauses": should_conditions,
+            }
+            LOG.debug(f"final Opensearch template params: {template_params}")
+            return template_request(INDEX_NAME, "complex_search", template_params), None
+        
+        LOG.debug(f"final Opensearch Query: {search_body}")
+        return search_request(
+            INDEX_NAME, search_body, params={"request_cache": "true"}, facets=True
+        ), None
+        
+    # Handle existing search types
+    attribute_name = body["attribute_name"] if "attribute_name" in body else None
+    attribute_value = body["attribute_value"] if "attribute_value" in body else None
+    if not isinstance(attribute_name, str):
+        return None, failure_response(
+            "Invalid request, attribute_name should be of type string", "400"
+        )
+    if not (isinstance(attribute_value, str) or isinstance(attribute_value, int)):
+        return None, failure_response(
+            "Invalid request, attribute_value should be of type string or integer",
+            "400",
+        )
 
-        multi_match_fields = []
-        search_body = {}
-        if body["type"] == "multi_match":
-            fields = body["fields"]
-            for field in fields:
-                if not isinstance(field.get("field"), str):
-                    return failure_response(
-                        "Invalid request, field should be of type string", "400"
-                    )
-                if not isinstance(field.get("boost"), int):
-                    return failure_response(
-                        "Invalid request, boost should be of type integer", "400"
-                    )
-
-                multi_match_fields.append(f'{field["field"]}^{field["boost"]}')
-            # perform multi-match query
+    multi_match_fields = []
+    search_body = {}
+    # Lexical searches run as stored search templates, only the template
+    # name and its params are built here and sent to the cluster
+    template_name = None
+    template_params = {
+        "attribute_name": attribute_name,
+        "attribute_value": attribute_value,
+    }
+    if body["type"] == "multi_match":
+        fields = body["fields"]
+        for field in fields:
+            if not isinstance(field.get("field"), str):
+                return None, failure_response(
+                    "Invalid request, field should be of type string", "400"
+                )
+            if not isinstance(field.get("boost"), int):
+                return None, failure_response(
+                    "Invalid request, boost should be of type integer", "400"
+                )
+
+            multi_match_fields.append(f'{field["field"]}^{field["boost"]}')
+        # perform multi-match query
+        template_name = "multi_match"
+        template_params["fields"] = multi_match_fields
+    # write an else if condition for a wildcard search
+    elif body["type"] == "wildcard_match":
+        case_insensitive = False
+        if "case_insensitive" in body:
+            case_insensitive = bool(body["case_insensitive"])
+        field, pattern, case_insensitive, error = rewrite_wildcard_query(
+            attribute_name, attribute_value, case_insensitive
+        )
+        if error:
+            return None, failure_response(error, "400")
+        template_name = "wildcard_match"
+        template_params["attribute_name"] = field
+        template_params["attribute_value"] = pattern
+        template_params["case_insensitive"] = case_insensitive
+    elif body["type"] == "match":
+        if "minimum_should_match" in body:
+            if not (
+                isinstance(body["minimum_should_match"], int)
+                or isinstance(body["minimum_should_match"], str)
+            ):
+                return None, failure_response(
+                    "Invalid request, minimum_should_match should be of type string or integer",
+                    "400",
+                )
+            template_name = "match_minimum_should_match"
+            template_params["minimum_should_match"] = body["minimum_should_match"]
+        else:
+            template_name = "match"
+    elif body["type"] == "prefix_match":
+
+        if attribute_value == "":
+            template_name = "match_all"
+        else:
+            template_name = "prefix_match"
+    elif body["type"] == "range_filter":
+        if not isinstance(body["operator"], str):
+            return None, failure_response(
+                "Invalid request, operator should be of type string", "400"
+            )
+        template_name = "range_filter"
+        template_params["operator"] = body["operator"]
+        template_params["attribute_value"] = int(attribute_value)
+    
+    # Handle vector search
+    elif body["type"] == "vector_search":
+        if body.get("mode") not in VECTOR_MODES:
+            return None, invalid_mode_response()
+        try:
+            # Get embedding for the search text
+            search_text = body["attribute_value"]
+            with STAGE_TIMINGS.stage("embedding"):
+                vector_embedding = embed_query(search_text, VECTOR_MODES[body["mode"]][1])
             search_body = {
                 "size": 100,
+                "_source": {
+                    "excludes": ["vector_embedding"]
+                },
                 "query": {
-                    "multi_match": {
-                        "query": attribute_value,
-                        "fields": multi_match_fields,
-                        "type": "phrase_prefix",
+                    "knn": {
+                        "vector_embedding": {"vector": vector_embedding, "k": 100}
                     }
                 }
             }
-        # write an else if condition for a wildcard search
-        elif body["type"] == "wildcard_match":
-            case_insensitive = False
-            if "case_insensitive" in body:
-                case_insensitive = bool(body["case_insensitive"])
-            search_body = {
-                "size": 100,
-                "query": {
-                    "wildcard": {
-                        attribute_name: {
-                            "value": attribute_value,
-                            "case_insensitive": case_insensitive,
-                        }
-                    }
+        except Exception as e:
+            LOG.error(f"Error in vector search: {str(e)}")
+            return None, failure_response(f"Error in vector search: {str(e)}")
+            
+    elif body["type"] == "hybrid_search":
+        if body.get("mode") not in VECTOR_MODES:
+            return None, invalid_mode_response()
+        try:
+            fusion = fusion_strategy(body.get("fusion"), caller)
+        except ValueError as e:
+            return None, failure_response(f"Invalid request, {e}", "400")
+        depth = candidate_depth(fusion)
+        LOG.info(f"method=prepare_search, fusion={fusion}, depth={depth}")
+        search_text = body["attribute_value"]
+        # identify category and color from search text by calling Amazon Bedrock
+        # category can be men, women, kids, unisex
+        # color can be red, blue, green, yellow, orange, purple, pink, brown, black, white, gray, silver, gold, etc.
+        with STAGE_TIMINGS.stage("filters"):
+            product_filters = identify_category_color_product_name(search_text)
+        category_match=None
+        color_match=None
+        product_type_match=None
+        should_match_conditions=[]
+        if "category" in product_filters:
+            category_match = {
+                "term": {
+                    "category": product_filters["category"]
                 }
             }
-        elif body["type"] == "match":
-            if "minimum_should_match" in body["minimum_should_match"]:
-                if not (
-                    isinstance(body["minimum_should_match"], int)
-                    or isinstance(body["minimum_should_match"], str)
-                ):
-                    return failure_response(
-                        "Invalid request, minimum_should_match should be of type string or integer",
-                        "400",
-                    )
-                search_body = {
-                    "size": 100,
-                    "query": {
-                        "match": {
-                            attribute_name: {
-                                "query": attribute_value,
-                                "minimum_should_match": body["minimum_should_match"],
-                            }
-                        }
-                    }
+            should_match_conditions.append(category_match)
+        if "color" in product_filters:
+            color_match = {
+                "term": {
+                    "color": product_filters["color"]
                 }
-            else:
-                search_body = {
-                    "size": 100,
-                    "query": {"match": {attribute_name: {"query": attribute_value}}}
-                }
-        elif body["type"] == "prefix_match":
-
-            if attribute_value == "":
-                search_body = {"size": 100, "query": {"match_all": {}}}
-            else:
-                search_body = {
-                    "size": 100,
-                    "query": {
-                        "match_phrase_prefix": {
-                            attribute_name: {
-                                "query": attribute_value,
-                                "max_expansions": 10,
-                                "slop": 1,
-                            }
-                        }
-                    }
-                }
-        elif body["type"] == "range_filter":
-            if not isinstance(body["operator"], str):
-                return failure_response(
-                    "Invalid request, operator should be of type string", "400"
-                )
-            search_body = {
-                "size": 100,
-                "query": {
-                    "range": {attribute_name: {body["operator"]: int(attribute_value)}}
+            }
+            should_match_conditions.append(color_match)
+        if "product_type" in product_filters:
+            product_type_match = {
+                "term": {
+                    "product_type": product_filters["product_type"]
                 }
             }
-        
-        # Handle vector search
-        elif body["type"] == "vector_search":
-            try:
-                # Get embedding for the search text
-                search_text = body["attribute_value"]
-                vector_embedding = get_embedding(search_text)
-                search_body = {
-                    "size": 100,
-                    "_source": {
-                        "excludes": ["vector_embedding"]
-                    },
-                    "query": {
-                        "knn": {
-                            "vector_embedding": {"vector": vector_embedding, "k": 100}
+            should_match_conditions.append(product_type_match)
+        with STAGE_TIMINGS.stage("embedding"):
+            vector_embedding = embed_query(search_text, VECTOR_MODES[body["mode"]][1])
+        search_body = {
+            "size": 100,
+            "_source": {
+                "excludes": "vector_embedding"
+            },
+            "query": {
+                "hybrid": {
+                    "pagination_depth": depth,
+                    "queries": [
+                        {
+                            "bool": {
+                                "should": should_match_conditions,
+                                "minimum_should_match": 1
+                            }
+                        },
+                        {
+                            "knn": {
+                                "vector_embedding": {"vector": vector_embedding, "k": depth}
+                            }
                         }
-                    }
-                }
-            except Exception as e:
-                LOG.error(f"Error in vector search: {str(e)}")
-                return failure_response(f"Error in vector search: {str(e)}")
-                
-        elif body["type"] == "hybrid_search":
-            search_text = body["attribute_value"]
-            # identify category and color from search text by calling Amazon Bedrock
-            # category can be men, women, kids, unisex
-            # color can be red, blue, green, yellow, orange, purple, pink, brown, black, white, gray, silver, gold, etc.
-            product_filters = identify_category_color_product_name(search_text)
-            category_match=None
-            color_match=None
-            product_type_match=None
-            should_match_conditions=[]
-            if "category" in product_filters:
-                category_match = {
-                    "term": {
-                        "category": product_filters["category"]
-                    }
+                    ]
                 }
-                should_match_conditions.append(category_match)
-            if "color" in product_filters:
-                color_match = {
-                    "term": {
-                        "color": product_filters["color"]
-                    }
-                }
-                should_match_conditions.append(color_match)
-            if "product_type" in product_filters:
-                product_type_match = {
-                    "term": {
-                        "product_type": product_filters["product_type"]
-                    }
+            },
+            "post_filter": {
+                "bool": {
+                    "must": should_match_conditions
                 }
-                should_match_conditions.append(product_type_match)
-            vector_embedding = get_embedding(search_text)
-            search_body = {
-                "size": 100,
-                "_source": {
-                    "excludes": "vector_embedding"
-                },
-                "query": {
-                    "hybrid": {
-                        "queries": [
-                            {
-                                "bool": {
-                                    "should": should_match_conditions,
-                                    "minimum_should_match": 1
-                                }
-                            },
-                            {
-                                "knn": {
-                                    "vector_embedding": {"vector": vector_embedding, "k": 100}
-                                }
-                            }
-                        ]
-                    }
-                },
-                "post_filter": {
-                    "bool": {
-                        "must": should_match_conditions
-                    }
-                },
-                "search_pipeline" : SEARCH_PIPELINE_NAME
-            }
-            
-        else:
-            search_body = {"size": 100, "query": {"match_all": {}}}
+            },
+            "search_pipeline" : pipeline_id(fusion)
+        }
         
-        if body["type"] not in ["vector_search", "hybrid_search"]:
-            response = ops_client.search(index=INDEX_NAME, body=search_body)
-        else:
-            if body["mode"] == "on_disk":
-                response = ops_client.search(index=VECTOR_INDEX_NAME_ON_DISK, body=search_body)
-            elif body["mode"] == "in_memory":
-                response = ops_client.search(index=VECTOR_INDEX_NAME_IN_MEMORY, body=search_body)
-            else:
-                return failure_response("Invalid request, mode should be on_disk or in_memory")
-                
-        # Add presigned URLs to search results before returning
-        try:
-            if 'hits' in response:
-                response = add_presigned_urls_to_results(response)
-        except Exception as e:
-            LOG.error(f"Error adding presigned URLs to search results: {e}")
-        return success_response(response)
-    return failure_response("Invalid request")
+    else:
+        template_name = "match_all"
+    
+    if template_name:
+        return template_request(INDEX_NAME, template_name, template_params), None
+    return search_request(VECTOR_MODES[body["mode"]][0], search_body), None
+
+
+def invalid_mode_response():
+    return failure_response(f"Invalid request, mode should be one of {', '.join(VECTOR_MODES)}", "400")
+
+
+def suggest_products(event):
+    """
+    Returns typeahead suggestions for a partially typed product title.
+
+    Runs a bool_prefix query over the search_as_you_type title_suggest field, which
+    is answered from shingle and edge-ngram terms built at index time rather than by
+    expanding prefixes at query time, and returns only a handful of fields per hit.
+
+    Args:
+        event (dict): The Lambda event object containing the text typed so far in the body
+                     Expected body format:
+                     {
+                         "attribute_value": str, # Text typed so far
+                         "size": int            # Optional, number of suggestions (default 5)
+                     }
+
+    Returns:
+        dict: Response object whose result is {"suggestions": [{"id": str, "title": str, ...}]}
+    """
+    if "body" not in event:
+        return failure_response("Invalid request")
+    body = json.loads(event["body"])
+    text = body.get("attribute_value")
+    size = body.get("size", SUGGEST_DEFAULT_SIZE)
+    if not isinstance(text, str):
+        return failure_response("Invalid request, attribute_value should be of type string", "400")
+    if not isinstance(size, int) or not 0 < size <= SUGGEST_MAX_SIZE:
+        return failure_response(
+            f"Invalid request, size should be an integer between 1 and {SUGGEST_MAX_SIZE}", "400"
+        )
+    if not text.strip():
+        return success_response({"suggestions": []})
+
+    response = execute_search(
+        template_request(INDEX_NAME, "suggest", {"attribute_value": text, "size": size})
+    )
+    suggestions = [
+        {"id": hit["_id"], **hit["_source"]} for hit in response["hits"]["hits"]
+    ]
+    return success_response({"suggestions": suggestions})
 
 
 def failure_response(error_message, statusCode="500"):
@@ -500,29 +1020,57 @@ def generate_presigned_url(object_key, expiration=3600):
             LOG.error("S3_BUCKET_NAME environment variable is not set")
             return None
             
+        # reuse a URL while it still has at least half its lifetime left
+        now = time.time()
+        cached = PRESIGN_CACHE.get((object_key, expiration))
+        if cached and cached[1] - now > expiration / 2:
+            return cached[0]
+
         response = s3_client.generate_presigned_url('get_object',
                                                    Params={'Bucket': S3_BUCKET_NAME,
                                                            'Key': object_key},
                                                    ExpiresIn=expiration)
+        if len(PRESIGN_CACHE) >= PRESIGN_CACHE_MAX_ENTRIES:
+            PRESIGN_CACHE.clear()
+        PRESIGN_CACHE[(object_key, expiration)] = (response, now + expiration)
         return response
     except ClientError as e:
         LOG.error(f"Error generating presigned URL for {object_key}: {e}")
         return None
 
-def add_presigned_urls_to_results(search_results):
+def with_presigned_urls(response, image_size=None):
+    """
+    Adds presigned URLs to a search response, logging instead of failing the search
+    if they can't be generated.
+    """
+    try:
+        if 'hits' in response:
+            with STAGE_TIMINGS.stage("presign"):
+                response = add_presigned_urls_to_results(response, image_size)
+    except Exception as e:
+        LOG.error(f"Error adding presigned URLs to search results: {e}")
+    return response
+
+
+def add_presigned_urls_to_results(search_results, image_size=None):
     """
     Add presigned URLs to search results for each hit that has a file_name
     
     :param search_results: OpenSearch search results
+    :param image_size: Optional width in pixels, links the smallest rendition at least
+                       that wide, see image_renditions, instead of the original image
     :return: Modified search results with presigned URLs
     """
-    s3_path = f"images/"
+    s3_path = IMAGE_PREFIX
     
     if 'hits' in search_results and 'hits' in search_results['hits']:
         for hit in search_results['hits']['hits']:
             if '_source' in hit and 'file_name' in hit['_source']:
                 file_name = hit['_source']['file_name']
-                object_key = f"{s3_path}{file_name}"
+                if image_size:
+                    object_key = rendition_key(file_name, rendition_size(image_size))
+                else:
+                    object_key = f"{s3_path}{file_name}"
                 presigned_url = generate_presigned_url(object_key)
                 if presigned_url:
                     hit['_source']['image_url'] = presigned_url
@@ -554,10 +1102,23 @@ def respond(err, res=None):
             "Access-Control-Allow-Methods": "*",
             "Access-Control-Allow-Headers": "Content-Type",
             "Access-Control-Allow-Credentials": "*",
+            # lets browsers expose Server-Timing to cross-origin pages
+            "Timing-Allow-Origin": "*",
         },
     }
 
 
+def timed_respond(err, res=None):
+    """
+    Builds the REST output like respond, timing its serialization and adding the
+    request's stages as a Server-Timing header.
+    """
+    with STAGE_TIMINGS.stage("serialize"):
+        response = respond(err, res)
+    response["headers"]["Server-Timing"] = STAGE_TIMINGS.server_timing()
+    return response
+
+
 def identify_category_color_product_name(search_text):
     """
     Identifies product category from search text using Amazon Bedrock.
@@ -614,16 +1175,72 @@ def handler(event, context):
         f"method=handler, event={event}, message=Opensearch Tutorial starting point"
     )
     if "httpMethod" in event:
-        api_map = {"POST/search": lambda x: search_products(x)}
+        api_map = {
+            "POST/search": lambda x: search_products(x),
+            "POST/search/batch": lambda x: search_batch(x),
+            "POST/suggest": lambda x: suggest_products(x),
+        }
         http_method = event["httpMethod"] if "httpMethod" in event else ""
         api_path = http_method + event["resource"]
+        # routes other than /search are reported by their path, e.g. search_batch
+        STAGE_TIMINGS.reset(event["resource"].strip("/").replace("/", "_"))
         try:
             if api_path in api_map:
                 LOG.info(f"method=handler , api_path={api_path}")
-                return respond(None, api_map[api_path](event))
+                return timed_respond(None, api_map[api_path](event))
             else:
                 LOG.info(f"error=api_not_found , api={api_path}")
-                return respond(failure_response("api_not_supported"), None)
+                return timed_respond(failure_response("api_not_supported"), None)
         except Exception as e:
             LOG.exception(f"error=error_processing_api, api={api_path} , error={e}")
-            return respond(failure_response(f"system_exception: {e}"), None)
+            return timed_respond(failure_response(f"system_exception: {e}"), None)
+        finally:
+            STAGE_TIMINGS.emit()
+            SLOW_QUERIES.finish(STAGE_TIMINGS)
+            COLD_START.flush()
+
+
+def prime():
+    """
+    Warms this execution environment before it takes traffic: imports and creates
+    every client, opens the OpenSearch connection, and fills the embedding and
+    presigned URL caches. A failing step is logged and skipped, never fatal.
+    """
+    steps = [
+        ("opensearch", lambda: ops_client.info()),
+        ("bedrock", get_bedrock_client),
+        ("embeddings", lambda: [embed_query(text) for text in PRIME_QUERIES]),
+        ("presign", lambda: with_presigned_urls(
+            execute_search(template_request(INDEX_NAME, "match_all", {}))
+        )),
+    ]
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            LOG.error(f"method=prime, step={name}, error={e}")
+    LOG.info(f"method=prime, initialization_type={INITIALIZATION_TYPE}, message=primed")
+
+
+def after_restore():
+    """
+    Runs when a SnapStart snapshot is restored. Connections captured in the snapshot
+    are closed and reopened, and presigned URLs signed with the snapshot's
+    credentials are dropped, as are generation tokens read before the snapshot.
+    """
+    PRESIGN_CACHE.clear()
+    GENERATION_CACHE.clear()
+    try:
+        ops_client.transport.close()
+        ops_client.info()
+    except Exception as e:
+        LOG.error(f"method=after_restore, error={e}")
+
+
+if INITIALIZATION_TYPE == "snap-start":
+    from snapshot_restore_py import register_after_restore, register_before_snapshot
+
+    register_before_snapshot(prime)
+    register_after_restore(after_restore)
+elif INITIALIZATION_TYPE == "provisioned-concurrency":
+    prime()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from os import getenv
+
+LOG = logging.getLogger()
+
+RESULT_CACHE_ENABLED = getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_BYTES = int(getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+def cache_key(index, search_body):
+    """
+    Builds the cache key for a search request.
+
+    Args:
+        index (str): The index the search runs against
+        search_body (dict): The OpenSearch request body
+
+    Returns:
+        str: A digest of the canonicalized (sorted keys, compact separators) index and body
+    """
+    canonical = json.dumps(
+        {"index": index, "body": search_body},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    In-process LRU cache of search responses, bounded by entry count and by the
+    total size of the serialized responses it holds.
+
+    Every entry is stored with the index generation token that was current when it
+    was computed. A lookup with a different token evicts the entry instead of
+    returning it, so a bulk load or delete invalidates everything cached before it.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, generation):
+        """
+        Returns a private copy of the cached response for key, or None on a miss
+        or when the entry was computed against another generation.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry_generation, payload = entry
+        if entry_generation != generation:
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return json.loads(payload)
+
+    def put(self, key, generation, result):
+        """
+        Stores result for key, evicting least recently used entries until both
+        bounds hold again. Results larger than the whole byte budget are skipped.
+        """
+        payload = json.dumps(result, separators=(",", ":"), default=str)
+        if len(payload) > self.max_bytes:
+            LOG.info(f"method=ResultCache.put, message=result too large to cache, size={len(payload)}")
+            return
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (generation, payload)
+        self.size_bytes += len(payload)
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def _evict(self, key):
+        _, payload = self._entries.pop(key)
+        self.size_bytes -= len(payload)
@@ -0,0 +1,99 @@
+import copy
+
+# Longest query description kept in a condensed profile, Lucene descriptions of
+# kNN and large bool queries can run to many kilobytes
+PROFILE_DESCRIPTION_MAX_CHARS = 200
+
+
+def nanos_to_ms(nanos):
+    return round(nanos / 1_000_000, 3)
+
+
+def profiled_request(request):
+    """
+    Returns a copy of a prepared request that asks OpenSearch to profile the search.
+    Search templates take the flag next to the template id and params.
+    """
+    request = copy.deepcopy(request)
+    request["body"]["profile"] = True
+    return request
+
+
+def is_knn(query):
+    return "knn" in query.get("type", "").lower()
+
+
+def split_knn_time(query):
+    """
+    Splits the time of a profiled query tree into kNN and lexical time.
+
+    A kNN query counts fully as kNN time. A query with kNN queries beneath it, such
+    as a hybrid query, is split across its children, dropping its own overhead.
+    Anything else counts fully as lexical time.
+
+    Returns:
+        tuple: (knn_nanos, lexical_nanos)
+    """
+    if is_knn(query):
+        return query["time_in_nanos"], 0
+    children = query.get("children", [])
+    if not any(contains_knn(child) for child in children):
+        return 0, query["time_in_nanos"]
+    knn_nanos = lexical_nanos = 0
+    for child in children:
+        child_knn, child_lexical = split_knn_time(child)
+        knn_nanos += child_knn
+        lexical_nanos += child_lexical
+    return knn_nanos, lexical_nanos
+
+
+def contains_knn(query):
+    return is_knn(query) or any(contains_knn(child) for child in query.get("children", []))
+
+
+def condense_profile(profile):
+    """
+    Condenses a Profile API response to a per-shard summary.
+
+    Args:
+        profile (dict): The "profile" section of a search response
+
+    Returns:
+        dict: {"shards": [...]} with, per shard, its query, rewrite, collector and
+              aggregation times in milliseconds, the kNN/lexical split of the query
+              time, and the top level queries with their own times
+    """
+    shards = []
+    for shard in profile.get("shards", []):
+        query_nanos = rewrite_nanos = collector_nanos = 0
+        knn_nanos = lexical_nanos = 0
+        queries = []
+        for search in shard.get("searches", []):
+            rewrite_nanos += search.get("rewrite_time", 0)
+            for query in search.get("query", []):
+                query_nanos += query["time_in_nanos"]
+                query_knn, query_lexical = split_knn_time(query)
+                knn_nanos += query_knn
+                lexical_nanos += query_lexical
+                queries.append({
+                    "type": query.get("type"),
+                    "description": query.get("description", "")[:PROFILE_DESCRIPTION_MAX_CHARS],
+                    "time_ms": nanos_to_ms(query["time_in_nanos"]),
+                })
+            collector_nanos += sum(
+                collector["time_in_nanos"] for collector in search.get("collector", [])
+            )
+        aggregation_nanos = sum(
+            aggregation["time_in_nanos"] for aggregation in shard.get("aggregations", [])
+        )
+        shards.append({
+            "id": shard.get("id"),
+            "query_ms": nanos_to_ms(query_nanos),
+            "knn_ms": nanos_to_ms(knn_nanos),
+            "lexical_ms": nanos_to_ms(lexical_nanos),
+            "rewrite_ms": nanos_to_ms(rewrite_nanos),
+            "collector_ms": nanos_to_ms(collector_nanos),
+            "aggregation_ms": nanos_to_ms(aggregation_nanos),
+            "queries": queries,
+        })
+    return {"shards": shards}
@@ -0,0 +1,151 @@
+from os import getenv
+
+from mustache import render_mustache
+
+SEARCH_TEMPLATE_PREFIX = getenv("SEARCH_TEMPLATE_PREFIX", "products")
+
+# Mustache sources for the stored search templates used by search_products.
+# Each entry is (version, source). Bump the version whenever a source changes so the
+# new shape is registered under a new id instead of overwriting one that running
+# Lambdas still reference.
+# Placeholders are separated from closing braces by a space so "}}}" is never
+# mistaken for a triple mustache.
+SEARCH_TEMPLATES = {
+    "multi_match": ("v1", """{
+        "size": 100,
+        "query": {
+            "multi_match": {
+                "query": {{#toJson}}attribute_value{{/toJson}},
+                "fields": {{#toJson}}fields{{/toJson}},
+                "type": "phrase_prefix"
+            }
+        }
+    }"""),
+    "wildcard_match": ("v1", """{
+        "size": 100,
+        "query": {
+            "wildcard": {
+                "{{attribute_name}}": {
+                    "value": {{#toJson}}attribute_value{{/toJson}},
+                    "case_insensitive": {{case_insensitive}}
+                }
+            }
+        }
+    }"""),
+    "match": ("v1", """{
+        "size": 100,
+        "query": {
+            "match": {
+                "{{attribute_name}}": {
+                    "query": {{#toJson}}attribute_value{{/toJson}}
+                }
+            }
+        }
+    }"""),
+    "match_minimum_should_match": ("v1", """{
+        "size": 100,
+        "query": {
+            "match": {
+                "{{attribute_name}}": {
+                    "query": {{#toJson}}attribute_value{{/toJson}},
+                    "minimum_should_match": {{#toJson}}minimum_should_match{{/toJson}}
+                }
+            }
+        }
+    }"""),
+    "prefix_match": ("v1", """{
+        "size": 100,
+        "query": {
+            "match_phrase_prefix": {
+                "{{attribute_name}}": {
+                    "query": {{#toJson}}attribute_value{{/toJson}},
+                    "max_expansions": 10,
+                    "slop": 1
+                }
+            }
+        }
+    }"""),
+    "range_filter": ("v1", """{
+        "size": 100,
+        "query": {
+            "range": {
+                "{{attribute_name}}": {
+                    "{{operator}}": {{#toJson}}attribute_value{{/toJson}}
+                }
+            }
+        }
+    }"""),
+    "match_all": ("v1", """{
+        "size": 100,
+        "query": {"match_all": {}}
+    }"""),
+    "suggest": ("v1", """{
+        "size": {{size}},
+        "track_total_hits": false,
+        "_source": ["title", "category", "color", "price", "file_name"],
+        "query": {
+            "multi_match": {
+                "query": {{#toJson}}attribute_value{{/toJson}},
+                "type": "bool_prefix",
+                "fields": ["title_suggest", "title_suggest._2gram", "title_suggest._3gram"]
+            }
+        }
+    }"""),
+    # The text clause lives in the template; the per-field clauses depend on the
+    # request's field list and are passed in pre-built. They are nested in their own
+    # bool, which scores as the sum of its clauses exactly like the flat must list.
+    "complex_search": ("v1", """{
+        "query": {
+            "bool": {
+                "must": [
+                    {{#has_search_value}}
+                    {
+                        "multi_match": {
+                            "query": {{#toJson}}search_value{{/toJson}},
+                            "fields": ["title^3", "description^2", "color"],
+                            "type": "{{text_type}}"
+                            {{#fuzzy}}
+                            , "fuzziness": "AUTO",
+                            "prefix_length": 2,
+                            "fuzzy_transpositions": true
+                            {{/fuzzy}}
+                        }
+                    }
+                    {{/has_search_value}}
+                    {{#has_both}} , {{/has_both}}
+                    {{#has_must_clauses}}
+                    {"bool": {"must": {{#toJson}}must_clauses{{/toJson}} } }
+                    {{/has_must_clauses}}
+                ]
+                {{#has_should_clauses}}
+                , "should": {{#toJson}}should_clauses{{/toJson}},
+                "minimum_should_match": 1
+                {{/has_should_clauses}}
+            }
+        }
+    }"""),
+}
+
+
+def template_id(name):
+    """
+    Returns the versioned stored script id for the template called name.
+    """
+    version, _ = SEARCH_TEMPLATES[name]
+    return f"{SEARCH_TEMPLATE_PREFIX}_{name}_{version}"
+
+
+def template_script(name):
+    """
+    Returns the body for registering the template called name with put_script.
+    """
+    _, source = SEARCH_TEMPLATES[name]
+    return {"script": {"lang": "mustache", "source": source}}
+
+
+def render_template(name, params):
+    """
+    Returns the search the template called name expands to with params.
+    """
+    _, source = SEARCH_TEMPLATES[name]
+    return render_mustache(source, params)
@@ -0,0 +1,198 @@
+import copy
+import hashlib
+import json
+import logging
+import math
+from collections import OrderedDict
+from os import getenv
+
+LOG = logging.getLogger()
+
+# Off by default: a hit returns the results of a similar query, not this one
+SEMANTIC_CACHE_ENABLED = getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_MAX_ENTRIES = int(getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+# Least cosine similarity between two query embeddings for one to reuse the other's results
+SEMANTIC_CACHE_THRESHOLD = float(getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Without NumPy every lookup scores entries in a Python loop, these bounds keep it
+# well under the cost of the search it saves
+SEMANTIC_CACHE_PURE_PYTHON_MAX_ENTRIES = int(getenv("SEMANTIC_CACHE_PURE_PYTHON_MAX_ENTRIES", "64"))
+SEMANTIC_CACHE_PURE_PYTHON_MAX_DIMENSIONS = int(getenv("SEMANTIC_CACHE_PURE_PYTHON_MAX_DIMENSIONS", "256"))
+
+try:
+    import numpy as np
+except ImportError:  # the Lambda layers don't ship NumPy, lookups fall back to plain Python
+    np = None
+
+
+def split_query_vector(index, search_body):
+    """
+    Separates the kNN query vector from the rest of a search request.
+
+    Returns:
+        tuple: (vector, scope) where scope is a digest of the index and the body
+               without the vector, or (None, None) when the body doesn't hold
+               exactly one kNN query
+    """
+    body = copy.deepcopy(search_body)
+    found = []
+
+    def strip(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "knn" and isinstance(value, dict):
+                    for options in value.values():
+                        if isinstance(options, dict) and "vector" in options:
+                            found.append(options["vector"])
+                            options["vector"] = None
+                else:
+                    strip(value)
+        elif isinstance(node, list):
+            for value in node:
+                strip(value)
+
+    strip(body)
+    if len(found) != 1:
+        return None, None
+    canonical = json.dumps({"index": index, "body": body}, sort_keys=True, separators=(",", ":"), default=str)
+    return found[0], hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """
+    Finds a recent search whose query embedding is within SEMANTIC_CACHE_THRESHOLD
+    cosine similarity of a new one, so paraphrases like "red running shoe for women"
+    and "women's red running shoes" share results.
+
+    Only the ResultCache keys are held here, responses stay in the ResultCache.
+    Embeddings are kept normalized in one preallocated matrix, a row per entry,
+    and a lookup scores them all with a single matrix-vector product. Only entries
+    with the same scope, the same search apart from its vector, can match.
+
+    Every entry carries the index generation it was computed against. A lookup
+    evicts the entries of its scope from other generations, and beyond
+    max_entries the least recently used entry is evicted.
+
+    Without NumPy, as in the Lambda layers, the cache holds at most
+    SEMANTIC_CACHE_PURE_PYTHON_MAX_ENTRIES and ignores vectors wider than
+    SEMANTIC_CACHE_PURE_PYTHON_MAX_DIMENSIONS.
+    """
+
+    def __init__(self, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, threshold=SEMANTIC_CACHE_THRESHOLD):
+        if np is None and max_entries > SEMANTIC_CACHE_PURE_PYTHON_MAX_ENTRIES:
+            LOG.warning(
+                f"method=SemanticCache, message=NumPy is not installed, capping entries, "
+                f"max_entries={SEMANTIC_CACHE_PURE_PYTHON_MAX_ENTRIES}"
+            )
+            max_entries = SEMANTIC_CACHE_PURE_PYTHON_MAX_ENTRIES
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._warned_dimensions = False
+        self.clear()
+
+    def lookup(self, scope, vector, generation):
+        """
+        Returns (result cache key, similarity) of the most similar entry in scope
+        at generation, or (None, similarity of the best one) when none is similar enough.
+        """
+        if not self._entries or len(vector) != self.dimensions:
+            return None, None
+        query = self._normalize(vector)
+        rows = self._rows_in_scope(scope)
+        stale = [row for row in rows if self._generations[row] != generation]
+        for row in stale:
+            self._evict(self._keys[row])
+        rows = [row for row in rows if self._generations[row] == generation]
+        if not rows:
+            return None, None
+        if np is not None:
+            similarities = self._vectors[rows] @ np.asarray(query, dtype=np.float32)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+        else:
+            similarities = [sum(a * b for a, b in zip(self._vectors[row], query)) for row in rows]
+            best = max(range(len(rows)), key=similarities.__getitem__)
+            similarity = similarities[best]
+        if similarity < self.threshold:
+            return None, similarity
+        key = self._keys[rows[best]]
+        self._entries.move_to_end(key)
+        return key, similarity
+
+    def put(self, key, scope, vector, generation):
+        if self.max_entries <= 0:
+            return
+        if np is None and len(vector) > SEMANTIC_CACHE_PURE_PYTHON_MAX_DIMENSIONS:
+            if not self._warned_dimensions:
+                LOG.warning(
+                    f"method=SemanticCache.put, message=NumPy is not installed, not caching vectors wider than "
+                    f"{SEMANTIC_CACHE_PURE_PYTHON_MAX_DIMENSIONS}, dimensions={len(vector)}"
+                )
+                self._warned_dimensions = True
+            return
+        if key in self._entries:
+            self._evict(key)
+        if not self._free:
+            self._evict(next(iter(self._entries)))
+        if self._vectors is None:
+            self._allocate(len(vector))
+        elif len(vector) != self.dimensions:
+            LOG.info(f"method=SemanticCache.put, message=dimension changed, clearing, dimensions={len(vector)}")
+            self.clear()
+            self._allocate(len(vector))
+        row = self._free.pop()
+        self._vectors[row] = self._normalize(vector)
+        if self._scope_ids is not None:
+            self._scope_ids[row] = scope_id(scope)
+        self._keys[row] = key
+        self._scopes[row] = scope
+        self._generations[row] = generation
+        self._entries[key] = row
+
+    def discard(self, key):
+        """Forgets key, whose response the ResultCache no longer holds."""
+        if key in self._entries:
+            self._evict(key)
+
+    def clear(self):
+        # result cache key -> row, in least to most recently used order
+        self._entries = OrderedDict()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self._keys = [None] * self.max_entries
+        self._scopes = [None] * self.max_entries
+        self._generations = [None] * self.max_entries
+        self._vectors = None
+        self._scope_ids = None
+        self.dimensions = None
+
+    def _allocate(self, dimensions):
+        self.dimensions = dimensions
+        if np is not None:
+            self._vectors = np.zeros((self.max_entries, dimensions), dtype=np.float32)
+            self._scope_ids = np.full(self.max_entries, -1, dtype=np.int64)
+        else:
+            self._vectors = [[0.0] * dimensions for _ in range(self.max_entries)]
+
+    def _rows_in_scope(self, scope):
+        if self._scope_ids is not None:
+            rows = np.flatnonzero(self._scope_ids == scope_id(scope)).tolist()
+            return [row for row in rows if self._scopes[row] == scope]
+        return [row for row in self._entries.values() if self._scopes[row] == scope]
+
+    def _normalize(self, vector):
+        if np is not None:
+            array = np.asarray(vector, dtype=np.float32)
+            return array / (float(np.linalg.norm(array)) or 1.0)
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _evict(self, key):
+        row = self._entries.pop(key)
+        if self._scope_ids is not None:
+            self._scope_ids[row] = -1
+        self._keys[row] = self._scopes[row] = self._generations[row] = None
+        self._free.append(row)
+
+
+def scope_id(scope):
+    """A scope as a non-negative int64, so the scopes of all rows compare at once."""
+    return int.from_bytes(hashlib.blake2b(scope.encode("utf-8"), digest_size=8).digest(), "little") >> 1
@@ -0,0 +1,211 @@
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from os import getenv
+
+from opensearch_clients import CLIENT_BACKEND, REGION, aws_client_config, get_opensearch_client, get_s3_client, get_session
+from result_cache import cache_key
+from search_templates import render_template
+
+LOG = logging.getLogger()
+
+# "opensearch", "s3", or "none" to capture nothing
+SLOW_QUERY_SINK = getenv("SLOW_QUERY_SINK", "none")
+SLOW_QUERY_THRESHOLD_MS = float(getenv("SLOW_QUERY_THRESHOLD_MS", "1000"))
+# Per stage thresholds as a JSON object, e.g. {"opensearch": 500, "embedding": 300}
+SLOW_QUERY_STAGE_THRESHOLDS_MS = json.loads(getenv("SLOW_QUERY_STAGE_THRESHOLDS_MS", "{}"))
+SLOW_QUERY_BUFFER_SIZE = int(getenv("SLOW_QUERY_BUFFER_SIZE", "200"))
+SLOW_QUERY_FLUSH_SIZE = int(getenv("SLOW_QUERY_FLUSH_SIZE", "20"))
+SLOW_QUERY_FLUSH_INTERVAL_SECONDS = int(getenv("SLOW_QUERY_FLUSH_INTERVAL_SECONDS", "60"))
+# Longest a flush may hold up an invocation, a batch that takes longer is retried on the next one
+SLOW_QUERY_FLUSH_TIMEOUT_SECONDS = float(getenv("SLOW_QUERY_FLUSH_TIMEOUT_SECONDS", "1"))
+SLOW_QUERY_INDEX_NAME = getenv("SLOW_QUERY_INDEX_NAME", "products_slow_queries")
+SLOW_QUERY_S3_PREFIX = getenv("SLOW_QUERY_S3_PREFIX", "slow-queries/")
+S3_BUCKET_NAME = getenv("S3_BUCKET_NAME")
+
+_s3_client = None
+
+
+def hit_count(response):
+    total = response.get("hits", {}).get("total")
+    if isinstance(total, dict):
+        return total.get("value")
+    if total is not None:
+        return total
+    return len(response.get("hits", {}).get("hits", []))
+
+
+def search_body(request):
+    """
+    Returns the body request searches with, rendered from its stored template for
+    template searches. A template that can't be rendered is kept as its id and params.
+    """
+    if "template" not in request:
+        return request["body"]
+    try:
+        return render_template(request["template"], request["body"].get("params", {}))
+    except Exception as e:
+        LOG.warning(f"method=search_body, template={request['template']}, error={e}")
+        return request["body"]
+
+
+def get_flush_s3_client():
+    """
+    Returns the S3 client flushes write with, which gives up after
+    SLOW_QUERY_FLUSH_TIMEOUT_SECONDS instead of retrying.
+    """
+    global _s3_client
+    if _s3_client is None:
+        if CLIENT_BACKEND == "emulator":
+            _s3_client = get_s3_client()
+        else:
+            from botocore.config import Config
+
+            _s3_client = get_session().client("s3", region_name=REGION, config=aws_client_config().merge(Config(
+                connect_timeout=SLOW_QUERY_FLUSH_TIMEOUT_SECONDS,
+                read_timeout=SLOW_QUERY_FLUSH_TIMEOUT_SECONDS,
+                retries={"max_attempts": 1},
+            )))
+    return _s3_client
+
+
+class SlowQueryLog:
+    """
+    Captures searches slower than SLOW_QUERY_THRESHOLD_MS in total, or than any
+    threshold in SLOW_QUERY_STAGE_THRESHOLDS_MS for a single stage.
+
+    Captures go into a ring buffer of SLOW_QUERY_BUFFER_SIZE, dropping the oldest
+    when the sink falls behind, and are written as one batch once SLOW_QUERY_FLUSH_SIZE
+    have accumulated or the oldest is SLOW_QUERY_FLUSH_INTERVAL_SECONDS old. A batch
+    is written before the invocation ends, as Lambda freezes anything left running
+    once it returns, and waits at most SLOW_QUERY_FLUSH_TIMEOUT_SECONDS for the sink.
+    Each capture keeps the search's DSL, rendered from its template for template
+    searches, so it can be replayed as an inline search against its index.
+    """
+
+    def __init__(self, sink=SLOW_QUERY_SINK):
+        self.sink = sink
+        self.buffer = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+        self.pending = []
+        self.oldest = None
+        self._index_ready = False
+
+    def track(self, request, response):
+        """
+        Remembers a request sent to OpenSearch and its response, to be checked
+        against the thresholds once the invocation's timings are complete. Called
+        for every search the invocation sends, single, batched or profiled.
+        """
+        if self.sink != "none":
+            self.pending.append((request, response))
+
+    def finish(self, timings):
+        """
+        Captures the searches tracked during the invocation if timings cross a
+        threshold, then flushes the buffer if a batch is due. Called once per
+        invocation, after the response is built.
+        """
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        total = timings.total()
+        slow_stages = [
+            name for name, threshold in SLOW_QUERY_STAGE_THRESHOLDS_MS.items()
+            if timings.stages.get(name, 0) > threshold
+        ]
+        if total > SLOW_QUERY_THRESHOLD_MS or slow_stages:
+            for request, response in pending:
+                body = search_body(request)
+                self.capture({
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "fingerprint": cache_key(request["index"], body),
+                    "index": request["index"],
+                    "search_type": timings.search_type,
+                    "mode": timings.mode,
+                    "hits": hit_count(response),
+                    "took": response.get("took"),
+                    "total_ms": total,
+                    "stages": dict(timings.stages),
+                    "slow_stages": slow_stages,
+                    "dsl": json.dumps(body, sort_keys=True, separators=(",", ":"), default=str),
+                })
+        if self.buffer and (
+            len(self.buffer) >= SLOW_QUERY_FLUSH_SIZE
+            or time.time() - self.oldest >= SLOW_QUERY_FLUSH_INTERVAL_SECONDS
+        ):
+            self.flush()
+
+    def capture(self, record):
+        if not self.buffer:
+            self.oldest = time.time()
+        self.buffer.append(record)
+
+    def flush(self):
+        """
+        Writes every buffered capture to the sink. On failure or timeout they stay
+        buffered for the next flush, within the ring buffer's bound.
+        """
+        if not self.buffer:
+            return
+        records = list(self.buffer)
+        try:
+            if self.sink == "s3":
+                self.write_to_s3(records)
+            else:
+                self.write_to_opensearch(records)
+        except Exception as e:
+            LOG.error(f"method=SlowQueryLog.flush, sink={self.sink}, records={len(records)}, error={e}")
+            return
+        self.buffer.clear()
+        self.oldest = None
+        LOG.info(f"method=SlowQueryLog.flush, sink={self.sink}, records={len(records)}")
+
+    def write_to_s3(self, records):
+        now = datetime.now(timezone.utc)
+        key = f"{SLOW_QUERY_S3_PREFIX}{now:%Y/%m/%d/%H%M%S}-{records[0]['fingerprint'][:12]}.ndjson"
+        body = "\n".join(json.dumps(record, default=str) for record in records) + "\n"
+        get_flush_s3_client().put_object(Bucket=S3_BUCKET_NAME, Key=key, Body=body.encode("utf-8"))
+
+    def write_to_opensearch(self, records):
+        client = get_opensearch_client()
+        if not self._index_ready:
+            self.create_index(client)
+        lines = []
+        for record in records:
+            lines.append({"index": {"_index": SLOW_QUERY_INDEX_NAME}})
+            lines.append(record)
+        res = client.bulk(body=lines, request_timeout=SLOW_QUERY_FLUSH_TIMEOUT_SECONDS)
+        if res.get("errors"):
+            raise RuntimeError(f"bulk reported errors for {SLOW_QUERY_INDEX_NAME}")
+
+    def create_index(self, client):
+        """
+        Creates SLOW_QUERY_INDEX_NAME if it doesn't exist. The DSL is kept as an
+        unindexed string, so captured queries never grow the mapping.
+        """
+        client.indices.create(index=SLOW_QUERY_INDEX_NAME, ignore=[400], request_timeout=SLOW_QUERY_FLUSH_TIMEOUT_SECONDS, body={
+            "mappings": {
+                "dynamic_templates": [{
+                    "stage_durations": {"path_match": "stages.*", "mapping": {"type": "float"}}
+                }],
+                "properties": {
+                    "timestamp": {"type": "date"},
+                    "fingerprint": {"type": "keyword"},
+                    "index": {"type": "keyword"},
+                    "search_type": {"type": "keyword"},
+                    "mode": {"type": "keyword"},
+                    "hits": {"type": "long"},
+                    "took": {"type": "long"},
+                    "total_ms": {"type": "float"},
+                    "stages": {"type": "object"},
+                    "slow_stages": {"type": "keyword"},
+                    "dsl": {"type": "text", "index": False},
+                }
+            }
+        })
+        self._index_ready = True
+
+
+SLOW_QUERIES = SlowQueryLog()
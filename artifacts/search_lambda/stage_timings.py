@@ -0,0 +1,80 @@
+import json
+import time
+from contextlib import contextmanager
+from os import getenv
+
+from coldstart import METRICS_NAMESPACE, to_ms
+
+STAGE_METRICS_ENABLED = getenv("STAGE_METRICS_ENABLED", "true").lower() == "true"
+
+
+class StageTimings:
+    """
+    Per-request stage timers for the search Lambda.
+
+    Stages are accumulated by name while a request runs, so a stage entered more
+    than once (an embedding per batched search, say) reports its total. The result
+    is logged as a CloudWatch Embedded Metric Format (EMF) record dimensioned by
+    search type and mode, and rendered as a Server-Timing header.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, search_type="unknown", mode="default"):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.search_type = search_type
+        self.mode = mode
+
+    def set_dimensions(self, search_type, mode):
+        self.search_type = search_type
+        self.mode = mode
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, to_ms(time.perf_counter() - start))
+
+    def record(self, name, milliseconds):
+        self.stages[name] = round(self.stages.get(name, 0) + milliseconds, 3)
+
+    def total(self):
+        return to_ms(time.perf_counter() - self.started)
+
+    def server_timing(self):
+        """
+        Returns the stages, and the total so far, as a Server-Timing header value.
+        """
+        timings = {**self.stages, "total": self.total()}
+        return ", ".join(f"{name};dur={duration}" for name, duration in timings.items())
+
+    def emit(self):
+        """
+        Logs the stages and total duration of the request as an EMF record.
+        """
+        if not STAGE_METRICS_ENABLED:
+            return
+        metrics = {f"StageDuration_{name}": duration for name, duration in self.stages.items()}
+        metrics["TotalDuration"] = self.total()
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["SearchType", "Mode"]],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in metrics],
+                }],
+            },
+            "SearchType": self.search_type,
+            "Mode": self.mode,
+            **metrics,
+        }
+        # EMF records are picked up from stdout
+        print(json.dumps(record))
+
+
+STAGE_TIMINGS = StageTimings()
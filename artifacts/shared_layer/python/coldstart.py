@@ -0,0 +1,116 @@
+import builtins
+import json
+import sys
+import time
+from contextlib import contextmanager
+from os import getenv
+
+METRICS_NAMESPACE = getenv("METRICS_NAMESPACE", "OpensearchTutorials")
+# number of imports, by cumulative time, logged with the cold start record
+COLD_START_TOP_IMPORTS = int(getenv("COLD_START_TOP_IMPORTS", "25"))
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class ColdStartProfiler:
+    """
+    Records what an execution environment spends its init time on and logs it as
+    CloudWatch Embedded Metric Format (EMF), so init regressions show up on a dashboard.
+
+    Imports are timed by wrapping builtins.__import__ between start_import_profiling
+    and stop_import_profiling, giving an "-X importtime" style self/cumulative
+    breakdown. Client creation is timed through measure_client, which catches lazily
+    created clients whenever the first route that needs them runs.
+    """
+
+    def __init__(self):
+        self.cold = True
+        self.import_seconds = 0.0
+        self.imports = []
+        self.pending_clients = {}
+        self._stack = []
+        self._original_import = None
+        self._import_started = 0.0
+
+    def start_import_profiling(self):
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        self._import_started = time.perf_counter()
+        builtins.__import__ = self._timed_import
+
+    def stop_import_profiling(self):
+        if self._original_import is None:
+            return
+        builtins.__import__ = self._original_import
+        self._original_import = None
+        self.import_seconds += time.perf_counter() - self._import_started
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports.append((name, elapsed - children, elapsed))
+
+    @contextmanager
+    def measure_client(self, name):
+        """
+        Times the creation of the client called name, including any imports it
+        triggers, and queues it for the next flush.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pending_clients[name] = time.perf_counter() - start
+
+    def flush(self):
+        """
+        Logs an EMF record for everything measured since the last flush: the import
+        breakdown on the first invocation, and any client created since then.
+        """
+        if not self.cold and not self.pending_clients:
+            return
+        metrics = {}
+        if self.cold:
+            metrics["ImportDuration"] = to_ms(self.import_seconds)
+        for name, seconds in self.pending_clients.items():
+            metrics[f"ClientInitDuration_{name}"] = to_ms(seconds)
+        metrics["InitDuration"] = round(sum(metrics.values()), 3)
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["FunctionName"]],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in metrics],
+                }],
+            },
+            "FunctionName": getenv("AWS_LAMBDA_FUNCTION_NAME", "local"),
+            "ColdStart": self.cold,
+            **metrics,
+        }
+        if self.cold:
+            slowest = sorted(self.imports, key=lambda item: item[2], reverse=True)
+            record["Imports"] = [
+                {"module": module, "self_ms": to_ms(own), "cumulative_ms": to_ms(cumulative)}
+                for module, own, cumulative in slowest[:COLD_START_TOP_IMPORTS]
+            ]
+        # EMF records are picked up from stdout
+        print(json.dumps(record))
+        self.cold = False
+        self.pending_clients = {}
+
+
+COLD_START = ColdStartProfiler()
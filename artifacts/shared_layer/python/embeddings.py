@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from os import getenv
+
+LOG = logging.getLogger()
+
+# "bedrock", or "hashing" / "random_projection" for deterministic local vectors
+EMBEDDING_PROVIDER = getenv("EMBEDDING_PROVIDER", "bedrock")
+# Must match the dimension of the knn_vector fields in the vector indices
+EMBEDDING_DIMENSIONS = int(getenv("EMBEDDING_DIMENSIONS", "1024"))
+EMBEDDING_SEED = int(getenv("EMBEDDING_SEED", "0"))
+MODEL_ID = getenv("MODEL_ID", "cohere.embed-english-v3")
+# Most texts Cohere embed accepts in one request
+COHERE_MAX_TEXTS = 96
+# Embedding types a provider returns: float vectors, int8 vectors scaled to -128..127,
+# and binary vectors, one sign bit per dimension packed 8 to a signed byte
+EMBEDDING_TYPES = ("float", "int8", "binary")
+
+
+def words(text):
+    return re.findall(r"\w+", str(text).lower())
+
+
+def features(text):
+    """Words and adjacent word pairs, so word order contributes a little."""
+    tokens = words(text)
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] or [str(text)]
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def quantize(vector, embedding_type):
+    """
+    Returns a float vector as embedding_type, for models that only return floats.
+
+    int8 scales the vector so its largest magnitude is 127 and rounds. binary keeps
+    the sign of each dimension, set for positive values, packs the bits of 8
+    dimensions per byte, first dimension in the most significant bit, and offsets the
+    bytes by -128 to a signed int8, as Cohere's "binary" type and the OpenSearch
+    binary knn_vector expect. The offset flips the same bit in every byte, so Hamming
+    distances are those of the unsigned packing.
+    """
+    if embedding_type == "float":
+        return vector
+    if embedding_type == "int8":
+        scale = 127.0 / (max(abs(value) for value in vector) or 1.0)
+        return [max(-128, min(127, round(value * scale))) for value in vector]
+    if embedding_type == "binary":
+        packed = []
+        for start in range(0, len(vector), 8):
+            byte = 0
+            for value in vector[start:start + 8]:
+                byte = byte << 1 | (value > 0)
+            packed.append((byte << 8 - len(vector[start:start + 8])) - 128)
+        return packed
+    raise ValueError(f"Unknown embedding type {embedding_type}, use one of {', '.join(EMBEDDING_TYPES)}")
+
+
+class EmbeddingProvider(ABC):
+    """
+    Turns texts into embedding vectors.
+
+    input_type follows Cohere: "search_document" for catalog text being indexed and
+    "search_query" for search text. Providers that embed both the same way ignore it.
+    """
+
+    name = None
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed(self, texts, input_type="search_document", embedding_type="float"):
+        """
+        Returns one vector per text, in order, of embedding_type.
+        """
+        return self.embed_types(texts, input_type, [embedding_type])[embedding_type]
+
+    def embed_types(self, texts, input_type="search_document", embedding_types=("float",)):
+        """
+        Returns a dict of embedding type to one vector per text, embedding each text
+        once for all embedding_types.
+        """
+        vectors = self.embed_floats(texts, input_type)
+        return {
+            embedding_type: [quantize(vector, embedding_type) for vector in vectors]
+            for embedding_type in embedding_types
+        }
+
+    @abstractmethod
+    def embed_floats(self, texts, input_type="search_document"):
+        """
+        Returns one float vector per text, in order.
+        """
+
+
+class BedrockEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeds with a Bedrock model: Cohere embed in batches of up to COHERE_MAX_TEXTS,
+    returning every requested embedding type natively, or a Titan text embedding
+    model one text at a time, whose float vectors are quantized here.
+    """
+
+    name = "bedrock"
+
+    def __init__(self, bedrock_client, model_id=MODEL_ID, dimensions=EMBEDDING_DIMENSIONS):
+        super().__init__(dimensions)
+        self.bedrock_client = bedrock_client
+        self.model_id = model_id
+
+    def embed_types(self, texts, input_type="search_document", embedding_types=("float",)):
+        if not self.model_id.startswith("cohere."):
+            return super().embed_types(texts, input_type, embedding_types)
+        vectors = {embedding_type: [] for embedding_type in embedding_types}
+        for start in range(0, len(texts), COHERE_MAX_TEXTS):
+            body = self.invoke({
+                "texts": texts[start:start + COHERE_MAX_TEXTS],
+                "input_type": input_type,
+                "truncate": "END",
+                "embedding_types": list(embedding_types),
+            })
+            for embedding_type in embedding_types:
+                vectors[embedding_type].extend(body["embeddings"][embedding_type])
+        return vectors
+
+    def embed_floats(self, texts, input_type="search_document"):
+        return [self.invoke({"inputText": text})["embedding"] for text in texts]
+
+    def invoke(self, request):
+        response = self.bedrock_client.invoke_model(
+            modelId=self.model_id,
+            accept='application/json',
+            contentType='application/json',
+            body=json.dumps(request)
+        )
+        return json.loads(response.get('body').read())
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Hashes each word and word pair into a signed bucket, the feature hashing trick,
+    and normalizes the result. Texts sharing words get a positive cosine similarity,
+    so kNN results follow lexical overlap.
+    """
+
+    name = "hashing"
+
+    def embed_floats(self, texts, input_type="search_document"):
+        return [self.embed_text(text) for text in texts]
+
+    def embed_text(self, text):
+        vector = [0.0] * self.dimensions
+        for feature in features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        return normalize(vector)
+
+
+class RandomProjectionEmbeddingProvider(EmbeddingProvider):
+    """
+    Projects a text's bag of words onto a dense space: every word and word pair maps
+    to a fixed Gaussian vector, seeded from EMBEDDING_SEED and the feature itself, and
+    a text is the normalized sum of its features' vectors. Unlike hashing, every
+    dimension is used, which gives kNN indices a realistic value distribution.
+    """
+
+    name = "random_projection"
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS, seed=EMBEDDING_SEED):
+        super().__init__(dimensions)
+        self.seed = seed
+        self.feature_vector = lru_cache(maxsize=65536)(self._feature_vector)
+
+    def _feature_vector(self, feature):
+        digest = hashlib.blake2b(f"{self.seed}:{feature}".encode("utf-8"), digest_size=8).digest()
+        generator = random.Random(int.from_bytes(digest, "little"))
+        return [generator.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+
+    def embed_floats(self, texts, input_type="search_document"):
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            for feature in features(text):
+                for position, value in enumerate(self.feature_vector(feature)):
+                    vector[position] += value
+            vectors.append(normalize(vector))
+        return vectors
+
+
+def create_embedding_provider(name=EMBEDDING_PROVIDER, bedrock_client=None):
+    """
+    Returns the embedding provider called name.
+
+    Args:
+        name (str): "bedrock", "hashing" or "random_projection"
+        bedrock_client: The bedrock-runtime client the bedrock provider calls, by
+                        default the shared one from opensearch_clients
+    """
+    if name == "bedrock":
+        if bedrock_client is None:
+            from opensearch_clients import LazyClient, get_bedrock_client
+
+            bedrock_client = LazyClient(get_bedrock_client)
+        return BedrockEmbeddingProvider(bedrock_client)
+    if name == "hashing":
+        return HashingEmbeddingProvider()
+    if name == "random_projection":
+        return RandomProjectionEmbeddingProvider()
+    raise ValueError(f"Unknown embedding provider {name}, use bedrock, hashing or random_projection")
@@ -0,0 +1,779 @@
+"""
+In-process stand-ins for the OpenSearch, Bedrock runtime and S3 clients, selected
+with CLIENT_BACKEND=emulator so the Lambdas can be run and benchmarked offline.
+
+Only the calls the Lambdas make are implemented, and queries are evaluated with
+simple token matching rather than Lucene scoring: result sets are plausible, not
+identical to a real cluster. Every call goes through a FaultInjector that adds
+latency sampled from EMULATOR_LATENCY_MS and fails a share of calls, as the real
+service would when throttling, per EMULATOR_THROTTLE_RATE. Both are JSON objects
+keyed by "service" or "service.operation", the more specific key winning:
+
+    EMULATOR_LATENCY_MS='{"opensearch": {"dist": "lognormal", "median": 8, "sigma": 0.4},
+                          "opensearch.bulk": {"dist": "uniform", "min": 40, "max": 120},
+                          "bedrock.invoke_model": 60}'
+    EMULATOR_THROTTLE_RATE='{"bedrock": 0.02}'
+
+A latency is a number of milliseconds or a distribution: fixed (ms), uniform
+(min, max), normal (mean, stddev) or lognormal (median, sigma). Samples are drawn
+from generators seeded with EMULATOR_SEED, so runs are reproducible.
+
+EMULATOR_DATA_FILE optionally names a product catalog (a JSON array or NDJSON) that
+is loaded into the products index and every vector index on start up.
+"""
+import copy
+import fnmatch
+import hashlib
+import io
+import json
+import logging
+import math
+import random
+import re
+import time
+import zlib
+from os import getenv
+
+from embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_PROVIDER, HashingEmbeddingProvider, create_embedding_provider, quantize
+from mustache import render_mustache
+from vector_projection import VECTOR_PROJECTION
+
+try:
+    from opensearchpy.exceptions import NotFoundError, RequestError, TransportError
+except ImportError:  # pragma: no cover - opensearch-py is in the utils layer
+    class TransportError(Exception):
+        @property
+        def status_code(self):
+            return self.args[0]
+
+        @property
+        def error(self):
+            return self.args[1]
+
+        @property
+        def info(self):
+            return self.args[2]
+
+    class NotFoundError(TransportError):
+        pass
+
+    class RequestError(TransportError):
+        pass
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - botocore ships with the Lambda runtime
+    class ClientError(Exception):
+        def __init__(self, error_response, operation_name):
+            super().__init__(f"An error occurred ({error_response['Error']['Code']}) when calling the {operation_name} operation")
+            self.response = error_response
+            self.operation_name = operation_name
+
+LOG = logging.getLogger()
+# Embeddings for emulated Bedrock calls
+HASHING = HashingEmbeddingProvider()
+# Catalog documents without a vector are embedded the way queries will be: by the
+# configured local provider, or by the emulated Bedrock
+CATALOG_EMBEDDINGS = HASHING if EMBEDDING_PROVIDER == "bedrock" else create_embedding_provider()
+
+EMULATOR_LATENCY_MS = json.loads(getenv("EMULATOR_LATENCY_MS", "{}"))
+EMULATOR_THROTTLE_RATE = json.loads(getenv("EMULATOR_THROTTLE_RATE", "{}"))
+EMULATOR_SEED = int(getenv("EMULATOR_SEED", "0"))
+EMULATOR_DATA_FILE = getenv("EMULATOR_DATA_FILE")
+INDEX_NAME = getenv("INDEX_NAME", "products")
+VECTOR_INDEX_NAME_ON_DISK = getenv("VECTOR_INDEX_NAME_ON_DISK", "products_vectorized_on_disk")
+VECTOR_INDEX_NAME_IN_MEMORY = getenv("VECTOR_INDEX_NAME_IN_MEMORY", "products_vectorized_in_memory")
+VECTOR_INDEX_NAME_INT8 = getenv("VECTOR_INDEX_NAME_INT8", "products_vectorized_int8")
+VECTOR_INDEX_NAME_BINARY = getenv("VECTOR_INDEX_NAME_BINARY", "products_vectorized_binary")
+VECTOR_INDEX_NAME_FP16 = getenv("VECTOR_INDEX_NAME_FP16", "products_vectorized_fp16")
+
+# Subfields are matched against the field they were derived from
+SUBFIELD_SUFFIXES = (".keyword", ".wildcard", "._2gram", "._3gram", "._index_prefix")
+COPY_TO_FIELDS = {"title_suggest": "title"}
+COLORS = [
+    "red", "blue", "green", "yellow", "multicolor", "orange", "purple", "pink", "brown",
+    "black", "white", "grey", "coral", "gold", "teal", "burgundy", "silver",
+]
+PRODUCT_TYPES = {
+    "shoes": ["shoe", "sneaker", "boot", "heel", "pump", "sandal", "stiletto", "loafer", "oxford", "flat"],
+    "bag": ["bag", "tote", "backpack", "duffel", "duffle", "clutch", "wallet", "purse", "weekender"],
+    "apparel": ["jacket", "shirt", "shorts", "leggings", "hoodie", "pants", "vest", "tank", "polo"],
+    "innerwear": ["bra", "socks", "underwear", "brief"],
+    "accessories": ["watch", "sunglasses", "hat", "cap", "belt", "scarf", "gloves", "towel", "mat"],
+}
+
+
+def tokens(value):
+    return re.findall(r"\w+", str(value).lower())
+
+
+class FaultInjector:
+    """
+    Adds the configured latency to, and throttles the configured share of, calls
+    made to one emulated service.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.random = random.Random(EMULATOR_SEED + zlib.crc32(service.encode("utf-8")))
+
+    def setting(self, settings, operation):
+        return settings.get(f"{self.service}.{operation}", settings.get(self.service))
+
+    def before(self, operation):
+        """
+        Sleeps for a sampled latency, then raises throttle() for a share of calls.
+        """
+        latency = self.setting(EMULATOR_LATENCY_MS, operation)
+        if latency:
+            time.sleep(self.sample_ms(latency) / 1000)
+        rate = self.setting(EMULATOR_THROTTLE_RATE, operation)
+        if rate and self.random.random() < rate:
+            raise self.throttle(operation)
+
+    def sample_ms(self, latency):
+        if isinstance(latency, (int, float)):
+            return latency
+        dist = latency.get("dist", "fixed")
+        if dist == "uniform":
+            return self.random.uniform(latency["min"], latency["max"])
+        if dist == "normal":
+            return max(0.0, self.random.gauss(latency["mean"], latency["stddev"]))
+        if dist == "lognormal":
+            return self.random.lognormvariate(math.log(latency["median"]), latency["sigma"])
+        return latency["ms"]
+
+    def throttle(self, operation):
+        if self.service == "opensearch":
+            return TransportError(429, "too_many_requests", {
+                "error": {"type": "too_many_requests", "reason": "emulated throttling"},
+                "status": 429,
+            })
+        return ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded (emulated)"},
+             "ResponseMetadata": {"HTTPStatusCode": 429}},
+            operation,
+        )
+
+
+def base_field(field):
+    for suffix in SUBFIELD_SUFFIXES:
+        if field.endswith(suffix):
+            field = field[: -len(suffix)]
+    return COPY_TO_FIELDS.get(field, field)
+
+
+def field_value(doc, field):
+    value = doc
+    for part in base_field(field).split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def split_boost(field):
+    name, _, boost = field.partition("^")
+    return name, float(boost) if boost else 1.0
+
+
+def required_matches(minimum_should_match, clauses):
+    if minimum_should_match is None:
+        return 1
+    if isinstance(minimum_should_match, str) and minimum_should_match.endswith("%"):
+        return max(1, math.floor(clauses * int(minimum_should_match[:-1]) / 100))
+    return int(minimum_should_match)
+
+
+def hamming(a, b):
+    """Number of differing bits between two binary vectors packed as signed bytes."""
+    return sum(bin((x ^ y) & 0xFF).count("1") for x, y in zip(a, b))
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def text_score(query_text, value, kind="best_fields", minimum_should_match=None):
+    """
+    Scores value against query_text by the number of query words it contains, or
+    returns None if it doesn't match. Phrase kinds need the words in order, and the
+    prefix kinds match the last query word as a prefix.
+    """
+    if not isinstance(value, (str, int, float)):
+        return None
+    query_words, value_words = tokens(query_text), tokens(value)
+    if not query_words:
+        return None
+    prefix = kind in ("phrase_prefix", "bool_prefix")
+    if kind in ("phrase", "phrase_prefix"):
+        size = len(query_words)
+        for start in range(len(value_words) - size + 1):
+            window = value_words[start:start + size]
+            if window[:-1] == query_words[:-1] and (
+                window[-1].startswith(query_words[-1]) if prefix else window[-1] == query_words[-1]
+            ):
+                return float(size)
+        return None
+    matched = 0
+    for position, word in enumerate(query_words):
+        last = position == len(query_words) - 1
+        if word in value_words or (prefix and last and any(v.startswith(word) for v in value_words)):
+            matched += 1
+    if matched < required_matches(minimum_should_match, len(query_words)) or matched == 0:
+        return None
+    return float(matched)
+
+
+def evaluate(query, doc):
+    """
+    Returns the score of doc for a non-kNN query clause, or None if it doesn't match.
+    """
+    (kind, spec), = query.items()
+    if kind == "match_all":
+        return 1.0
+    if kind in ("match", "match_phrase_prefix", "match_phrase"):
+        (field, options), = spec.items()
+        if not isinstance(options, dict):
+            options = {"query": options}
+        text_kind = {"match_phrase_prefix": "phrase_prefix", "match_phrase": "phrase"}.get(kind, "best_fields")
+        score = text_score(options["query"], field_value(doc, field), text_kind, options.get("minimum_should_match"))
+        return None if score is None else score * options.get("boost", 1.0)
+    if kind == "multi_match":
+        scores = []
+        for field in spec.get("fields", ["*"]):
+            name, boost = split_boost(field)
+            fields = doc.keys() if name == "*" else [name]
+            for each in fields:
+                score = text_score(spec["query"], field_value(doc, each), spec.get("type", "best_fields"))
+                if score is not None:
+                    scores.append(score * boost)
+        return max(scores) if scores else None
+    if kind == "wildcard":
+        (field, options), = spec.items()
+        if not isinstance(options, dict):
+            options = {"value": options}
+        value = field_value(doc, field)
+        if value is None:
+            return None
+        pattern = str(options["value"])
+        analyzed = not field.endswith((".keyword", ".wildcard"))
+        if options.get("case_insensitive") or analyzed:
+            pattern = pattern.lower()
+        candidates = tokens(value) if analyzed else [str(value).lower() if options.get("case_insensitive") else str(value)]
+        return 1.0 if any(fnmatch.fnmatchcase(candidate, pattern) for candidate in candidates) else None
+    if kind in ("term", "terms"):
+        (field, expected), = spec.items()
+        if isinstance(expected, dict):
+            expected = expected.get("value")
+        expected = expected if kind == "terms" else [expected]
+        value = field_value(doc, field)
+        if value is None:
+            return None
+        if field.endswith(".keyword"):
+            return 1.0 if value in expected else None
+        words = tokens(value)
+        return 1.0 if any(str(e).lower() in words or e == value for e in expected) else None
+    if kind == "range":
+        (field, bounds), = spec.items()
+        value = field_value(doc, field)
+        if not isinstance(value, (int, float)):
+            return None
+        checks = {"gt": value.__gt__, "gte": value.__ge__, "lt": value.__lt__, "lte": value.__le__}
+        return 1.0 if all(checks[op](bound) for op, bound in bounds.items() if op in checks) else None
+    if kind == "bool":
+        score = 0.0
+        for clause in as_list(spec.get("must")):
+            clause_score = evaluate(clause, doc)
+            if clause_score is None:
+                return None
+            score += clause_score
+        for clause in as_list(spec.get("filter")):
+            if evaluate(clause, doc) is None:
+                return None
+        for clause in as_list(spec.get("must_not")):
+            if evaluate(clause, doc) is not None:
+                return None
+        should = [evaluate(clause, doc) for clause in as_list(spec.get("should"))]
+        matched = [s for s in should if s is not None]
+        default_minimum = 0 if spec.get("must") or spec.get("filter") else 1
+        minimum = spec.get("minimum_should_match", default_minimum if should else 0)
+        if minimum and len(matched) < required_matches(minimum, len(should)):
+            return None
+        return score + sum(matched) or 1.0
+    raise RequestError(400, "parsing_exception", {
+        "error": {"type": "parsing_exception", "reason": f"[{kind}] query is not supported by the emulator"},
+        "status": 400,
+    })
+
+
+def as_list(clauses):
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def aggregate(aggs, docs):
+    """
+    Computes the terms, range, stats and single value metric aggregations over docs.
+    """
+    results = {}
+    for name, spec in aggs.items():
+        sub_aggs = spec.get("aggs") or spec.get("aggregations") or {}
+        kind = next(key for key in spec if key not in ("aggs", "aggregations"))
+        options = spec[kind]
+        values = [field_value(doc, options["field"]) for doc in docs]
+        if kind == "terms":
+            groups = {}
+            for doc, value in zip(docs, values):
+                for key in as_list(value):
+                    groups.setdefault(key, []).append(doc)
+            ordered = sorted(groups.items(), key=lambda item: (-len(item[1]), str(item[0])))
+            size = options.get("size", 10)
+            buckets = []
+            for key, members in ordered[:size]:
+                bucket = {"key": key, "doc_count": len(members)}
+                bucket.update(aggregate(sub_aggs, members))
+                buckets.append(bucket)
+            results[name] = {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": sum(len(members) for _, members in ordered[size:]),
+                "buckets": buckets,
+            }
+        elif kind == "range":
+            buckets = []
+            for bounds in options.get("ranges", []):
+                members = [
+                    doc for doc, value in zip(docs, values)
+                    if isinstance(value, (int, float))
+                    and ("from" not in bounds or value >= bounds["from"])
+                    and ("to" not in bounds or value < bounds["to"])
+                ]
+                key = bounds.get("key") or f"{bounds.get('from', '*')}-{bounds.get('to', '*')}"
+                bucket = {"key": key, **{k: bounds[k] for k in ("from", "to") if k in bounds}, "doc_count": len(members)}
+                bucket.update(aggregate(sub_aggs, members))
+                buckets.append(bucket)
+            results[name] = {"buckets": buckets}
+        else:
+            numbers = [value for value in values if isinstance(value, (int, float))]
+            stats = {
+                "count": len(numbers),
+                "min": min(numbers) if numbers else None,
+                "max": max(numbers) if numbers else None,
+                "avg": sum(numbers) / len(numbers) if numbers else None,
+                "sum": float(sum(numbers)),
+            }
+            results[name] = stats if kind == "stats" else {"value": stats.get(kind)}
+    return results
+
+
+class EmulatedIndices:
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def create(self, index, body=None, ignore=(), **kwargs):
+        self.cluster.faults.before("indices.create")
+        if index in self.cluster.indices_data:
+            info = {
+                "error": {"type": "resource_already_exists_exception", "reason": f"index [{index}/emulated] already exists"},
+                "status": 400,
+            }
+            if 400 in as_list(ignore):
+                return info
+            raise RequestError(400, "resource_already_exists_exception", info)
+        self.cluster.indices_data[index] = {"mappings": (body or {}).get("mappings", {}), "docs": {}}
+        return {"acknowledged": True, "shards_acknowledged": True, "index": index}
+
+    def delete(self, index, ignore=(), **kwargs):
+        self.cluster.faults.before("indices.delete")
+        if index not in self.cluster.indices_data:
+            info = {"error": {"type": "index_not_found_exception", "reason": f"no such index [{index}]"}, "status": 404}
+            if 404 in as_list(ignore):
+                return info
+            raise NotFoundError(404, "index_not_found_exception", info)
+        del self.cluster.indices_data[index]
+        return {"acknowledged": True}
+
+    def exists(self, index, **kwargs):
+        return index in self.cluster.indices_data
+
+    def refresh(self, index=None, **kwargs):
+        self.cluster.faults.before("indices.refresh")
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+
+class EmulatedTransport:
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def perform_request(self, method, url, params=None, body=None, **kwargs):
+        self.cluster.faults.before("perform_request")
+        if url.startswith("/_search/pipeline/") and method == "PUT":
+            self.cluster.pipelines[url.rsplit("/", 1)[-1]] = body
+            return {"acknowledged": True}
+        if url == "/_search/pipeline" and method == "GET":
+            return copy.deepcopy(self.cluster.pipelines)
+        raise NotFoundError(404, "not_found", {"error": {"type": "not_found", "reason": f"{method} {url} is not emulated"}, "status": 404})
+
+    def close(self):
+        pass
+
+
+class EmulatedOpenSearch:
+    """
+    Holds indices, stored scripts and search pipelines in memory and answers the
+    opensearch-py calls the Lambdas make.
+    """
+
+    def __init__(self):
+        self.faults = FaultInjector("opensearch")
+        self.indices_data = {}
+        self.scripts = {}
+        self.pipelines = {}
+        self.indices = EmulatedIndices(self)
+        self.transport = EmulatedTransport(self)
+        if EMULATOR_DATA_FILE:
+            self.load_catalog(EMULATOR_DATA_FILE)
+
+    def load_catalog(self, path):
+        with open(path) as data_file:
+            content = data_file.read().strip()
+        if content.startswith("["):
+            products = json.loads(content)
+        else:
+            products = [json.loads(line) for line in content.splitlines() if line.strip()]
+        for position, product in enumerate(products):
+            product = dict(product)
+            vector = product.pop("vector_embedding", None) or CATALOG_EMBEDDINGS.embed([
+                f"{product.get('title', '')}, Category: {product.get('category', '')}, Description: {product.get('description', '')}"
+            ], "search_document")[0]
+            self.store(INDEX_NAME, str(position), product)
+            for vector_index in (VECTOR_INDEX_NAME_ON_DISK, VECTOR_INDEX_NAME_IN_MEMORY, VECTOR_INDEX_NAME_FP16):
+                self.store(vector_index, str(position), {**product, "vector_embedding": VECTOR_PROJECTION.project(vector)})
+            self.store(VECTOR_INDEX_NAME_INT8, str(position), {**product, "vector_embedding": quantize(vector, "int8")})
+            self.store(VECTOR_INDEX_NAME_BINARY, str(position), {**product, "vector_embedding": quantize(vector, "binary")})
+        # binary vectors are ranked by Hamming distance, see score
+        self.indices_data.setdefault(VECTOR_INDEX_NAME_BINARY, {"docs": {}})["mappings"] = {"properties": {"vector_embedding": {
+            "type": "knn_vector", "dimension": EMBEDDING_DIMENSIONS, "data_type": "binary",
+        }}}
+        LOG.info(f"method=EmulatedOpenSearch.load_catalog, path={path}, products={len(products)}")
+
+    def store(self, index, doc_id, source):
+        self.indices_data.setdefault(index, {"mappings": {}, "docs": {}})["docs"][doc_id] = source
+
+    def info(self, **kwargs):
+        self.faults.before("info")
+        return {"cluster_name": "emulator", "version": {"distribution": "opensearch", "number": "2.19.0"}}
+
+    def index(self, index, body, id=None, **kwargs):
+        self.faults.before("index")
+        doc_id = id or hashlib.md5(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+        existed = doc_id in self.indices_data.get(index, {}).get("docs", {})
+        self.store(index, doc_id, copy.deepcopy(body))
+        return {"_index": index, "_id": doc_id, "result": "updated" if existed else "created"}
+
+    def get(self, index, id, ignore=(), **kwargs):
+        """Like opensearch-py, answers a missing index or document with its 404 body when ignore holds 404."""
+        self.faults.before("get")
+        if index not in self.indices_data:
+            info = {"error": {"type": "index_not_found_exception", "reason": f"no such index [{index}]"}, "status": 404}
+            if 404 in as_list(ignore):
+                return info
+            raise NotFoundError(404, "index_not_found_exception", info)
+        docs = self.indices_data[index]["docs"]
+        if id not in docs:
+            info = {"_index": index, "_id": id, "found": False}
+            if 404 in as_list(ignore):
+                return info
+            raise NotFoundError(404, "not_found", info)
+        return {"_index": index, "_id": id, "found": True, "_source": copy.deepcopy(docs[id])}
+
+    def mget(self, body, index=None, **kwargs):
+        self.faults.before("mget")
+        docs = self.indices_data.get(index, {}).get("docs", {})
+        return {"docs": [
+            {"_index": index, "_id": doc_id, "found": doc_id in docs, **({"_source": copy.deepcopy(docs[doc_id])} if doc_id in docs else {})}
+            for doc_id in body["ids"]
+        ]}
+
+    def bulk(self, body, **kwargs):
+        self.faults.before("bulk")
+        started = time.perf_counter()
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()] if isinstance(body, str) else list(body)
+        items = []
+        position = 0
+        while position < len(lines):
+            (action, meta), = lines[position].items()
+            doc_id = meta.get("_id") or hashlib.md5(f"{time.time_ns()}-{position}".encode()).hexdigest()
+            if action == "delete":
+                self.indices_data.get(meta["_index"], {}).get("docs", {}).pop(doc_id, None)
+                position += 1
+            else:
+                source = lines[position + 1]
+                if action == "update":
+                    current = self.indices_data.get(meta["_index"], {}).get("docs", {}).get(doc_id, {})
+                    source = {**current, **source.get("doc", {})}
+                self.store(meta["_index"], doc_id, copy.deepcopy(source))
+                position += 2
+            items.append({action: {"_index": meta["_index"], "_id": doc_id, "status": 201, "result": "created"}})
+        return {"took": int((time.perf_counter() - started) * 1000), "errors": False, "items": items}
+
+    def put_script(self, id, body, **kwargs):
+        self.faults.before("put_script")
+        self.scripts[id] = body["script"]["source"]
+        return {"acknowledged": True}
+
+    def search(self, index=None, body=None, params=None, **kwargs):
+        self.faults.before("search")
+        return self.run_search(index, body or {})
+
+    def search_template(self, body, index=None, **kwargs):
+        self.faults.before("search_template")
+        return self.run_search(index, self.render(body), profile=body.get("profile", False))
+
+    def msearch(self, body, **kwargs):
+        self.faults.before("msearch")
+        return {"responses": [self.try_search(header.get("index"), search) for header, search in self.pairs(body)]}
+
+    def msearch_template(self, body, **kwargs):
+        self.faults.before("msearch_template")
+        responses = []
+        for header, template in self.pairs(body):
+            try:
+                search = self.render(template)
+            except NotFoundError as e:
+                responses.append({"error": e.info["error"], "status": 404})
+                continue
+            responses.append(self.try_search(header.get("index"), search))
+        return {"responses": responses}
+
+    def pairs(self, body):
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()] if isinstance(body, str) else list(body)
+        return list(zip(lines[0::2], lines[1::2]))
+
+    def render(self, template):
+        """Renders a search template body, stored by id or inline as source."""
+        if "id" in template:
+            if template["id"] not in self.scripts:
+                raise NotFoundError(404, "resource_not_found_exception", {
+                    "error": {"type": "resource_not_found_exception", "reason": f"unable to find script [{template['id']}]"},
+                    "status": 404,
+                })
+            source = self.scripts[template["id"]]
+        else:
+            source = template["source"]
+            if isinstance(source, dict):
+                return source
+        return render_mustache(source, template.get("params", {}))
+
+    def try_search(self, index, body):
+        try:
+            return {**self.run_search(index, body), "status": 200}
+        except TransportError as e:
+            return {"error": e.info.get("error", {}), "status": e.status_code}
+
+    def run_search(self, index, body, profile=False):
+        started = time.perf_counter()
+        names = [name for pattern in str(index or "*").split(",") for name in self.indices_data if fnmatch.fnmatch(name, pattern)]
+        if index and "*" not in str(index) and not names:
+            raise NotFoundError(404, "index_not_found_exception", {
+                "error": {"type": "index_not_found_exception", "reason": f"no such index [{index}]"},
+                "status": 404,
+            })
+        docs = [(name, doc_id, doc) for name in names for doc_id, doc in self.indices_data[name]["docs"].items()]
+        query = body.get("query", {"match_all": {}})
+        scored = self.score(query, docs, body.get("search_pipeline"))
+
+        post_filter = body.get("post_filter")
+        hits = [hit for hit in scored if post_filter is None or evaluate(post_filter, hit[3]) is not None]
+        hits.sort(key=lambda hit: -hit[0])
+        start, size = body.get("from", 0), body.get("size", 10)
+        response = {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": hits[0][0] if hits else None,
+                "hits": [
+                    {"_index": name, "_id": doc_id, "_score": score, "_source": self.source(doc, body.get("_source"))}
+                    for score, name, doc_id, doc in hits[start:start + size]
+                ],
+            },
+        }
+        if body.get("aggs") or body.get("aggregations"):
+            response["aggregations"] = aggregate(body.get("aggs") or body.get("aggregations"), [hit[3] for hit in scored])
+        elapsed_nanos = int((time.perf_counter() - started) * 1e9)
+        response["took"] = elapsed_nanos // 1_000_000
+        if profile or body.get("profile"):
+            response["profile"] = self.profile(query, index, elapsed_nanos)
+        return response
+
+    def score(self, query, docs, pipeline_name=None):
+        """
+        Returns (score, index, id, source) for every doc matching query. kNN queries
+        keep their top k, hybrid queries combine min-max normalized sub-query scores
+        using the weights of the search pipeline, as the normalization processor does,
+        or sum reciprocal ranks when the pipeline has an rrf score ranker.
+        """
+        (kind, spec), = query.items()
+        if kind == "knn":
+            (field, options), = spec.items()
+            scored = [
+                (
+                    1 / (1 + hamming(options["vector"], doc[field])) if self.is_binary_vector(name, field)
+                    else (1 + cosine(options["vector"], doc[field])) / 2,
+                    name, doc_id, doc,
+                )
+                for name, doc_id, doc in docs if isinstance(doc.get(field), list)
+            ]
+            return sorted(scored, key=lambda hit: -hit[0])[:options.get("k", 10)]
+        if kind == "hybrid":
+            sub_queries = spec["queries"]
+            weights = self.pipeline_weights(pipeline_name) or [1.0] * len(sub_queries)
+            rank_constant = self.pipeline_rank_constant(pipeline_name)
+            combined = {}
+            for weight, sub_query in zip(weights, sub_queries):
+                results = self.score(sub_query, docs)
+                if not results:
+                    continue
+                if rank_constant is not None:
+                    ranked = sorted(results, key=lambda hit: -hit[0])
+                    for rank, (_, name, doc_id, doc) in enumerate(ranked, 1):
+                        combined.setdefault((name, doc_id), [0.0, doc])[0] += 1 / (rank_constant + rank)
+                    continue
+                low, high = min(hit[0] for hit in results), max(hit[0] for hit in results)
+                for score, name, doc_id, doc in results:
+                    normalized = (score - low) / (high - low) if high > low else 1.0
+                    entry = combined.setdefault((name, doc_id), [0.0, doc])
+                    entry[0] += weight * normalized / sum(weights)
+            return [(score, name, doc_id, doc) for (name, doc_id), (score, doc) in combined.items()]
+        scored = []
+        for name, doc_id, doc in docs:
+            score = evaluate(query, doc)
+            if score is not None:
+                scored.append((score, name, doc_id, doc))
+        return scored
+
+    def is_binary_vector(self, index, field):
+        mapping = self.indices_data.get(index, {}).get("mappings", {}).get("properties", {}).get(field, {})
+        return mapping.get("data_type") == "binary"
+
+    def pipeline_rank_constant(self, pipeline_name):
+        for processor in (self.pipelines.get(pipeline_name) or {}).get("phase_results_processors", []):
+            combination = processor.get("score-ranker-processor", {}).get("combination", {})
+            if combination.get("technique") == "rrf":
+                return combination.get("rank_constant", 60)
+        return None
+
+    def pipeline_weights(self, pipeline_name):
+        for processor in (self.pipelines.get(pipeline_name) or {}).get("phase_results_processors", []):
+            combination = processor.get("normalization-processor", {}).get("combination", {})
+            if "weights" in combination.get("parameters", {}):
+                return combination["parameters"]["weights"]
+        return None
+
+    def source(self, doc, source_filter):
+        if source_filter is None or source_filter is True:
+            return copy.deepcopy(doc)
+        if source_filter is False:
+            return {}
+        if isinstance(source_filter, (list, str)):
+            source_filter = {"includes": as_list(source_filter)}
+        includes, excludes = as_list(source_filter.get("includes")), as_list(source_filter.get("excludes"))
+        return {
+            key: copy.deepcopy(value) for key, value in doc.items()
+            if (not includes or key in includes) and key not in excludes
+        }
+
+    def profile(self, query, index, elapsed_nanos):
+        """Returns a Profile API shaped breakdown with the query tree's clause types."""
+        def node(clause, nanos):
+            (kind, spec), = clause.items()
+            children = spec.get("queries", []) if kind == "hybrid" else []
+            return {
+                "type": {"knn": "KNNQuery", "hybrid": "HybridQuery", "bool": "BooleanQuery"}.get(kind, f"{kind}Query"),
+                "description": json.dumps(clause, default=str)[:500],
+                "time_in_nanos": nanos,
+                "children": [node(child, nanos // max(1, len(children))) for child in children],
+            }
+        return {"shards": [{
+            "id": f"[emulator][{index}][0]",
+            "searches": [{
+                "query": [node(query, elapsed_nanos)],
+                "rewrite_time": 0,
+                "collector": [{"name": "SimpleTopScoreDocCollector", "reason": "search_top_hits", "time_in_nanos": 0}],
+            }],
+            "aggregations": [],
+        }]}
+
+
+class EmulatedBedrock:
+    """
+    Answers embedding requests with HashingEmbeddingProvider vectors, and the product
+    filter converse prompt with the category, color and product type named in it.
+    """
+
+    def __init__(self):
+        self.faults = FaultInjector("bedrock")
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.faults.before("invoke_model")
+        request = json.loads(body)
+        if "texts" in request:
+            vectors = HASHING.embed_types(request["texts"], request.get("input_type"), request.get("embedding_types") or ["float"])
+            payload = {"id": "emulated", "texts": request["texts"], "embeddings": vectors, "response_type": "embeddings_by_type"}
+        elif "inputText" in request:
+            payload = {"embedding": HASHING.embed_text(request["inputText"]), "inputTextTokenCount": len(tokens(request["inputText"]))}
+        else:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": f"{modelId} is not emulated"}}, "InvokeModel")
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+    def converse(self, modelId, messages, **kwargs):
+        self.faults.before("converse")
+        prompt = " ".join(part.get("text", "") for message in messages for part in message["content"])
+        quoted = re.search(r'search text: "([^"]*)"', prompt)
+        words = tokens(quoted.group(1) if quoted else prompt)
+        filters = {"category": "women" if "women" in words else "men" if "men" in words else "unisex"}
+        color = next((word for word in words if word in COLORS), None)
+        if color:
+            filters["color"] = color
+        filters["product_type"] = next(
+            (name for name, stems in PRODUCT_TYPES.items() if any(word.startswith(stem) for word in words for stem in stems)),
+            "other",
+        )
+        text = json.dumps(filters)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": {"inputTokens": len(tokens(prompt)), "outputTokens": len(tokens(text)), "totalTokens": len(tokens(prompt)) + len(tokens(text))},
+        }
+
+
+class EmulatedS3:
+    """Keeps objects in memory and signs URLs that point at a local placeholder host."""
+
+    def __init__(self):
+        self.faults = FaultInjector("s3")
+        self.objects = {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        self.faults.before("generate_presigned_url")
+        return f"http://s3.emulator.local/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+    def generate_presigned_post(self, Bucket, Key, ExpiresIn=3600, **kwargs):
+        self.faults.before("generate_presigned_post")
+        return {"url": f"http://s3.emulator.local/{Bucket}", "fields": {"key": Key}}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.faults.before("put_object")
+        self.objects[(Bucket, Key)] = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        return {"ETag": hashlib.md5(self.objects[(Bucket, Key)]).hexdigest()}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.faults.before("get_object")
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "The specified key does not exist."}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
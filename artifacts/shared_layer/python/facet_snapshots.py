@@ -0,0 +1,63 @@
+import hashlib
+import json
+
+
+def terms(field, size):
+    return {"terms": {"field": f"{field}.keyword", "size": size}}
+
+
+# The facet aggregations the index Lambda precomputes after every catalog load, as
+# the search bodies complex_search "aggregations" requests build for them: the UI's
+# aggregations page and the load test's facet sidebar. Only these are served from
+# snapshots, any other aggregation runs against the index like a regular search.
+FACET_SNAPSHOT_SEARCHES = [
+    {
+        "size": 0,
+        "query": {"match_all": {}},
+        "aggs": {
+            "categories": terms("category", 10),
+            "colors": terms("color", 20),
+            "price_stats": {"stats": {"field": "price"}},
+            "price_ranges": {
+                "range": {
+                    "field": "price",
+                    "ranges": [
+                        {"to": 5000},
+                        {"from": 5000, "to": 10000},
+                        {"from": 10000, "to": 15000},
+                        {"from": 15000}
+                    ]
+                }
+            },
+            "avg_price_by_category": {
+                **terms("category", 10),
+                "aggs": {"avg_price": {"avg": {"field": "price"}}}
+            }
+        }
+    },
+    {
+        "size": 0,
+        "query": {"match_all": {}},
+        "aggs": {
+            "category_counts": terms("category", 10),
+            "color_counts": terms("color", 10),
+            "price_stats": {"stats": {"field": "price"}}
+        }
+    },
+]
+
+
+def snapshot_id(index, search_body):
+    """
+    Returns the snapshot document id for search_body against index, a digest of
+    both canonicalized the way result_cache.cache_key does.
+    """
+    canonical = json.dumps(
+        {"index": index, "body": search_body}, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_precomputed(search_body):
+    """Whether search_body is one of FACET_SNAPSHOT_SEARCHES."""
+    return search_body in FACET_SNAPSHOT_SEARCHES
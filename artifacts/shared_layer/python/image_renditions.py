@@ -0,0 +1,37 @@
+import os
+from os import getenv
+
+# Product images are uploaded under IMAGE_PREFIX with their file_name, and their
+# downscaled renditions under RENDITION_PREFIX, one folder per image
+IMAGE_PREFIX = "images/"
+RENDITION_PREFIX = f"{IMAGE_PREFIX}renditions/"
+# Widths in pixels, renditions keep the square aspect ratio of the generated images
+IMAGE_RENDITION_SIZES = sorted(int(size) for size in getenv("IMAGE_RENDITION_SIZES", "96,160,320").split(","))
+# "webp", or "webp,avif" to also write AVIF where Pillow supports it
+IMAGE_RENDITION_FORMATS = getenv("IMAGE_RENDITION_FORMATS", "webp").split(",")
+# The format search results link to
+IMAGE_RENDITION_FORMAT = IMAGE_RENDITION_FORMATS[0]
+
+
+def rendition_path(file_name, size, image_format=IMAGE_RENDITION_FORMAT):
+    """
+    Returns the path of a rendition relative to IMAGE_PREFIX, derived only from
+    the image's file name, size and format, e.g. renditions/0-Women-running-shoes/160.webp.
+    """
+    stem = os.path.splitext(file_name)[0]
+    return f"renditions/{stem}/{size}.{image_format}"
+
+
+def rendition_key(file_name, size, image_format=IMAGE_RENDITION_FORMAT):
+    return f"{IMAGE_PREFIX}{rendition_path(file_name, size, image_format)}"
+
+
+def rendition_size(requested):
+    """
+    Returns the smallest rendition size that is at least requested pixels wide,
+    or the largest there is when none is.
+    """
+    for size in IMAGE_RENDITION_SIZES:
+        if size >= requested:
+            return size
+    return IMAGE_RENDITION_SIZES[-1]
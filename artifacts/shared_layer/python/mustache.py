@@ -0,0 +1,31 @@
+import json
+import re
+
+
+def render_mustache(source, params):
+    """
+    Renders the mustache subset the stored search templates use: {{var}},
+    {{#toJson}}var{{/toJson}} and {{#flag}}...{{/flag}} / {{^flag}}...{{/flag}} sections.
+    """
+    rendered = re.sub(
+        r"\{\{#toJson\}\}\s*(\w+)\s*\{\{/toJson\}\}",
+        lambda m: json.dumps(params.get(m.group(1))),
+        source,
+    )
+    section = re.compile(r"\{\{([#^])(\w+)\}\}(.*?)\{\{/\2\}\}", re.S)
+    while True:
+        expanded = section.sub(
+            lambda m: m.group(3) if bool(params.get(m.group(2))) == (m.group(1) == "#") else "",
+            rendered,
+        )
+        if expanded == rendered:
+            break
+        rendered = expanded
+
+    def value(m):
+        param = params.get(m.group(1), "")
+        if isinstance(param, bool):
+            return "true" if param else "false"
+        return str(param)
+
+    return json.loads(re.sub(r"\{\{(\w+)\}\}", value, rendered))
@@ -0,0 +1,126 @@
+import logging
+from os import getenv
+
+from coldstart import COLD_START
+
+LOG = logging.getLogger()
+
+ENDPOINT = getenv("OPENSEARCH_HOST", "default")
+SERVICE = "es"  # aoss for Amazon Opensearch serverless
+REGION = getenv("AWS_REGION", "us-east-1")
+OPENSEARCH_TIMEOUT = int(getenv("OPENSEARCH_TIMEOUT", "300"))
+# connections kept open per host, size it to the threads a single invocation fans out to
+OPENSEARCH_POOL_MAXSIZE = int(getenv("OPENSEARCH_POOL_MAXSIZE", "10"))
+AWS_MAX_POOL_CONNECTIONS = int(getenv("AWS_MAX_POOL_CONNECTIONS", "10"))
+AWS_MAX_ATTEMPTS = int(getenv("AWS_MAX_ATTEMPTS", "5"))
+# "aws", or "emulator" for the in-process stand-ins in emulator.py
+CLIENT_BACKEND = getenv("CLIENT_BACKEND", "aws")
+
+_session = None
+_clients = {}
+
+
+class LazyClient:
+    """
+    Stands in for a client until it is first used, so a route only pays for
+    importing and creating the clients it actually calls.
+
+    Args:
+        factory (callable): Returns the real, cached client
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+def get_session():
+    """
+    Returns the boto3 session shared by every client in this execution environment.
+    """
+    global _session
+    if _session is None:
+        import boto3
+
+        _session = boto3.Session(region_name=REGION)
+    return _session
+
+
+def aws_client_config():
+    """
+    Returns the botocore config for AWS clients: a connection pool sized for
+    concurrent calls, TCP keep-alive, and adaptive retries that back off on throttling.
+    """
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "adaptive"},
+        tcp_keepalive=True,
+    )
+
+
+def get_opensearch_client():
+    """
+    Returns the pooled OpenSearch client for OPENSEARCH_HOST.
+
+    Requests are signed with the session's refreshable credentials on every call,
+    rather than with keys captured once at import time, and reuse keep-alive
+    connections from a pool of OPENSEARCH_POOL_MAXSIZE.
+    """
+    if "opensearch" not in _clients:
+        with COLD_START.measure_client("opensearch"):
+            if CLIENT_BACKEND == "emulator":
+                from emulator import EmulatedOpenSearch
+
+                _clients["opensearch"] = EmulatedOpenSearch()
+                return _clients["opensearch"]
+            from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+
+            credentials = get_session().get_credentials()
+            _clients["opensearch"] = OpenSearch(
+                hosts=[{"host": ENDPOINT, "port": 443}],
+                http_auth=AWSV4SignerAuth(credentials, REGION, SERVICE),
+                use_ssl=True,
+                verify_certs=True,
+                connection_class=RequestsHttpConnection,
+                pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
+                timeout=OPENSEARCH_TIMEOUT,
+            )
+    return _clients["opensearch"]
+
+
+def get_bedrock_client():
+    """
+    Returns the shared bedrock-runtime client.
+    """
+    if "bedrock" not in _clients:
+        with COLD_START.measure_client("bedrock"):
+            if CLIENT_BACKEND == "emulator":
+                from emulator import EmulatedBedrock
+
+                _clients["bedrock"] = EmulatedBedrock()
+                return _clients["bedrock"]
+            _clients["bedrock"] = get_session().client(
+                "bedrock-runtime", region_name=REGION, config=aws_client_config()
+            )
+    return _clients["bedrock"]
+
+
+def get_s3_client():
+    """
+    Returns the shared S3 client.
+    """
+    if "s3" not in _clients:
+        with COLD_START.measure_client("s3"):
+            if CLIENT_BACKEND == "emulator":
+                from emulator import EmulatedS3
+
+                _clients["s3"] = EmulatedS3()
+                return _clients["s3"]
+            _clients["s3"] = get_session().client(
+                "s3", region_name=REGION, config=aws_client_config()
+            )
+    return _clients["s3"]
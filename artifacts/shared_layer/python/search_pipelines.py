@@ -0,0 +1,92 @@
+import hashlib
+import json
+from os import getenv
+
+# Hybrid search pipelines are registered as <prefix>-<strategy>-<version>
+SEARCH_PIPELINE_PREFIX = getenv("SEARCH_PIPELINE_NAME", "oss_srch_pipeline")
+# Strategy hybrid searches use when neither the request nor FUSION_TRAFFIC_SPLIT picks one
+FUSION_STRATEGY = getenv("FUSION_STRATEGY", "weighted")
+# Share of callers assigned to other strategies, e.g. {"rrf": 0.1, "rrf_shallow": 0.1}
+FUSION_TRAFFIC_SPLIT = json.loads(getenv("FUSION_TRAFFIC_SPLIT", "{}"))
+
+
+def normalization_processor(weights):
+    return {
+        "normalization-processor": {
+            "normalization": {
+                "technique": "min_max"
+            },
+            "combination": {
+                "technique": "arithmetic_mean",
+                "parameters": {
+                    "weights": weights
+                }
+            }
+        }
+    }
+
+
+def rrf_processor(rank_constant=60):
+    return {
+        "score-ranker-processor": {
+            "combination": {
+                "technique": "rrf",
+                "rank_constant": rank_constant
+            }
+        }
+    }
+
+
+# How hybrid searches fuse their keyword and kNN sub-queries. Each strategy is
+# (version, candidate depth, phase results processor), weights being keyword then
+# kNN. Depth is how many results each sub-query contributes, the kNN k and the hybrid
+# pagination_depth, fewer being cheaper to fetch and fuse. Bump the version whenever
+# a processor changes so it is registered under a new id instead of overwriting one
+# that running Lambdas still reference.
+FUSION_STRATEGIES = {
+    "weighted": ("v1", 100, normalization_processor([0.7, 0.3])),
+    "balanced": ("v1", 100, normalization_processor([0.5, 0.5])),
+    "semantic": ("v1", 100, normalization_processor([0.3, 0.7])),
+    "weighted_shallow": ("v1", 20, normalization_processor([0.7, 0.3])),
+    "rrf": ("v1", 100, rrf_processor()),
+    "rrf_shallow": ("v1", 20, rrf_processor()),
+}
+
+
+def pipeline_id(strategy):
+    return f"{SEARCH_PIPELINE_PREFIX}-{strategy}-{FUSION_STRATEGIES[strategy][0]}"
+
+
+def pipeline_body(strategy):
+    return {
+        "description": f"Hybrid search fusion, {strategy} strategy",
+        "phase_results_processors": [FUSION_STRATEGIES[strategy][2]],
+    }
+
+
+def candidate_depth(strategy):
+    return FUSION_STRATEGIES[strategy][1]
+
+
+def fusion_strategy(requested=None, caller=None):
+    """
+    Returns the fusion strategy for a hybrid search: the one requested, else the
+    FUSION_TRAFFIC_SPLIT strategy caller's segment is assigned to, else FUSION_STRATEGY.
+    A caller always lands in the same segment, so its results don't flip between
+    strategies from one search to the next.
+
+    Raises:
+        ValueError: If requested is not one of FUSION_STRATEGIES
+    """
+    if requested is not None:
+        if requested not in FUSION_STRATEGIES:
+            raise ValueError(f"fusion should be one of {', '.join(FUSION_STRATEGIES)}")
+        return requested
+    if caller and FUSION_TRAFFIC_SPLIT:
+        digest = hashlib.blake2b(str(caller).encode("utf-8"), digest_size=8).digest()
+        point = int.from_bytes(digest, "little") / 2 ** 64
+        for strategy, share in sorted(FUSION_TRAFFIC_SPLIT.items()):
+            if point < share and strategy in FUSION_STRATEGIES:
+                return strategy
+            point -= share
+    return FUSION_STRATEGY
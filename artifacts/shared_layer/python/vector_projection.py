@@ -0,0 +1,140 @@
+import base64
+import json
+import logging
+import math
+import operator
+import os
+import sys
+from array import array
+from os import getenv
+
+from embeddings import EMBEDDING_DIMENSIONS
+
+LOG = logging.getLogger()
+
+# Projection artifact written by fit_vector_projection.py, empty to index and search
+# full EMBEDDING_DIMENSIONS vectors. Relative paths are resolved against this layer.
+VECTOR_PROJECTION_FILE = getenv("VECTOR_PROJECTION_FILE", "")
+
+try:
+    import numpy as np
+except ImportError:  # the Lambda layers don't ship NumPy, projection falls back to plain Python
+    np = None
+
+
+def encode_floats(values):
+    """Packs floats as base64 little-endian float32, several times smaller than a JSON list."""
+    packed = array("f", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def decode_floats(encoded):
+    packed = array("f")
+    packed.frombytes(base64.b64decode(encoded))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tolist()
+
+
+class VectorProjection:
+    """
+    Maps embeddings to fewer dimensions, then renormalizes them so inner product
+    kNN keeps ranking by cosine similarity.
+
+    "pca" subtracts the catalog mean and keeps the top principal components.
+    "truncate" keeps the leading dimensions, for Matryoshka trained models whose
+    leading dimensions carry the most information by construction.
+    """
+
+    def __init__(self, method, source_dimensions, dimensions, mean=None, components=None, metadata=None):
+        self.method = method
+        self.source_dimensions = source_dimensions
+        self.dimensions = dimensions
+        self.mean = mean
+        self.components = components
+        self.metadata = metadata or {}
+        if np is not None and components is not None:
+            self._mean = np.asarray(mean, dtype=np.float32)
+            self._components = np.asarray(components, dtype=np.float32)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path) as projection_file:
+            artifact = json.load(projection_file)
+        dimensions = artifact["dimensions"]
+        mean = components = None
+        if artifact["method"] == "pca":
+            mean = decode_floats(artifact["mean"])
+            flat = decode_floats(artifact["components"])
+            source = artifact["source_dimensions"]
+            components = [flat[row * source:(row + 1) * source] for row in range(dimensions)]
+        return cls(
+            artifact["method"], artifact["source_dimensions"], dimensions,
+            mean, components, artifact.get("metadata"),
+        )
+
+    def save(self, file_path):
+        artifact = {
+            "method": self.method,
+            "source_dimensions": self.source_dimensions,
+            "dimensions": self.dimensions,
+            "metadata": self.metadata,
+        }
+        if self.method == "pca":
+            artifact["mean"] = encode_floats(self.mean)
+            artifact["components"] = encode_floats(value for row in self.components for value in row)
+        with open(file_path, "w") as projection_file:
+            json.dump(artifact, projection_file)
+
+    def project(self, vector):
+        """
+        Returns vector projected to self.dimensions and normalized to unit length.
+        A vector that already has self.dimensions is returned as is.
+        """
+        if len(vector) == self.dimensions:
+            return vector
+        if len(vector) != self.source_dimensions:
+            raise ValueError(f"Expected a vector of {self.source_dimensions} dimensions, got {len(vector)}")
+        if self.method == "truncate":
+            projected = vector[:self.dimensions]
+        elif np is not None:
+            projected = (self._components @ (np.asarray(vector, dtype=np.float32) - self._mean)).tolist()
+        else:
+            centered = list(map(operator.sub, vector, self.mean))
+            projected = [sum(map(operator.mul, row, centered)) for row in self.components]
+        norm = math.sqrt(sum(value * value for value in projected)) or 1.0
+        return [value / norm for value in projected]
+
+
+class IdentityProjection:
+    """Stands in when no projection is configured, vectors keep EMBEDDING_DIMENSIONS."""
+
+    method = "none"
+    dimensions = EMBEDDING_DIMENSIONS
+
+    def project(self, vector):
+        return vector
+
+
+def load_projection(file_path=VECTOR_PROJECTION_FILE):
+    """
+    Returns the VectorProjection stored at file_path, or an IdentityProjection
+    when file_path is empty.
+    """
+    if not file_path:
+        return IdentityProjection()
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_path)
+    projection = VectorProjection.load(file_path)
+    LOG.info(
+        f"method=load_projection, file={file_path}, projection={projection.method}, "
+        f"dimensions={projection.source_dimensions}->{projection.dimensions}"
+    )
+    return projection
+
+
+VECTOR_PROJECTION = load_projection()
+# Dimension of the knn_vector fields, what embeddings are projected to
+VECTOR_DIMENSIONS = VECTOR_PROJECTION.dimensions
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Fits a projection that reduces catalog embeddings to fewer dimensions, and
+benchmarks what that costs in kNN recall.
+
+The projection is written as an artifact the Lambdas load through
+VECTOR_PROJECTION_FILE, see artifacts/shared_layer/python/vector_projection.py.
+Documents are then projected in vectorize_and_index_products, queries in
+search_products, and the vector index mappings take their dimension from it.
+
+Methods:
+    pca       Principal components of the catalog embeddings, fitted with NumPy
+    truncate  The leading dimensions, for Matryoshka trained embedding models
+
+The benchmark holds --queries catalog vectors out as queries, fits on the rest,
+and for each of --benchmark dimensions reports the recall@k of exact inner
+product search over projected vectors against exact search over full vectors,
+next to the memory per vector and the size of the query vector in a search request.
+The last row, at full dimension, shows how much recall ties between near
+duplicate vectors cost on their own.
+
+Examples:
+    python fit_vector_projection.py --dimensions 256
+    python fit_vector_projection.py --vectors products_1m.f32 --dimensions 256 --benchmark 64,128,256,512
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Embedding providers and the projection artifact format are shared with the Lambdas
+sys.path.insert(0, os.path.join(ROOT, "artifacts", "shared_layer", "python"))
+from embeddings import EMBEDDING_PROVIDER, create_embedding_provider  # noqa: E402
+from vector_projection import VectorProjection  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(ROOT, "artifacts", "shared_layer", "python", "vector_projection.json")
+
+
+def read_catalog_vectors(path):
+    """
+    Returns the vector_embedding of every product in a JSON array or NDJSON catalog,
+    embedding the products that have none with the configured EMBEDDING_PROVIDER.
+    """
+    with open(path) as catalog_file:
+        content = catalog_file.read().strip()
+    if content.startswith("["):
+        products = json.loads(content)
+    else:
+        products = [json.loads(line) for line in content.splitlines() if line.strip()]
+    missing = [product for product in products if not product.get("vector_embedding")]
+    if missing:
+        print(f"Embedding {len(missing)} products with the {EMBEDDING_PROVIDER} provider")
+        texts = [
+            f"{product.get('title', '')}, Category: {product.get('category', '')}, Description: {product.get('description', '')}"
+            for product in missing
+        ]
+        for product, vector in zip(missing, create_embedding_provider(EMBEDDING_PROVIDER).embed(texts, "search_document")):
+            product["vector_embedding"] = vector
+    return np.asarray([product["vector_embedding"] for product in products], dtype=np.float32)
+
+
+def read_sidecar_vectors(path):
+    """Maps a float32 vector sidecar written by generate_synthetic_catalog.py."""
+    with open(f"{path}.json") as manifest_file:
+        manifest = json.load(manifest_file)
+    return np.memmap(path, dtype="<f4", mode="r", shape=(manifest["count"], manifest["dimensions"]))
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def fit_pca(vectors):
+    """
+    Returns:
+        tuple: (mean, components sorted by explained variance, explained variance ratios)
+    """
+    mean = vectors.mean(axis=0, dtype=np.float64)
+    centered = vectors - mean
+    # eigendecomposition of the dimensions x dimensions covariance, cheaper than an
+    # SVD of the data once there are more vectors than dimensions
+    covariance = centered.T.astype(np.float64) @ centered / max(len(vectors) - 1, 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.clip(eigenvalues[order], 0, None)
+    return mean, eigenvectors[:, order].T, eigenvalues / eigenvalues.sum()
+
+
+def projection_for(method, dimensions, source_dimensions, pca, metadata):
+    if method == "truncate":
+        return VectorProjection("truncate", source_dimensions, dimensions, metadata=metadata)
+    mean, components, _ = pca
+    return VectorProjection(
+        "pca", source_dimensions, dimensions,
+        mean.astype(np.float32).tolist(), components[:dimensions].astype(np.float32).tolist(), metadata,
+    )
+
+
+def project(vectors, method, dimensions, pca):
+    if method == "truncate":
+        return normalize(vectors[:, :dimensions])
+    mean, components, _ = pca
+    return normalize((vectors - mean) @ components[:dimensions].T)
+
+
+def top_k(queries, documents, k):
+    scores = queries @ documents.T
+    k = min(k, documents.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def benchmark(vectors, method, dimension_options, query_count, ks, seed):
+    """
+    Prints recall@k for each projected dimension against exact search at full dimension.
+    """
+    generator = np.random.default_rng(seed)
+    order = generator.permutation(len(vectors))
+    query_count = min(query_count, len(vectors) // 10 or 1)
+    queries = normalize(np.asarray(vectors[order[:query_count]], dtype=np.float32))
+    documents = normalize(np.asarray(vectors[order[query_count:]], dtype=np.float32))
+    pca = fit_pca(documents) if method == "pca" else None
+    exact = {k: top_k(queries, documents, k) for k in ks}
+
+    print(f"{len(documents)} documents, {len(queries)} queries, method {method}")
+    header = ["dimensions", "variance"] + [f"recall@{k}" for k in ks] + ["bytes/vector", "query_json_bytes"]
+    print("".join(f"{column:>18}" for column in header))
+    for dimensions in dimension_options + [vectors.shape[1]]:
+        projected_queries = project(queries, method, dimensions, pca)
+        projected_documents = project(documents, method, dimensions, pca)
+        recalls = []
+        for k in ks:
+            approximate = top_k(projected_queries, projected_documents, k)
+            found = sum(len(a & e) for a, e in zip(approximate, exact[k]))
+            recalls.append(found / sum(len(e) for e in exact[k]))
+        variance = pca[2][:dimensions].sum() if pca is not None else float("nan")
+        payload = len(json.dumps(projected_queries[0].tolist()))
+        row = [dimensions, f"{variance:.3f}"] + [f"{recall:.3f}" for recall in recalls] + [dimensions * 4, payload]
+        print("".join(f"{value:>18}" for value in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit and benchmark an embedding dimension reduction")
+    parser.add_argument("--catalog", default=os.path.join(ROOT, "artifacts", "index_lambda", "products_content.jsonl"),
+                        help="Products with vector_embedding, a JSON array or NDJSON")
+    parser.add_argument("--vectors", help="Read vectors from a generate_synthetic_catalog.py sidecar instead")
+    parser.add_argument("--method", choices=["pca", "truncate"], default="pca")
+    parser.add_argument("--dimensions", type=int, default=256, help="Dimension to project to")
+    parser.add_argument("--sample", type=int, default=200_000, help="Most vectors to fit on")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the projection artifact")
+    parser.add_argument("--benchmark", help="Also report recall at these dimensions, e.g. 64,128,256,512")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out as benchmark queries")
+    parser.add_argument("--k", default="10,100", help="Recall cut-offs for the benchmark")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    vectors = read_sidecar_vectors(args.vectors) if args.vectors else read_catalog_vectors(args.catalog)
+    source_dimensions = vectors.shape[1]
+    if not 0 < args.dimensions < source_dimensions:
+        parser.error(f"--dimensions must be between 1 and {source_dimensions - 1}")
+    if len(vectors) > args.sample:
+        rows = np.sort(np.random.default_rng(args.seed).choice(len(vectors), args.sample, replace=False))
+        vectors = vectors[rows]
+    vectors = normalize(np.asarray(vectors, dtype=np.float32))
+
+    if args.benchmark:
+        benchmark(vectors, args.method, [int(d) for d in args.benchmark.split(",")],
+                  args.queries, [int(k) for k in args.k.split(",")], args.seed)
+
+    pca = fit_pca(vectors) if args.method == "pca" else None
+    metadata = {"fitted_on": len(vectors), "source": os.path.basename(args.vectors or args.catalog)}
+    if pca is not None:
+        metadata["explained_variance"] = round(float(pca[2][:args.dimensions].sum()), 4)
+    projection_for(args.method, args.dimensions, source_dimensions, pca, metadata).save(args.output)
+    print(f"Wrote {args.method} projection {source_dimensions}->{args.dimensions} to {args.output}, {metadata}")
+
+
+if __name__ == "__main__":
+    main()
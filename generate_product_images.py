@@ -1,107 +1,290 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
 import json
 import os
+import random
+import sys
+import time
 import boto3
 import base64
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
-from PIL import Image
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+from PIL import Image, features
+
+# Rendition sizes and keys are shared with the search Lambda through the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts", "shared_layer", "python"))
+from image_renditions import IMAGE_PREFIX, IMAGE_RENDITION_FORMATS, IMAGE_RENDITION_SIZES, rendition_path
 
 # Please install the following packages in a virtual environment locally:
 # pip install boto3
 # pip install Pillow
 
+IMAGE_MODEL_ID = os.getenv("IMAGE_MODEL_ID", "amazon.nova-canvas-v1:0")
+# Size the UI shows, generated as is. Nova Canvas takes 320 to 4096, in multiples of 16
+IMAGE_SIZE = int(os.getenv("IMAGE_SIZE", "320"))
+# Concurrent image requests, keep within the account's Nova Canvas quota
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))
+IMAGE_MAX_ATTEMPTS = int(os.getenv("IMAGE_MAX_ATTEMPTS", "8"))
+# Backoff before retry n is a random wait of up to min(cap, base * 2**n) seconds
+RETRY_BASE_SECONDS = 2.0
+RETRY_CAP_SECONDS = 60.0
+RENDITION_SAVE_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 6},
+    "avif": {"format": "AVIF", "quality": 60},
+}
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "avif": "image/avif"}
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException", "ServiceUnavailableException", "ModelNotReadyException",
+    "ModelTimeoutException", "InternalServerException",
+}
+IMAGE_GENERATION_CONFIG = {
+    "seed": 12,
+    "quality": "standard",
+    "height": IMAGE_SIZE,
+    "width": IMAGE_SIZE,
+    "numberOfImages": 1,
+}
+
+# One client for every worker thread: its connection pool fits the worker pool,
+# and adaptive retries rate limit all of them together once Bedrock throttles
+bedrock_runtime = boto3.client(
+    service_name='bedrock-runtime',
+    region_name='us-east-1',  # Change to your preferred region
+    config=Config(
+        max_pool_connections=IMAGE_WORKERS,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+    )
+)
+s3_client = boto3.client('s3', config=Config(max_pool_connections=IMAGE_WORKERS))
+
+
 def read_jsonl_file(file_path):
-    """Read a JSONL file and return the parsed data."""
+    """
+    Read the product catalog, stored either as a JSON array or as NDJSON with one
+    product per line, the format generate_product_images_vectors.py writes.
+    """
     with open(file_path, 'r') as file:
-        content = file.read()
-        # The file appears to be a JSON array rather than JSONL
+        content = file.read().strip()
+    if content.startswith("["):
         return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
 
-def generate_image_with_bedrock(prompt, model_id="amazon.nova-canvas-v1:0"):
+def generate_image_with_bedrock(prompt, model_id=IMAGE_MODEL_ID):
     """Generate an image using Amazon Bedrock's Nova Canvas model."""
-    bedrock_runtime = boto3.client(
-        service_name='bedrock-runtime',
-        region_name='us-east-1'  # Change to your preferred region
-    )
-    
     # Prepare the request body for image generation
 # Format the request payload using the model's native structure.
     request_body = {
         "taskType": "TEXT_IMAGE",
         "textToImageParams": {"text": prompt},
-        "imageGenerationConfig": {
-            "seed": 12,
-            "quality": "standard",
-            "height": 640,
-            "width": 640,
-            "numberOfImages": 1,
-        },
+        "imageGenerationConfig": IMAGE_GENERATION_CONFIG,
     }
-    
+
     # Call the Bedrock API
     response = bedrock_runtime.invoke_model(
         modelId=model_id,
         body=json.dumps(request_body)
     )
-    
+
     # Parse the response
     response_body = json.loads(response['body'].read().decode('utf-8'))
-    
+
     # Extract the base64-encoded image
     image_data = response_body['images'][0]
-    
+
     # Convert base64 to image
     image_bytes = base64.b64decode(image_data)
     image = Image.open(BytesIO(image_bytes))
-    
+
     return image
 
+def is_retryable(error):
+    if isinstance(error, (ConnectionError, ReadTimeoutError)):
+        return True
+    return isinstance(error, ClientError) and error.response["Error"]["Code"] in RETRYABLE_ERROR_CODES
+
+def generate_image_with_retries(prompt, max_attempts=IMAGE_MAX_ATTEMPTS):
+    """
+    Generate an image, retrying throttling and transient errors with exponential
+    backoff and full jitter so that workers throttled together don't retry together.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return generate_image_with_bedrock(prompt)
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_attempts - 1:
+                raise
+            delay = random.uniform(0, min(RETRY_CAP_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+            print(f"Retrying in {delay:.1f}s after {type(e).__name__}: {e}")
+            time.sleep(delay)
+
 def save_image(image, file_path):
     """Save the PIL Image to the specified file path."""
     # Ensure the directory exists
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    
+
     # Save the image
     image.save(file_path, format='PNG')
     print(f"Image saved to {file_path}")
 
+def rendition_formats():
+    """The IMAGE_RENDITION_FORMATS this Pillow build can write."""
+    supported = [image_format for image_format in IMAGE_RENDITION_FORMATS if features.check(image_format)]
+    for image_format in set(IMAGE_RENDITION_FORMATS) - set(supported):
+        print(f"Skipping {image_format} renditions, this Pillow build can't write them")
+    return supported
+
+def save_renditions(image, file_name, data_folder, formats):
+    """
+    Save downscaled copies of image in every IMAGE_RENDITION_SIZES and format, at
+    data_folder/rendition_path, which mirrors their S3 keys under IMAGE_PREFIX.
+
+    Returns:
+        list: The paths written, relative to data_folder
+    """
+    paths = []
+    image = image.convert("RGB")
+    for size in IMAGE_RENDITION_SIZES:
+        rendition = image if image.width == size else image.resize((size, size), Image.LANCZOS)
+        for image_format in formats:
+            path = rendition_path(file_name, size, image_format)
+            os.makedirs(os.path.dirname(os.path.join(data_folder, path)), exist_ok=True)
+            rendition.save(os.path.join(data_folder, path), **RENDITION_SAVE_OPTIONS[image_format])
+            paths.append(path)
+    return paths
+
+def upload_images(paths, data_folder, bucket):
+    """Upload images from data_folder to the bucket under IMAGE_PREFIX, keyed by their relative paths."""
+    for path in paths:
+        extension = os.path.splitext(path)[1].lstrip(".").lower()
+        s3_client.upload_file(
+            os.path.join(data_folder, path), bucket, f"{IMAGE_PREFIX}{path}",
+            ExtraArgs={"ContentType": CONTENT_TYPES.get(extension, "application/octet-stream")}
+        )
+
+def image_prompt(product):
+    return f"A professional product photograph of {product['title']}. The product is {product['color']} in color. High-quality studio lighting, clean background, detailed product shot."
+
+def prompt_hash(prompt):
+    """Identifies what an image was generated from, so a changed prompt or config regenerates it."""
+    request = {"model_id": IMAGE_MODEL_ID, "prompt": prompt, "config": IMAGE_GENERATION_CONFIG}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def read_manifest(manifest_file):
+    """
+    Read the manifest of generated images, file name to prompt hash. It is an
+    append-only JSONL log, so an interrupted run loses at most the line being written.
+    """
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                manifest[entry["file_name"]] = entry["prompt_hash"]
+    return manifest
+
+def is_done(manifest, image_path, file_name, prompt):
+    """
+    An image is done when it exists and the manifest has no record of it, as for
+    images generated before there was a manifest, or records the same prompt.
+    """
+    return os.path.exists(image_path) and manifest.get(file_name, prompt_hash(prompt)) == prompt_hash(prompt)
+
+def has_renditions(data_folder, file_name, formats):
+    return all(
+        os.path.exists(os.path.join(data_folder, rendition_path(file_name, size, image_format)))
+        for size in IMAGE_RENDITION_SIZES for image_format in formats
+    )
+
+def generate_product_image(product, data_folder, formats, bucket, generate):
+    """
+    Generate and save the image for one product, or reuse the saved one unless
+    generate, then save its renditions and upload them all to bucket if given.
+    Runs in a worker thread.
+    """
+    prompt = image_prompt(product)
+    image_path = os.path.join(data_folder, product["file_name"])
+    if generate:
+        image = generate_image_with_retries(prompt)
+        save_image(image, image_path)
+    else:
+        image = Image.open(image_path)
+    paths = [product["file_name"]] + save_renditions(image, product["file_name"], data_folder, formats)
+    if bucket:
+        upload_images(paths, data_folder, bucket)
+    return prompt_hash(prompt)
+
 def main():
+    parser = argparse.ArgumentParser(description="Generate product images with Amazon Bedrock")
     # Path to the products_content.jsonl file
-    products_file = "artifacts/index_lambda/products_content.jsonl"
-    
+    parser.add_argument("--products", default="artifacts/index_lambda/products_content.jsonl")
     # Path to the data folder for saving images
-    data_folder = "artifacts/data"
-    
+    parser.add_argument("--data-folder", default="artifacts/data")
+    # Kept outside the data folder, which is uploaded to S3 as is
+    parser.add_argument("--manifest", default="artifacts/image_manifest.jsonl")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS)
+    parser.add_argument("--force", action="store_true", help="Regenerate images that already exist")
+    parser.add_argument("--bucket", default=os.getenv("S3_BUCKET_NAME"),
+                        help="Upload new images and renditions to this bucket, defaults to $S3_BUCKET_NAME")
+    args = parser.parse_args()
+    formats = rendition_formats()
+
     # Read the products data
-    products = read_jsonl_file(products_file)
-    
-    # Process each product
+    products = read_jsonl_file(args.products)
+    manifest = {} if args.force else read_manifest(args.manifest)
+
+    pending = []
+    skipped = 0
     for product in products:
-        title = product.get("title", "")
-        color = product.get("color", "")
-        file_name = product.get("file_name", "")
-        
-        if title and color and file_name:
-            # Create a prompt for image generation
-            prompt = f"A professional product photograph of {title}. The product is {color} in color. High-quality studio lighting, clean background, detailed product shot."
-            
-            print(f"Generating image for: {title}")
-            print(f"Prompt: {prompt}")
-            
-            try:
-                # Generate the image
-                image = generate_image_with_bedrock(prompt)
-                # resize the image to 320x320
-                image = image.resize((320, 320))
-                # Save the image
-                image_path = os.path.join(data_folder, file_name)
-                save_image(image, image_path)
-                print(f"Successfully generated and saved image for {title}")
-                
-            except Exception as e:
-                print(f"Error generating image for {title}: {str(e)}")
-        else:
+        if not (product.get("title") and product.get("color") and product.get("file_name")):
             print(f"Skipping product due to missing data: {product}")
+            continue
+        image_path = os.path.join(args.data_folder, product["file_name"])
+        generate = args.force or not is_done(manifest, image_path, product["file_name"], image_prompt(product))
+        if not generate and has_renditions(args.data_folder, product["file_name"], formats):
+            skipped += 1
+            continue
+        pending.append((product, generate))
+    to_generate = sum(1 for _, generate in pending if generate)
+    print(f"{to_generate} images to generate, {len(pending) - to_generate} to render, {skipped} already present")
+
+    started = time.perf_counter()
+    generated = failed = 0
+    queue = iter(pending)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, open(args.manifest, "a") as manifest_file:
+        # Keep at most two tasks per worker queued, however large the catalog
+        while True:
+            while len(in_flight) < args.workers * 2:
+                task = next(queue, None)
+                if task is None:
+                    break
+                product, generate = task
+                in_flight[executor.submit(
+                    generate_product_image, product, args.data_folder, formats, args.bucket, generate
+                )] = product
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                product = in_flight.pop(future)
+                try:
+                    manifest_file.write(json.dumps({"file_name": product["file_name"], "prompt_hash": future.result()}) + "\n")
+                    manifest_file.flush()
+                    generated += 1
+                    print(f"Successfully generated and saved image for {product['title']} ({generated}/{len(pending)})")
+                except Exception as e:
+                    failed += 1
+                    print(f"Error generating image for {product['title']}: {str(e)}")
+
+    print(f"Generated {generated}, skipped {skipped}, failed {failed} in {time.perf_counter() - started:.1f}s")
+    if failed:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -7,6 +7,12 @@ from io import BytesIO
 from PIL import Image
 from os import getenv
 import logging
+import re
+import sys
+from itertools import islice
+# Embedding providers are shared with the Lambdas through the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts", "shared_layer", "python"))
+from embeddings import EMBEDDING_PROVIDER, create_embedding_provider
 # Please install the following packages in a virtual environment locally:
 # pip install boto3
 # pip install Pillow
@@ -17,14 +23,122 @@ bedrock_client = boto3.client(
     service_name='bedrock-runtime',
     region_name='us-east-1'  # Change to your preferred region
 )
+# EMBEDDING_PROVIDER=hashing or random_projection writes deterministic vectors without Bedrock
+embedding_provider = create_embedding_provider(EMBEDDING_PROVIDER, bedrock_client)
+# Characters read at a time when streaming products
+READ_CHUNK_SIZE = 1 << 20
 
+PRODUCT_NAME_MODEL_ID = getenv("PRODUCT_NAME_MODEL_ID", "amazon.nova-lite-v1:0")
+PRODUCT_NAMES = ["shoes", "bag", "apparel", "accessories", "innerwear"]
+# Titles classified per converse call
+PRODUCT_NAME_BATCH_SIZE = int(getenv("PRODUCT_NAME_BATCH_SIZE", "40"))
+PRODUCT_NAME_CACHE_FILE = "artifacts/index_lambda/product_name_cache.json"
+# Title words that settle the product name without asking the model, in singular form
+PRODUCT_NAME_KEYWORDS = {
+    "shoes": {"shoe", "sneaker", "boot", "heel", "pump", "sandal", "stiletto", "loafer", "oxford", "slipper", "trainer", "flip-flop"},
+    "bag": {"bag", "tote", "backpack", "duffel", "duffle", "clutch", "purse", "satchel", "handbag", "weekender", "messenger"},
+    "apparel": {"jacket", "shirt", "t-shirt", "short", "legging", "hoodie", "pant", "jean", "dress", "skirt", "sweater", "coat", "polo", "jersey"},
+    "innerwear": {"bra", "sock", "underwear", "brief", "boxer", "lingerie", "undershirt"},
+    "accessories": {"watch", "sunglass", "hat", "cap", "belt", "scarf", "glove", "wallet", "headband", "bracelet", "necklace"},
+}
+# Answers the model gives that mean one of PRODUCT_NAMES
+PRODUCT_NAME_ALIASES = {
+    "shoe": "shoes", "footwear": "shoes", "bags": "bag", "accessory": "accessories",
+    "clothing": "apparel", "clothes": "apparel", "underwear": "innerwear",
+}
 
-def read_jsonl_file(file_path):
-    """Read a JSONL file and return the parsed data."""
+
+def iter_products(file_path):
+    """
+    Stream products one at a time from a JSON array, as products_content.jsonl is
+    stored, or from NDJSON, so a catalog never has to fit in memory.
+    """
+    decoder = json.JSONDecoder()
     with open(file_path, 'r') as file:
-        content = file.read()
-        # The file appears to be a JSON array rather than JSONL
-        return json.loads(content)
+        buffer = ""
+        eof = False
+        while True:
+            # skip the array brackets and separators around each product
+            buffer = buffer.lstrip(" \t\r\n,[]")
+            if not buffer:
+                if eof:
+                    return
+                chunk = file.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer = chunk
+                continue
+            try:
+                product, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # the product continues in the next chunk
+                chunk = file.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            yield product
+
+def batches(items, batch_size):
+    """Yield lists of up to batch_size items from an iterable."""
+    items = iter(items)
+    while batch := list(islice(items, batch_size)):
+        yield batch
+
+class CheckpointedNDJSONWriter:
+    """
+    Writes records to an NDJSON file one per line, a batch at a time.
+
+    After each batch the file is fsynced, then a checkpoint with the number of
+    records and the byte offset they end at is written next to it and atomically
+    renamed into place. Reopening the writer truncates whatever was written after
+    the last checkpoint, so a crashed run resumes after its last complete batch,
+    `records` being how many input records to skip.
+
+    Use as a context manager: leaving the block normally marks the file complete.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.checkpoint_path = f"{file_path}.checkpoint"
+        self.records = 0
+        self.complete = False
+        offset = 0
+        if os.path.exists(self.checkpoint_path) and os.path.exists(file_path):
+            with open(self.checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            self.records = checkpoint["records"]
+            self.complete = checkpoint["complete"]
+            offset = checkpoint["offset"]
+        self.file = open(file_path, "r+b" if offset else "wb")
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def write_batch(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += len(records)
+        self.save_checkpoint()
+
+    def save_checkpoint(self):
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump({"records": self.records, "offset": self.file.tell(), "complete": self.complete}, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self.complete:
+            self.complete = True
+            self.save_checkpoint()
+        self.file.close()
 
 def generate_image_with_bedrock(prompt, model_id="amazon.nova-canvas-v1:0"):
     """Generate an image using Amazon Bedrock's Nova Canvas model."""
@@ -75,67 +189,38 @@ def save_image(image, file_path):
     print(f"Image saved to {file_path}")
 
 
-def get_embedding(text):
-    """
-    Gets embedding for text using Cohere model via Bedrock.
-    """
-    try:
-        body = json.dumps({
-            "texts": [text],
-            "input_type": "search_document",
-            "truncate": "END",
-            "embedding_types": ["float"]
-        })
-        LOG.info(f"method=get_embedding, body={body}")
-        response = bedrock_client.invoke_model(
-            modelId=MODEL_ID,
-            accept='application/json',
-            contentType='application/json',
-            body=body
-        )
-        LOG.info(f"method=get_embedding, response={response}")
-        response_body = json.loads(response.get('body').read())
-        return response_body['embeddings']['float'][0]
-    except Exception as e:
-        LOG.error(f"Error getting embedding: {str(e)}")
-        raise e
-
 def generate_cohere_embeddings():
     # Path to the products_content_vectors.jsonl file
     products_file = "artifacts/index_lambda/products_content.jsonl"
-    products_file_temp = "artifacts/index_lambda/products_content_temp.jsonl"
-    # Read the products data
-    product_list = read_jsonl_file(products_file)
-    processed_products = []
+    # one output, and checkpoint, per job so the jobs never resume from each other's
+    products_file_temp = "artifacts/index_lambda/products_content_embeddings_temp.jsonl"
     # Process products in batches
     batch_size = 90  # Smaller batch size due to embedding API calls
-    for i in range(0, len(product_list), batch_size):
-        batch = product_list[i:i + batch_size]
-        batch_products = []
-        for product in batch:
-            if "vector_embedding" in product:
-                batch_products.append(product)
-                continue
-            # Combine relevant fields
-            combined_text = f"{product.get('title', '')}, Category: {product.get('category', '')}, Description: {product.get('description', '')}"
-            # Get embedding
-            vector_embedding = get_embedding(combined_text)
+    with CheckpointedNDJSONWriter(products_file_temp) as writer:
+        if writer.complete:
+            print(f"{products_file_temp} is complete, delete it and its checkpoint to regenerate")
+            return
+        if writer.records:
+            print(f"Resuming after {writer.records} products")
+        # Stream the products data, skipping those already written
+        for batch in batches(islice(iter_products(products_file), writer.records, None), batch_size):
+            embed_batch(batch)
+            writer.write_batch(batch)
+            print(f"Wrote {writer.records} products to {products_file_temp}")
+
+def embed_batch(batch):
+    """Add a vector_embedding to the products in batch that have none, in one provider call."""
+    to_embed = [product for product in batch if "vector_embedding" not in product]
+    if to_embed:
+        # Combine relevant fields, one provider call embeds the whole batch
+        combined_texts = [
+            f"{product.get('title', '')}, Category: {product.get('category', '')}, Description: {product.get('description', '')}"
+            for product in to_embed
+        ]
+        vector_embeddings = embedding_provider.embed(combined_texts, "search_document")
+        for product, vector_embedding in zip(to_embed, vector_embeddings):
             product['vector_embedding'] = vector_embedding
-            batch_products.append(product)
             print(f"Generated embedding for {product.get('title', '')}")
-        processed_products.extend(batch_products)
-        
-        # Dump batch to file
-        if i == 0:
-            with open(products_file_temp, "w") as json_file:
-                json.dump(processed_products, json_file)
-        else:
-            with open(products_file_temp, "a") as json_file:
-                json.dump(batch_products, json_file)
-
-            
-    
-
 
 def generate_images_for_products():
     # Path to the products_content_vectors.jsonl file
@@ -144,11 +229,8 @@ def generate_images_for_products():
     # Path to the data folder for saving images
     data_folder = "artifacts/data_vectors"
     
-    # Read the products data
-    products = read_jsonl_file(products_file)
-    
-    # Process each product
-    for product in products:
+    # Stream the products data, a JSON array or the NDJSON this script writes
+    for product in iter_products(products_file):
         title = product.get("title", "")
         color = product.get("color", "")
         file_name = product.get("file_name", "")
@@ -175,60 +257,167 @@ def generate_images_for_products():
         else:
             print(f"Skipping product due to missing data: {product}")
 
+def singular_forms(word):
+    forms = {word}
+    if word.endswith("es"):
+        forms.add(word[:-2])
+    if word.endswith("s"):
+        forms.add(word[:-1])
+    return forms
+
+def keyword_product_name(title):
+    """
+    Return the product name when the title's words point to exactly one of
+    PRODUCT_NAMES, and None when they point to none or to several.
+    """
+    words = set()
+    for word in re.findall(r"[\w-]+", title.lower()):
+        words |= singular_forms(word)
+    matches = [name for name, keywords in PRODUCT_NAME_KEYWORDS.items() if words & keywords]
+    return matches[0] if len(matches) == 1 else None
+
+def normalize_product_name(value):
+    name = str(value).strip().strip('."\'').lower()
+    name = PRODUCT_NAME_ALIASES.get(name, name)
+    return name if name in PRODUCT_NAMES + ["other"] else None
+
+def parse_product_names(text):
+    """
+    Parse the model's {"<number>": "<product name>"} answer. Output that isn't
+    valid JSON, e.g. wrapped in a code fence, with trailing commas or cut short
+    at maxTokens, is repaired by picking out the number and name pairs one by one.
+
+    Returns:
+        dict: Title number as a string to the raw answer for it
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            parsed = json.loads(match.group(0))
+            if isinstance(parsed, dict):
+                return {str(number): name for number, name in parsed.items()}
+        except json.JSONDecodeError:
+            pass
+    return dict(re.findall(r'"?(\d+)"?\s*:\s*"([^"]*)"', text))
+
+class ProductNameClassifier:
+    """
+    Classifies product titles into one of PRODUCT_NAMES or "other".
+
+    Titles are looked up in a cache kept in PRODUCT_NAME_CACHE_FILE, then in the
+    keyword table, and only the rest go to the model, PRODUCT_NAME_BATCH_SIZE to
+    a converse call, as a numbered list to be answered with a JSON object.
+    Answers that are missing or not a valid product name are asked again once,
+    in a batch of their own, and fall back to "other" after that.
+    """
+
+    def __init__(self, cache_file=PRODUCT_NAME_CACHE_FILE):
+        self.cache_file = cache_file
+        self.cache = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as file:
+                self.cache = json.load(file)
+        self.stats = {"cached": 0, "keyword": 0, "model": 0, "fallback": 0, "calls": 0}
+
+    @staticmethod
+    def cache_key(title):
+        return " ".join(title.lower().split())
+
+    def classify(self, titles):
+        """
+        Returns:
+            dict: Each of titles to its product name
+        """
+        names = {}
+        unknown = []
+        for title in dict.fromkeys(titles):
+            key = self.cache_key(title)
+            if not key:
+                names[title] = "other"
+            elif key in self.cache:
+                names[title] = self.cache[key]
+                self.stats["cached"] += 1
+            elif (name := keyword_product_name(title)):
+                names[title] = name
+                self.stats["keyword"] += 1
+            else:
+                unknown.append(title)
+        for batch in batches(unknown, PRODUCT_NAME_BATCH_SIZE):
+            answered = self.ask_model(batch)
+            retry = [title for title in batch if title not in answered]
+            if retry:
+                answered.update(self.ask_model(retry))
+            for title in batch:
+                if title in answered:
+                    self.stats["model"] += 1
+                    self.cache[self.cache_key(title)] = answered[title]
+                else:
+                    self.stats["fallback"] += 1
+                    LOG.warning(f"method=ProductNameClassifier.classify, no valid answer for {title}")
+                names[title] = answered.get(title, "other")
+        return names
+
+    def ask_model(self, titles):
+        """
+        Returns:
+            dict: Title to product name, for the titles the model gave a valid answer for
+        """
+        numbered = "\n".join(f"{number}. {title}" for number, title in enumerate(titles, 1))
+        prompt = f"""Classify each product title below by its main product type.
+        Choose from: {", ".join(PRODUCT_NAMES)}. If a title is not clear use "other".
+        Return only a JSON object mapping every title's number to its product type, like {{"1": "shoes", "2": "bag"}}, nothing else.
+
+{numbered}"""
+        self.stats["calls"] += 1
+        response = bedrock_client.converse(
+            modelId=PRODUCT_NAME_MODEL_ID,
+            messages=[{"role": "user", "content": [{"text": prompt}]}],
+            # about 8 tokens per answer, with room for the braces and a code fence
+            inferenceConfig={"maxTokens": 8 * len(titles) + 32, "temperature": 0},
+        )
+        text = response["output"]["message"]["content"][0]["text"]
+        answered = {}
+        for number, name in parse_product_names(text).items():
+            name = normalize_product_name(name)
+            if name and number.isdigit() and 1 <= int(number) <= len(titles):
+                answered[titles[int(number) - 1]] = name
+        return answered
+
+    def save(self):
+        """Write the cache atomically, so an interrupted run never leaves it half written."""
+        temp_path = f"{self.cache_file}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.cache, file, indent=0, sort_keys=True)
+        os.replace(temp_path, self.cache_file)
+
 def generate_product_name_from_title():
-    """Extract product name from title using Amazon Bedrock."""
+    """Extract product name from title, with keywords, a cache and batched Amazon Bedrock calls."""
     products_file = "artifacts/index_lambda/products_content.jsonl"
-    products_file_temp = "artifacts/index_lambda/products_content_temp.jsonl"
-    
-    products = read_jsonl_file(products_file)
-    batch_size = 30
-    processed_products = []
-    
-    for i in range(0, len(products), batch_size):
-        batch = products[i:i + batch_size]
-        batch_products = []
-        
-        for product in batch:
-            title = product.get("title", "")
-            prompt = f"""Given the product title: "{title}", extract only the main product type.
-            Choose from: shoes, bag, apparel, accessories, innerwear. If the title is not clear return "other"
-            Return only the product type, nothing else."""
-            
-            conversation = [
-                {
-                    "role": "user",
-                    "content": [{"text": prompt}]
-                }
-            ]
-            
-            response = bedrock_client.converse(
-                modelId='amazon.nova-lite-v1:0',
-                messages=conversation,
-                inferenceConfig={"maxTokens": 10, "temperature": 0.1},
-            )
-            
-            product_name = response["output"]["message"]["content"][0]["text"].strip().lower()
-            product["product_name"] = product_name
-            batch_products.append(product)
-        
-        processed_products.extend(batch_products)
-        
-        # Dump batch to file
-        if i == 0:
-            with open(products_file_temp, "w") as json_file:
-                json.dump(processed_products, json_file)
-        else:
-            with open(products_file_temp, "a") as json_file:
-                json.dump(batch_products, json_file)
-        
-        print(f"Processed batch {i//batch_size + 1} of {(len(products) + batch_size - 1)//batch_size}")
+    products_file_temp = "artifacts/index_lambda/products_content_product_names_temp.jsonl"
+    batch_size = 200
+    classifier = ProductNameClassifier()
+
+    with CheckpointedNDJSONWriter(products_file_temp) as writer:
+        if writer.complete:
+            print(f"{products_file_temp} is complete, delete it and its checkpoint to regenerate")
+            return
+        if writer.records:
+            print(f"Resuming after {writer.records} products")
+        for batch in batches(islice(iter_products(products_file), writer.records, None), batch_size):
+            names = classifier.classify([product.get("title", "") for product in batch])
+            for product in batch:
+                product["product_name"] = names[product.get("title", "")]
+            # the cache is saved first, a crash in between only means asking again
+            classifier.save()
+            writer.write_batch(batch)
+            print(f"Processed {writer.records} products, {classifier.stats}")
 
 if __name__ == "__main__":
     #generate_images_for_products()
     generate_cohere_embeddings()
 
     #product_name should be extracted from the title, for example it could be shoes, bag, apparel, accessories, innerwear only
-    # write the entire json including product_name to a products_content_temp.jsonl file
+    # write the entire json including product_name to a products_content_product_names_temp.jsonl file
     # invoke the nova-lite-v1 model to generate the product_name
     #generate_product_name_from_title()
 
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Synthetic catalog generator for ingest tests at scale.
+
+Uses the products in products_content.jsonl as seeds to synthesize any number of
+products. Each synthetic product starts from a seed product, takes a color and
+category drawn from those in the seed catalog, gets its title and description
+rewritten to match, a modifier prepended to its title some of the time, and a
+jittered price. Its vector is the seed's vector plus a small random perturbation,
+renormalized, so synthetic products cluster around their seeds like near
+duplicates do in a real catalog.
+
+Products are streamed to --output as NDJSON, one per line, without vectors.
+Vectors go to the --vectors sidecar as raw little-endian float32 rows, row i
+belonging to line i, described by a <vectors>.json manifest. --inline-vectors
+writes them into the NDJSON as vector_embedding instead, the shape
+vectorize_and_index_products expects.
+
+Product i depends only on --seed, i and the seed catalog, so the same arguments
+always write the same files, and a larger --count extends a smaller one.
+
+Seed products without a vector_embedding are embedded once with the
+EMBEDDING_PROVIDER, see artifacts/shared_layer/python/embeddings.py.
+
+Examples:
+    python generate_synthetic_catalog.py --count 100000
+    EMBEDDING_PROVIDER=hashing python generate_synthetic_catalog.py --count 10000000 \\
+        --output /data/products_10m.ndjson --vectors /data/products_10m.f32
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from array import array
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Embedding providers are shared with the Lambdas through the shared layer
+sys.path.insert(0, os.path.join(ROOT, "artifacts", "shared_layer", "python"))
+from embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_PROVIDER, create_embedding_provider  # noqa: E402
+
+TITLE_MODIFIERS = [
+    "Classic", "Premium", "Essential", "Lightweight", "Everyday", "Pro", "Deluxe",
+    "Vintage", "Modern", "Eco", "Compact", "Sport", "Signature", "Limited Edition",
+]
+# Share of synthetic titles that get a modifier prepended
+TITLE_MODIFIER_RATE = 0.5
+# Perturbation vectors shared by all products, two are mixed per product
+NOISE_POOL_SIZE = 256
+PROGRESS_EVERY = 100_000
+
+
+def read_seeds(path):
+    """Reads a product catalog stored as a JSON array, like products_content.jsonl, or as NDJSON."""
+    with open(path) as seeds_file:
+        content = seeds_file.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def unit(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def seed_vectors(seeds):
+    """
+    Returns a unit vector per seed product, embedding the ones that have none in
+    one batch with the configured EMBEDDING_PROVIDER.
+    """
+    missing = [position for position, product in enumerate(seeds) if not product.get("vector_embedding")]
+    vectors = [product.get("vector_embedding") for product in seeds]
+    if missing:
+        print(f"Embedding {len(missing)} seed products with the {EMBEDDING_PROVIDER} provider")
+        provider = create_embedding_provider(EMBEDDING_PROVIDER)
+        texts = [
+            f"{seeds[position].get('title', '')}, Category: {seeds[position].get('category', '')}, Description: {seeds[position].get('description', '')}"
+            for position in missing
+        ]
+        for position, vector in zip(missing, provider.embed(texts, "search_document")):
+            vectors[position] = vector
+    return [unit(vector) for vector in vectors]
+
+
+def noise_pool(seed, dimensions):
+    generator = random.Random(f"{seed}:noise")
+    return [
+        unit([generator.gauss(0.0, 1.0) for _ in range(dimensions)])
+        for _ in range(NOISE_POOL_SIZE)
+    ]
+
+
+def distinct(seeds, field):
+    return sorted({str(product[field]) for product in seeds if product.get(field)})
+
+
+def replace_word(text, old, new):
+    """Replaces whole word occurrences of old in text with new, keeping their capitalization."""
+    if not old or not text:
+        return text
+
+    def matched(match):
+        word = match.group(0)
+        return new.capitalize() if word[:1].isupper() else new
+
+    return re.sub(rf"\b{re.escape(old)}\b", matched, text, flags=re.IGNORECASE)
+
+
+class CatalogGenerator:
+    """
+    Synthesizes product i from the seed catalog with its own random generator,
+    seeded from --seed and i, so products can be produced in any order or range.
+    """
+
+    def __init__(self, seeds, seed, price_jitter, vector_noise):
+        self.seeds = seeds
+        self.seed = seed
+        self.price_jitter = price_jitter
+        self.vector_noise = vector_noise
+        self.colors = distinct(seeds, "color")
+        self.categories = distinct(seeds, "category")
+        self.vectors = seed_vectors(seeds)
+        self.dimensions = len(self.vectors[0]) if self.vectors else EMBEDDING_DIMENSIONS
+        self.noise = noise_pool(seed, self.dimensions)
+
+    def product(self, i):
+        """
+        Returns:
+            tuple: (product, vector) for synthetic product i
+        """
+        generator = random.Random(f"{self.seed}:{i}")
+        position = generator.randrange(len(self.seeds))
+        base = self.seeds[position]
+        product = {key: value for key, value in base.items() if key != "vector_embedding"}
+
+        title = base.get("title", "")
+        description = base.get("description", "")
+        if self.colors and base.get("color"):
+            color = generator.choice(self.colors)
+            title = replace_word(title, base["color"], color)
+            description = replace_word(description, base["color"], color)
+            product["color"] = color
+        if self.categories and base.get("category"):
+            category = generator.choice(self.categories)
+            title = replace_word(title, base["category"], category)
+            description = replace_word(description, base["category"], category)
+            product["category"] = category
+        if generator.random() < TITLE_MODIFIER_RATE:
+            title = f"{generator.choice(TITLE_MODIFIERS)} {title}"
+        product["title"] = title
+        product["description"] = description
+        if isinstance(base.get("price"), (int, float)):
+            # log-normal jitter keeps prices positive and the spread proportional
+            price = base["price"] * math.exp(generator.gauss(0.0, self.price_jitter))
+            product["price"] = round(max(price, 0.99), 2)
+        product["synthetic_id"] = f"syn-{i:09d}"
+        product["seed_product"] = position
+
+        first, second = self.noise[generator.randrange(NOISE_POOL_SIZE)], self.noise[generator.randrange(NOISE_POOL_SIZE)]
+        angle = generator.uniform(0.0, math.pi / 2)
+        # random unit vectors in high dimensions are nearly orthogonal, so this mix of two is
+        # close to unit length, making the noise about vector_noise of the seed vector
+        first_weight = self.vector_noise * math.cos(angle)
+        second_weight = self.vector_noise * math.sin(angle)
+        vector = unit([
+            value + first_weight * a + second_weight * b
+            for value, a, b in zip(self.vectors[position], first, second)
+        ])
+        return product, vector
+
+
+def read_catalog(output, vectors=None, start=0, stop=None):
+    """
+    Streams a generated catalog back, one product at a time, with its vector as
+    vector_embedding when a vectors sidecar is given. For feeding
+    bulk_index_documents or the vector indices in batches without loading the
+    whole catalog.
+    """
+    dimensions = 0
+    vectors_file = None
+    if vectors:
+        with open(f"{vectors}.json") as manifest_file:
+            dimensions = json.load(manifest_file)["dimensions"]
+        vectors_file = open(vectors, "rb")
+        vectors_file.seek(start * dimensions * 4)
+    try:
+        with open(output) as products_file:
+            for line_number, line in enumerate(products_file):
+                if line_number < start:
+                    continue
+                if stop is not None and line_number >= stop:
+                    break
+                product = json.loads(line)
+                if vectors_file:
+                    row = array("f")
+                    row.frombytes(vectors_file.read(dimensions * 4))
+                    if sys.byteorder == "big":
+                        row.byteswap()
+                    product["vector_embedding"] = row.tolist()
+                yield product
+    finally:
+        if vectors_file:
+            vectors_file.close()
+
+
+def generate(generator, count, output, vectors, inline_vectors):
+    """
+    Writes count products to output, and their vectors to the vectors sidecar
+    unless inline_vectors. Each file is written under a temporary name and renamed
+    once complete, so a partial run never looks like a finished catalog.
+    """
+    started = time.perf_counter()
+    partial_output = f"{output}.partial"
+    partial_vectors = f"{vectors}.partial"
+    with open(partial_output, "w", buffering=1 << 20) as products_file, \
+            open(os.devnull if inline_vectors else partial_vectors, "wb", buffering=1 << 20) as vectors_file:
+        for i in range(count):
+            product, vector = generator.product(i)
+            if inline_vectors:
+                product["vector_embedding"] = vector
+            else:
+                row = array("f", vector)
+                if sys.byteorder == "big":
+                    row.byteswap()
+                vectors_file.write(row.tobytes())
+            products_file.write(json.dumps(product, separators=(",", ":")) + "\n")
+            if (i + 1) % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{i + 1} products, {(i + 1) / elapsed:.0f}/s")
+    os.replace(partial_output, output)
+    if not inline_vectors:
+        os.replace(partial_vectors, vectors)
+        with open(f"{vectors}.json", "w") as manifest_file:
+            json.dump({
+                "products": os.path.basename(output),
+                "count": count,
+                "dimensions": generator.dimensions,
+                "dtype": "float32",
+                "byte_order": "little",
+                "seed": generator.seed,
+            }, manifest_file, indent=2)
+    print(f"Wrote {count} products to {output} in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic product catalog from the sample products")
+    parser.add_argument("--count", type=int, required=True, help="Number of products to generate")
+    parser.add_argument("--seeds", default=os.path.join(ROOT, "artifacts", "index_lambda", "products_content.jsonl"),
+                        help="Seed catalog, a JSON array or NDJSON of products")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed, the same seed gives the same catalog")
+    parser.add_argument("--output", default="products_synthetic.ndjson")
+    parser.add_argument("--vectors", help="Vector sidecar file, defaults to --output with a .f32 extension")
+    parser.add_argument("--inline-vectors", action="store_true",
+                        help="Write vectors into the NDJSON as vector_embedding instead of a sidecar")
+    parser.add_argument("--price-jitter", type=float, default=0.15,
+                        help="Standard deviation of the log-normal price jitter")
+    parser.add_argument("--vector-noise", type=float, default=0.1,
+                        help="Length of the perturbation added to each seed vector, relative to it")
+    args = parser.parse_args()
+
+    seeds = read_seeds(args.seeds)
+    if not seeds:
+        parser.error(f"no seed products in {args.seeds}")
+    vectors = args.vectors or f"{os.path.splitext(args.output)[0]}.f32"
+    generator = CatalogGenerator(seeds, args.seed, args.price_jitter, args.vector_noise)
+    generate(generator, args.count, args.output, vectors, args.inline_vectors)
+
+
+if __name__ == "__main__":
+    main()
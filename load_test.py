@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Load test for the search and index Lambdas.
+
+Sends API Gateway style requests for every search type, plus single document
+indexing, and reports throughput, latency percentiles and errors per scenario.
+
+Targets:
+    local  Invokes opensearch_search.handler and opensearch_index.handler in worker
+           processes, one per unit of concurrency like Lambda execution environments.
+           The handlers use whatever OPENSEARCH_HOST, S3_BUCKET_NAME and AWS
+           credentials are set in the environment, or with --emulator the offline
+           stand-ins in artifacts/shared_layer/python/emulator.py, each worker
+           loading its own copy of --catalog.
+    api    Sends HTTPS requests to a deployed stack's API Gateway URL, authorized
+           with a Cognito id token.
+
+With --rate the load is open loop: requests arrive at a fixed rate whether or not
+earlier ones have finished, and latency includes time spent queued. Without it
+--concurrency workers send back to back.
+
+Examples:
+    python load_test.py --target local --concurrency 4 --duration 60
+    python load_test.py --target local --emulator --catalog products.json --requests 2000
+    python load_test.py --target api --api-url https://abc.execute-api.us-east-1.amazonaws.com/dev \\
+        --token "$ID_TOKEN" --rate 20 --duration 120 --mix multi_match=3,hybrid_search=1
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+QUERIES = [
+    "running shoes", "leather bag", "yoga mat", "fitness watch", "sneakers",
+    "ankle boots", "backpack", "sunglasses", "gym tote", "travel wallet",
+]
+CATEGORIES = ["men", "women", "unisex"]
+COLORS = ["red", "blue", "black", "white", "grey", "pink", "green", "brown"]
+# Vector index modes vector and hybrid searches are spread over, add the opt-in
+# fp16, int8 and binary modes once the index Lambda builds them
+VECTOR_MODES = os.getenv("LOAD_TEST_VECTOR_MODES", "on_disk,in_memory,fp16").split(",")
+
+
+def multi_match(rng):
+    return {
+        "type": "multi_match",
+        "attribute_name": "None",
+        "attribute_value": rng.choice(QUERIES),
+        "fields": [
+            {"field": "title", "boost": 3},
+            {"field": "description", "boost": 1},
+            {"field": "color", "boost": 2},
+        ],
+    }
+
+
+def wildcard_match(rng):
+    word = rng.choice(QUERIES).split()[-1]
+    return {
+        "type": "wildcard_match",
+        "attribute_name": rng.choice(["title", "description"]),
+        "attribute_value": f"*{word[:4]}*",
+        "case_insensitive": True,
+    }
+
+
+def match(rng):
+    return {
+        "type": "match",
+        "attribute_name": rng.choice(["title", "description"]),
+        "attribute_value": rng.choice(QUERIES),
+        "minimum_should_match": rng.choice(["50%", "100%"]),
+    }
+
+
+def prefix_match(rng):
+    return {
+        "type": "prefix_match",
+        "attribute_name": "title",
+        "attribute_value": rng.choice(QUERIES)[:rng.randint(3, 8)],
+    }
+
+
+def range_filter(rng):
+    return {
+        "type": "range_filter",
+        "attribute_name": "price",
+        "attribute_value": rng.choice([25, 50, 100, 200]),
+        "operator": rng.choice(["gt", "gte", "lt", "lte"]),
+    }
+
+
+def complex_search(rng):
+    return {
+        "type": "complex_search",
+        "search_value": rng.choice(QUERIES),
+        "search_type": rng.choice(["combined", "any", "exact", "fuzzy"]),
+        "fields": [
+            {"name": "category", "type": "select", "value": rng.choice(CATEGORIES)},
+            {"name": "price", "type": "range", "value": {"min": 20, "max": rng.choice([100, 300])}},
+        ],
+    }
+
+
+def aggregations(rng):
+    return {
+        "type": "complex_search",
+        "search_type": "aggregations",
+        "aggregations": [
+            {"name": "category_counts", "type": "terms", "field": "category", "size": 10},
+            {"name": "color_counts", "type": "terms", "field": "color", "size": 10},
+            {"name": "price_stats", "type": "stats", "field": "price"},
+        ],
+    }
+
+
+def vector_search(rng):
+    return {
+        "type": "vector_search",
+        "attribute_name": "vector_embedding",
+        "attribute_value": rng.choice(QUERIES),
+        "mode": rng.choice(VECTOR_MODES),
+    }
+
+
+def hybrid_search(rng):
+    return {
+        "type": "hybrid_search",
+        "attribute_name": "vector_embedding",
+        "attribute_value": f"{rng.choice(COLORS)} {rng.choice(QUERIES)} for {rng.choice(CATEGORIES)}",
+        "mode": rng.choice(VECTOR_MODES),
+    }
+
+
+def index_custom_document(rng):
+    query = rng.choice(QUERIES)
+    return {
+        "title": f"Load test {query}",
+        "description": f"A {rng.choice(COLORS)} {query} indexed by load_test.py",
+        "color": rng.choice(COLORS),
+        "category": rng.choice(CATEGORIES),
+        "price": round(rng.uniform(5, 400), 2),
+        "file_name": "0-Women-running-shoes.png",
+    }
+
+
+# name -> (handler, HTTP method, resource, body builder, default weight)
+SCENARIOS = {
+    "multi_match": ("search", "POST", "/search", multi_match, 2),
+    "wildcard_match": ("search", "POST", "/search", wildcard_match, 2),
+    "match": ("search", "POST", "/search", match, 2),
+    "prefix_match": ("search", "POST", "/search", prefix_match, 2),
+    "range_filter": ("search", "POST", "/search", range_filter, 2),
+    "complex_search": ("search", "POST", "/search", complex_search, 2),
+    "aggregations": ("search", "POST", "/search", aggregations, 2),
+    "vector_search": ("search", "POST", "/search", vector_search, 2),
+    "hybrid_search": ("search", "POST", "/search", hybrid_search, 2),
+    "index_custom_document": ("index", "POST", "/index-custom-document", index_custom_document, 1),
+    # embeds and indexes the whole products_content.jsonl catalog, opt in with --mix
+    "vectorize_index": ("index", "POST", "/vectorize-index", lambda rng: {}, 0),
+}
+
+
+def build_event(name, rng):
+    """Builds the API Gateway proxy event for one request of scenario name."""
+    _, method, resource, body_builder, _ = SCENARIOS[name]
+    return {
+        "httpMethod": method,
+        "resource": resource,
+        "path": resource,
+        "body": json.dumps(body_builder(rng)),
+        "requestContext": {"authorizer": {"claims": {"cognito:groups": ""}}},
+    }
+
+
+def classify(status_code, body):
+    """Returns None for a successful response, otherwise a short error label."""
+    try:
+        payload = json.loads(body) if isinstance(body, str) else body
+    except ValueError:
+        payload = {}
+    if str(status_code) == "200" and isinstance(payload, dict) and payload.get("success"):
+        return None
+    message = payload.get("errorMessage") if isinstance(payload, dict) else None
+    return f"{status_code}: {str(message or body)[:80]}"
+
+
+_handlers = {}
+
+
+def init_local_worker():
+    """Makes the Lambda code importable in a worker process and loads both handlers."""
+    for path in ("artifacts/shared_layer/python", "artifacts/search_lambda", "artifacts/index_lambda"):
+        sys.path.insert(0, os.path.join(ROOT, path))
+    # Lambda runs with the function's code directory as its working directory
+    os.chdir(os.path.join(ROOT, "artifacts/index_lambda"))
+    # the handlers log EMF records to stdout, keep the report readable
+    sys.stdout = open(os.devnull, "w")
+    import opensearch_index
+    import opensearch_search
+
+    _handlers["search"] = opensearch_search.handler
+    _handlers["index"] = opensearch_index.handler
+
+
+def invoke_local(handler, event):
+    try:
+        response = _handlers[handler](event, None)
+    except Exception as e:
+        return f"exception: {e}"
+    return classify(response["statusCode"], response["body"])
+
+
+def invoke_api(api_url, token, handler, event):
+    request = urllib.request.Request(
+        api_url.rstrip("/") + event["resource"],
+        data=event["body"].encode("utf-8"),
+        method=event["httpMethod"],
+        headers={"Content-Type": "application/json", "Authorization": token or ""},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return classify(response.status, response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        return classify(e.code, e.read().decode("utf-8", "replace"))
+    except Exception as e:
+        return f"exception: {e}"
+
+
+def parse_mix(mix):
+    """Parses "name=weight,..." into scenario weights, defaulting to SCENARIOS' weights."""
+    if not mix:
+        return {name: scenario[4] for name, scenario in SCENARIOS.items()}
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name}, choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run(executor, invoke, weights, concurrency, rate, duration, max_requests, seed):
+    """
+    Drives the load and returns (results, elapsed seconds), where results maps a
+    scenario to its list of (latency seconds, error or None).
+    """
+    rng = random.Random(seed)
+    names, scenario_weights = zip(*weights.items())
+    results = defaultdict(list)
+    pending = {}
+    sent = 0
+    started = time.perf_counter()
+    next_arrival = started
+
+    def more_to_send(now):
+        if max_requests:
+            return sent < max_requests
+        return now - started < duration
+
+    while True:
+        now = time.perf_counter()
+        more = more_to_send(now)
+        ready = now >= next_arrival if rate else len(pending) < concurrency
+        if more and ready:
+            name = rng.choices(names, scenario_weights)[0]
+            future = executor.submit(invoke, SCENARIOS[name][0], build_event(name, rng))
+            pending[future] = (name, next_arrival if rate else now)
+            sent += 1
+            if rate:
+                next_arrival += 1 / rate
+            continue
+        if not more and not pending:
+            break
+        timeout = max(0.0, next_arrival - now) if rate and more else None
+        if not pending:
+            time.sleep(timeout)
+            continue
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        finished = time.perf_counter()
+        for future in done:
+            name, scheduled = pending.pop(future)
+            try:
+                error = future.result()
+            except Exception as e:
+                error = f"exception: {e}"
+            results[name].append((finished - scheduled, error))
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _ in samples)
+    errors = [error for _, error in samples if error]
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def report(results, elapsed):
+    """Prints a table per scenario plus the total, and returns the same data."""
+    summary = {name: summarize(samples, elapsed) for name, samples in sorted(results.items())}
+    summary["total"] = summarize([sample for samples in results.values() for sample in samples], elapsed)
+    columns = ["requests", "throughput_rps", "error_rate", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    print(f"{'scenario':<24}" + "".join(f"{column:>16}" for column in columns))
+    for name, row in summary.items():
+        print(f"{name:<24}" + "".join(f"{row[column]:>16}" for column in columns))
+
+    error_counts = defaultdict(int)
+    for samples in results.values():
+        for _, error in samples:
+            if error:
+                error_counts[error] += 1
+    if error_counts:
+        print("\nMost frequent errors:")
+        for error, count in sorted(error_counts.items(), key=lambda item: -item[1])[:10]:
+            print(f"{count:>8}  {error}")
+    return {"elapsed_seconds": round(elapsed, 2), "scenarios": summary, "errors": dict(error_counts)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the search and index Lambdas")
+    parser.add_argument("--target", choices=["local", "api"], default="local")
+    parser.add_argument("--api-url", help="API Gateway stage URL, required for --target api")
+    parser.add_argument("--token", default=os.getenv("LOAD_TEST_TOKEN"),
+                        help="Cognito id token for --target api, defaults to $LOAD_TEST_TOKEN")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0,
+                        help="Arrivals per second, 0 sends back to back from --concurrency workers")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run for")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests instead")
+    parser.add_argument("--mix", help="Scenario weights, e.g. multi_match=3,hybrid_search=1")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    parser.add_argument("--emulator", action="store_true",
+                        help="Run --target local against the emulated OpenSearch, Bedrock and S3")
+    parser.add_argument("--catalog", help="Product catalog the emulator loads, see EMULATOR_DATA_FILE")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    if args.emulator:
+        # inherited by the worker processes
+        os.environ["CLIENT_BACKEND"] = "emulator"
+        os.environ.setdefault("S3_BUCKET_NAME", "emulator-bucket")
+        if args.catalog:
+            os.environ["EMULATOR_DATA_FILE"] = os.path.abspath(args.catalog)
+    if args.target == "api":
+        if not args.api_url:
+            parser.error("--api-url is required for --target api")
+        executor = ThreadPoolExecutor(max_workers=args.concurrency)
+        invoke = partial(invoke_api, args.api_url, args.token)
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.concurrency, initializer=init_local_worker)
+        invoke = invoke_local
+
+    with executor:
+        results, elapsed = run(
+            executor, invoke, weights, args.concurrency, args.rate,
+            args.duration, args.requests, args.seed,
+        )
+    summary = report(results, elapsed)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(summary, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
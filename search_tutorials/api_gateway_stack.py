@@ -60,6 +60,15 @@ class APIGWStack(NestedStack):
             )
         )
 
+        # Members may profile searches through POST /search, see PROFILE_ADMIN_GROUP
+        _cognito.CfnUserPoolGroup(
+            self,
+            f"opnsrch-srch-admns-{env_name}",
+            user_pool_id=user_pool.user_pool_id,
+            group_name="search-admins",
+            description="Search administrators, allowed to profile queries",
+        )
+
         # for the user pool created above create a application client
         user_pool_client = _cognito.UserPoolClient(
             self,
@@ -208,7 +217,7 @@ class APIGWStack(NestedStack):
             self,
             f"PSrchAllowLambdaInvoke",
             action="lambda:InvokeFunction",
-            function_name=opensearch_search_lambda.function_name,
+            function_name=opensearch_search_lambda.function_arn,
             principal="apigateway.amazonaws.com",
             source_arn=f"arn:aws:execute-api:{region}:{account_id}:{rest_api.rest_api_id}/*/POST/search",
             source_account=account_id,
@@ -243,8 +252,48 @@ class APIGWStack(NestedStack):
             authorizer=cognito_authorizer,
         )
 
+        search_batch = search.add_resource("batch")
+        search_batch.add_method(
+            "POST",
+            _apigw.LambdaIntegration(opensearch_search_lambda),
+            authorization_type=_apigw.AuthorizationType.COGNITO,
+            authorization_scopes=None,
+            authorizer=cognito_authorizer,
+        )
+
+        _lambda.CfnPermission(
+            self,
+            f"PSrchBatchAllowLambdaInvoke",
+            action="lambda:InvokeFunction",
+            function_name=opensearch_search_lambda.function_arn,
+            principal="apigateway.amazonaws.com",
+            source_arn=f"arn:aws:execute-api:{region}:{account_id}:{rest_api.rest_api_id}/*/POST/search/batch",
+            source_account=account_id,
+        )
+
+        suggest = rest_api.root.add_resource("suggest")
+        suggest.add_method(
+            "POST",
+            _apigw.LambdaIntegration(opensearch_search_lambda),
+            authorization_type=_apigw.AuthorizationType.COGNITO,
+            authorization_scopes=None,
+            authorizer=cognito_authorizer,
+        )
+
+        _lambda.CfnPermission(
+            self,
+            f"PSuggestAllowLambdaInvoke",
+            action="lambda:InvokeFunction",
+            function_name=opensearch_search_lambda.function_arn,
+            principal="apigateway.amazonaws.com",
+            source_arn=f"arn:aws:execute-api:{region}:{account_id}:{rest_api.rest_api_id}/*/POST/suggest",
+            source_account=account_id,
+        )
+
         self.add_cors_options(index)
         self.add_cors_options(search)
+        self.add_cors_options(search_batch)
+        self.add_cors_options(suggest)
         self.add_cors_options(presigned_url)
         self.add_cors_options(index_custom_doc)
         self.add_cors_options(vectorize_index)
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 import aws_cdk as _cdk
 from aws_cdk import (
@@ -8,6 +10,8 @@ from aws_cdk import (
     aws_opensearchservice as _opensearch,
     aws_iam as _iam,
     aws_lambda as _lambda,
+    aws_applicationautoscaling as _appscaling,
+    custom_resources as _cr,
 )
 import aws_cdk as cdk
 from constructs import Construct
@@ -178,6 +182,21 @@ class OpensearchProxyStack(Stack):
             f'arn:aws:lambda:{region}:{account_id}:layer:{env_params["opensearch_utils_layer_name"]}:1',
         )
 
+        # Pooled OpenSearch, Bedrock and S3 clients shared by both Lambdas
+        shared_clients_layer = _lambda.LayerVersion(
+            self,
+            f"opnsrch-shrd-clnts-lyr-{env_name}",
+            code=_lambda.Code.from_asset(
+                os.path.join(os.getcwd(), "artifacts/shared_layer/")
+            ),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            description="Shared, pooled OpenSearch, Bedrock and S3 clients",
+        )
+
+        # Projection artifact in the shared layer both Lambdas project vectors with,
+        # empty for full dimension vectors, see fit_vector_projection.py
+        vector_projection_file = env_params.get("vector_projection_file", "")
+
         opensearch_index_lambda = _lambda.Function(
             self,
             f"opnsrch-indx-{env_name}",
@@ -191,13 +210,16 @@ class OpensearchProxyStack(Stack):
             timeout=_cdk.Duration.seconds(300),
             description="Access to private Opensearch Cluster",
             memory_size=3000,
-            layers=[opensearch_utils_layer],
+            layers=[opensearch_utils_layer, shared_clients_layer],
             vpc=vpc,
             environment={"OPENSEARCH_HOST": domain.domain_endpoint,
                           "S3_BUCKET_NAME": bucket_name,
-                          "BEDROCK_LAMBDA_NAME": env_params["bedrock_lambda_function_name"]},
+                          "BEDROCK_LAMBDA_NAME": env_params["bedrock_lambda_function_name"],
+                          "VECTOR_PROJECTION_FILE": vector_projection_file},
         )
 
+        # "none", "snapstart" or "provisioned", see search_lambda_warm_start in cdk.json
+        search_warm_start = env_params.get("search_lambda_warm_start", "none")
         opensearch_search_lambda = _lambda.Function(
             self,
             f"opnsrch-srch-{env_name}",
@@ -211,10 +233,55 @@ class OpensearchProxyStack(Stack):
             timeout=_cdk.Duration.seconds(300),
             description="Access to private Opensearch Cluster",
             memory_size=3000,
-            layers=[opensearch_utils_layer],
+            layers=[opensearch_utils_layer, shared_clients_layer],
             vpc=vpc,
-            environment={"OPENSEARCH_HOST": domain.domain_endpoint, "S3_BUCKET_NAME": bucket_name},
+            environment={"OPENSEARCH_HOST": domain.domain_endpoint,
+                         "S3_BUCKET_NAME": bucket_name,
+                         "VECTOR_PROJECTION_FILE": vector_projection_file,
+                         # hybrid search fusion, see artifacts/shared_layer/python/search_pipelines.py
+                         "FUSION_STRATEGY": env_params.get("fusion_strategy", "weighted"),
+                         "FUSION_TRAFFIC_SPLIT": json.dumps(env_params.get("fusion_traffic_split", {}))},
+            # SnapStart snapshots the primed init phase of every published version
+            snap_start=_lambda.SnapStartConf.ON_PUBLISHED_VERSIONS
+            if search_warm_start == "snapstart"
+            else None,
         )
+        search_func_arn = opensearch_search_lambda.function_arn
+
+        # API Gateway invokes a "live" alias instead of $LATEST when the search Lambda
+        # is kept warm, since SnapStart and provisioned concurrency only apply to versions
+        if search_warm_start in ("snapstart", "provisioned"):
+            search_alias = _lambda.Alias(
+                self,
+                f"opnsrch-srch-live-{env_name}",
+                alias_name="live",
+                version=opensearch_search_lambda.current_version,
+            )
+            if search_warm_start == "provisioned":
+                concurrency = env_params["search_lambda_provisioned_concurrency"]
+                # Each schedule pins min and max, there is no utilization policy that
+                # would otherwise bring capacity back down after peak hours
+                scaling = search_alias.add_auto_scaling(
+                    min_capacity=concurrency["off_peak"],
+                    max_capacity=concurrency["peak"],
+                )
+                scaling.scale_on_schedule(
+                    f"opnsrch-srch-peak-{env_name}",
+                    schedule=_appscaling.Schedule.cron(
+                        hour=str(concurrency["peak_start_hour_utc"]), minute="0"
+                    ),
+                    min_capacity=concurrency["peak"],
+                    max_capacity=concurrency["peak"],
+                )
+                scaling.scale_on_schedule(
+                    f"opnsrch-srch-off-peak-{env_name}",
+                    schedule=_appscaling.Schedule.cron(
+                        hour=str(concurrency["peak_end_hour_utc"]), minute="0"
+                    ),
+                    min_capacity=concurrency["off_peak"],
+                    max_capacity=concurrency["off_peak"],
+                )
+            search_func_arn = search_alias.function_arn
 
 
         opensearch_access_policy_1 = _iam.PolicyStatement(
@@ -294,12 +361,31 @@ class OpensearchProxyStack(Stack):
             True,
         )
 
+        # Registers the hybrid search pipelines once the index Lambda can reach the
+        # domain, and again whenever their definitions change
+        with open(os.path.join(os.getcwd(), "artifacts/shared_layer/python/search_pipelines.py"), "rb") as pipelines_file:
+            pipelines_hash = hashlib.sha256(pipelines_file.read()).hexdigest()[:16]
+        # The provider fails the deploy when the index Lambda raises, which it does
+        # when a pipeline can't be registered
+        register_pipelines_provider = _cr.Provider(
+            self,
+            f"opnsrch-srch-pplns-prvdr-{env_name}",
+            on_event_handler=opensearch_index_lambda,
+        )
+        register_pipelines = _cdk.CustomResource(
+            self,
+            f"opnsrch-srch-pplns-{env_name}",
+            service_token=register_pipelines_provider.service_token,
+            properties={"action": "register_search_pipelines", "definitions": pipelines_hash},
+        )
+        register_pipelines.node.add_dependency(domain)
+
         api_gw_stack = APIGWStack(
             self,
             f"APIGWOpnsrch{env_name}Stack",
             domain.domain_endpoint,
             opensearch_index_lambda.function_arn,
-            opensearch_search_lambda.function_arn,
+            search_func_arn,
         )
         self.tag_my_stack(api_gw_stack)
 